@@ -0,0 +1,317 @@
+"""
+Local stand-in for a vLLM server, for benchmarking the collection path on a CPU-only box.
+
+Implements what the collectors use:
+- POST /v1/responses: Responses API objects with a `reasoning` item (`reasoning_text`) and an
+  `output_text` message, or the equivalent SSE event stream with `"stream": true`.
+  `max_output_tokens` is honoured (status "incomplete").
+- GET /health, GET /metrics (`vllm:num_requests_running` / `vllm:num_requests_waiting`)
+- GET /stats: request counters for the harness; GET /stats/reset clears them
+
+Latency, response length and failures are drawn per request from the configured distributions.
+`--max_running` emulates a server that only decodes that many requests at once; the rest wait.
+
+Usage:
+    python -m src.bench.mock_server --port 8000 --latency lognormal --latency_mean 2 --error_rate 0.01
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("so the sum of all terms is then we get that this gives a value for x and y where "
+         "since both sides are equal it follows hence the answer must be").split()
+LETTERS = "ABCDEFGHIJ"
+
+
+class MockConfig:
+    def __init__(self, args):
+        self.latency = args.latency
+        self.latency_mean = args.latency_mean
+        self.latency_sigma = args.latency_sigma
+        self.first_token = args.first_token
+        self.reasoning_tokens = args.reasoning_tokens
+        self.answer_tokens = args.answer_tokens
+        self.error_rate = args.error_rate
+        self.disconnect_rate = args.disconnect_rate
+        self.hang_rate = args.hang_rate
+        self.stall_rate = args.stall_rate
+        self.max_running = args.max_running
+        self.rng = random.Random(args.seed)
+        self.rng_lock = threading.Lock()
+
+    def draw(self):
+        """(latency seconds, reasoning tokens, answer tokens, failure kind or None, letter, number) for one request"""
+        with self.rng_lock:
+            rng = self.rng
+            if self.latency == "fixed":
+                latency = self.latency_mean
+            elif self.latency == "uniform":
+                latency = rng.uniform(max(0.0, self.latency_mean - self.latency_sigma), self.latency_mean + self.latency_sigma)
+            elif self.latency == "exponential":
+                latency = rng.expovariate(1 / self.latency_mean) if self.latency_mean > 0 else 0.0
+            else:  # lognormal with the given mean
+                sigma = self.latency_sigma
+                latency = rng.lognormvariate(math.log(max(self.latency_mean, 1e-6)) - sigma ** 2 / 2, sigma)
+            reasoning = max(1, int(rng.expovariate(1 / self.reasoning_tokens))) if self.reasoning_tokens else 0
+            answer = max(1, int(rng.expovariate(1 / self.answer_tokens))) if self.answer_tokens else 1
+            roll = rng.random()
+            failure = None
+            if roll < self.error_rate:
+                failure = "error"
+            elif roll < self.error_rate + self.disconnect_rate:
+                failure = "disconnect"
+            elif roll < self.error_rate + self.disconnect_rate + self.hang_rate:
+                failure = "hang"
+            elif roll < self.error_rate + self.disconnect_rate + self.hang_rate + self.stall_rate:
+                failure = "stall"
+            letter = rng.choice(LETTERS)
+            number = rng.randint(0, 999)
+        return latency, reasoning, answer, failure, letter, number
+
+
+class MockStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.waiting = 0
+        self.reset()
+
+    def reset(self):
+        """清空计数（running / waiting 是当前状态，不清）"""
+        self.requests = 0
+        self.completed = 0
+        self.failed = 0
+        self.aborted = 0
+        self.first_request_at = None
+        self.last_request_at = None
+
+    def snapshot(self):
+        with self.lock:
+            return {k: v for k, v in self.__dict__.items() if k != "lock"}
+
+
+def _text(tokens, offset=0):
+    return "".join(WORDS[(offset + i) % len(WORDS)] + " " for i in range(tokens))
+
+
+def _response_object(model, reasoning, answer, status="completed", output_tokens=0, reasoning_tokens=0, input_tokens=0):
+    return {
+        "id": "resp_mock", "object": "response", "created_at": int(time.time()), "model": model,
+        "status": status,
+        "incomplete_details": {"reason": "max_output_tokens"} if status == "incomplete" else None,
+        "parallel_tool_calls": False, "tool_choice": "auto", "tools": [],
+        "usage": {
+            "input_tokens": input_tokens, "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens_details": {"reasoning_tokens": reasoning_tokens},
+        },
+        "output": [
+            {"type": "reasoning", "id": "rs_mock", "summary": [],
+             "content": [{"type": "reasoning_text", "text": reasoning}]},
+            {"type": "message", "id": "msg_mock", "role": "assistant", "status": "completed",
+             "content": [{"type": "output_text", "text": answer, "annotations": []}]},
+        ],
+    }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: MockConfig = None
+    stats: MockStats = None
+    slots: threading.BoundedSemaphore = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        data = body.encode("utf-8") if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, "", "text/plain")
+        elif self.path == "/metrics":
+            snap = self.stats.snapshot()
+            self._send(200, (
+                f'vllm:num_requests_running{{model_name="mock"}} {float(snap["running"])}\n'
+                f'vllm:num_requests_waiting{{model_name="mock"}} {float(snap["waiting"])}\n'
+            ), "text/plain")
+        elif self.path == "/stats":
+            self._send(200, json.dumps(self.stats.snapshot()))
+        elif self.path == "/stats/reset":
+            with self.stats.lock:
+                self.stats.reset()
+            self._send(200, "{}")
+        else:
+            self._send(404, json.dumps({"error": "not found"}))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length))
+        except json.JSONDecodeError:
+            self._send(400, json.dumps({"error": {"message": "invalid JSON"}}))
+            return
+        if self.path.rstrip("/") != "/v1/responses":
+            self._send(404, json.dumps({"error": {"message": "not found"}}))
+            return
+
+        with self.stats.lock:
+            now = time.time()
+            self.stats.requests += 1
+            self.stats.first_request_at = self.stats.first_request_at or now
+            self.stats.last_request_at = now
+            self.stats.waiting += 1
+        self.slots.acquire()
+        with self.stats.lock:
+            self.stats.waiting -= 1
+            self.stats.running += 1
+        try:
+            self._respond(request)
+        except (BrokenPipeError, ConnectionResetError):
+            with self.stats.lock:
+                self.stats.aborted += 1
+        finally:
+            self.slots.release()
+            with self.stats.lock:
+                self.stats.running -= 1
+
+    def _respond(self, request):
+        latency, reasoning_tokens, answer_tokens, failure, letter, number = self.config.draw()
+        if failure == "error":
+            time.sleep(min(latency, self.config.first_token))
+            with self.stats.lock:
+                self.stats.failed += 1
+            self._send(500, json.dumps({"error": {"message": "mock server error", "type": "InternalServerError"}}))
+            return
+        if failure == "disconnect":
+            time.sleep(min(latency, self.config.first_token))
+            with self.stats.lock:
+                self.stats.failed += 1
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+        if failure == "hang":
+            time.sleep(10 * latency + 60)
+
+        limit = request.get("max_output_tokens") or float("inf")
+        reasoning_tokens = int(min(reasoning_tokens, limit))
+        answer_tokens = int(min(answer_tokens, limit - reasoning_tokens))
+        status = "incomplete" if reasoning_tokens + answer_tokens >= limit else "completed"
+        reasoning = _text(reasoning_tokens)
+        answer = _text(max(0, answer_tokens - 1), offset=reasoning_tokens)
+        if status == "completed":
+            answer += f"\\boxed{{{number}}}\nAnswer: {letter}"
+        output_tokens = reasoning_tokens + answer_tokens
+        input_tokens = len(str(request.get("input", ""))) // 4
+        model = request.get("model", "mock")
+
+        if not request.get("stream"):
+            time.sleep(latency)
+            self._send(200, json.dumps(_response_object(
+                model, reasoning, answer, status, output_tokens, reasoning_tokens, input_tokens)))
+            with self.stats.lock:
+                self.stats.completed += 1
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        sequence = 0
+
+        def event(payload):
+            nonlocal sequence
+            payload["sequence_number"] = sequence
+            sequence += 1
+            self.wfile.write(f"event: {payload['type']}\ndata: {json.dumps(payload)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        event({"type": "response.created", "response": _response_object(model, "", "", "in_progress")})
+        time.sleep(min(latency, self.config.first_token))
+        deltas = [("reasoning", w + " ") for w in reasoning.split(" ") if w]
+        deltas += [("answer", piece) for piece in answer.replace("\n", "\n ").split(" ") if piece]
+        step = max(0.0, latency - self.config.first_token) / max(1, len(deltas))
+        next_at = time.monotonic()
+        stall_at = len(deltas) // 2 if failure == "stall" else None
+        for position, (kind, delta) in enumerate(deltas):
+            if position == stall_at:
+                time.sleep(10 * latency + 60)  # 连接不断，只是不再发事件
+            next_at += step
+            pause = next_at - time.monotonic()
+            if pause > 0.001:
+                time.sleep(pause)
+            if kind == "reasoning":
+                event({"type": "response.reasoning_text.delta", "item_id": "rs_mock", "output_index": 0,
+                       "content_index": 0, "delta": delta})
+            else:
+                event({"type": "response.output_text.delta", "item_id": "msg_mock", "output_index": 1,
+                       "content_index": 0, "delta": delta if delta.endswith("\n") else delta + " ", "logprobs": []})
+        event({"type": f"response.{status}", "response": _response_object(
+            model, reasoning, answer, status, output_tokens, reasoning_tokens, input_tokens)})
+        with self.stats.lock:
+            self.stats.completed += 1
+
+
+def add_server_args(parser):
+    parser.add_argument("--latency", type=str, choices=["fixed", "uniform", "exponential", "lognormal"], default="lognormal",
+                        help="Per-request latency distribution (default: lognormal)")
+    parser.add_argument("--latency_mean", type=float, default=0.5, help="Mean latency in seconds (default: 0.5)")
+    parser.add_argument("--latency_sigma", type=float, default=0.5,
+                        help="Lognormal sigma, or half-width for uniform (default: 0.5)")
+    parser.add_argument("--first_token", type=float, default=0.05, help="Streaming: delay before the first token (default: 0.05)")
+    parser.add_argument("--reasoning_tokens", type=int, default=800, help="Mean reasoning length in tokens (default: 800)")
+    parser.add_argument("--answer_tokens", type=int, default=60, help="Mean final answer length in tokens (default: 60)")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--disconnect_rate", type=float, default=0.0, help="Fraction of requests whose connection is dropped")
+    parser.add_argument("--hang_rate", type=float, default=0.0, help="Fraction of requests that stall far beyond their latency")
+    parser.add_argument("--stall_rate", type=float, default=0.0,
+                        help="Fraction of streamed requests that stop sending events halfway, connection left open")
+    parser.add_argument("--max_running", type=int, default=256,
+                        help="Requests decoded at once; the rest are reported as waiting (default: 256)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # 默认 5，高并发时连接会被拒
+
+
+def make_server(args, host="127.0.0.1"):
+    handler = type("Handler", (MockHandler,), {
+        "config": MockConfig(args),
+        "stats": MockStats(),
+        "slots": threading.BoundedSemaphore(args.max_running),
+    })
+    return MockServer((host, args.port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock vLLM Responses API server for benchmarks.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Bind address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="Port (default: 8000)")
+    add_server_args(parser)
+    args = parser.parse_args()
+
+    server = make_server(args, args.host)
+    print(f"Mock Responses API server on http://{args.host}:{args.port}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
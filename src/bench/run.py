@@ -0,0 +1,242 @@
+"""
+End-to-end benchmark of the collectors against the mock Responses API server.
+
+For every (collector, engine, --max_workers, dataset size) combination the collector is run
+as a subprocess on a synthetic dataset and measured:
+- records/s (written records over wall time) and requests/s as seen by the server
+- CPU use (user + sys of the collector process) and peak RSS
+- startup-to-first-request time (process launch until the server sees the first request)
+
+Results are printed as a table and can be saved with --report; --compare prints the change
+against an earlier report, so regressions and speedups in the collection path can be checked
+on a CPU-only machine.
+
+Usage:
+    python -m src.bench.run --workers 8,32,128 --sizes 200,2000 --latency_mean 0.2 --report bench.json
+"""
+import argparse
+import json
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from src.bench.mock_server import LETTERS, add_server_args
+from src.collect.writer import iter_output_records
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+COLLECTORS = {
+    "dapo": os.path.join(ROOT, "src", "collect", "batch-dapo.py"),
+    "science": os.path.join(ROOT, "src", "collect", "batch-science.py"),
+}
+SERVER_ARGS = ["latency", "latency_mean", "latency_sigma", "first_token", "reasoning_tokens", "answer_tokens",
+               "error_rate", "disconnect_rate", "hang_rate", "max_running", "seed"]
+
+DEFAULT_INST = """Solve the following math problem step by step. The last line of your response should be of the form Answer: $Answer (without quotes) where $Answer is the answer to the problem.\n\n"""
+ORIGINAL_INST = """Remember to put your answer on its own line after "Answer:"."""
+
+
+def _int_list(text):
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def write_dataset(kind, path, size):
+    """合成的 DAPO / science 输入，格式和真实数据一致"""
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(size):
+            if kind == "dapo":
+                record = {
+                    "data_source": "math_dapo",
+                    "prompt": [{"role": "user", "content": f"{DEFAULT_INST}Problem {i}: find the value of {i} * 7 + 3.\n\n{ORIGINAL_INST}"}],
+                    "ability": "MATH",
+                    "reward_model": {"ground_truth": str(i * 7 + 3), "style": "rule-lighteval/MATH_v2"},
+                    "extra_info": {"index": i},
+                }
+            else:
+                options = "\n".join(f"{letter}: option {letter.lower()} for question {i}" for letter in LETTERS)
+                record = {
+                    "input": [{"role": "user", "content": f"Answer the following multiple choice question {i}.\n{options}"}],
+                    "output": f"<think>reasoning</think>The answer is ({LETTERS[i % len(LETTERS)]}).",
+                    "category": "science",
+                    "license": "cc-by-4.0",
+                    "reasoning": "on",
+                    "generator": "bench",
+                    "used_in_training": "",
+                    "version": "v1",
+                    "system_prompt": "",
+                }
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def _get_json(url, timeout=5.0):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read() or b"{}")
+
+
+def start_server(args, port):
+    command = [sys.executable, "-m", "src.bench.mock_server", "--port", str(port)]
+    for name in SERVER_ARGS:
+        command += [f"--{name}", str(getattr(args, name))]
+    server = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            _get_json(f"http://127.0.0.1:{port}/stats", timeout=1.0)
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("mock server did not start")
+
+
+def run_once(args, port, collector, engine, workers, size, dataset, work_dir):
+    output_path = os.path.join(work_dir, f"{collector}-{engine}-{workers}-{size}", "results.jsonl")
+    log_path = os.path.join(work_dir, f"{collector}-{engine}-{workers}-{size}.log")
+    command = [
+        sys.executable, COLLECTORS[collector],
+        "--raw_path", dataset, "--output_path", output_path,
+        "--model_name", "mock", "--port", str(port),
+        "--engine", engine, "--max_workers", str(workers), "--max_lines", str(size),
+        "--health_interval", "0",
+    ] + shlex.split(args.collector_args)
+    env = {**os.environ, "PYTHONPATH": ROOT + os.pathsep + os.environ.get("PYTHONPATH", "")}
+
+    _get_json(f"http://127.0.0.1:{port}/stats/reset")
+    with open(log_path, "w") as log:
+        launched = time.time()
+        process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)  # 单个子进程的 rusage
+        wall = time.time() - launched
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        with open(log_path) as log:
+            tail = log.read()[-2000:]
+        raise RuntimeError(f"{collector} exited with {process.returncode}:\n{tail}")
+
+    stats = _get_json(f"http://127.0.0.1:{port}/stats")
+    records = sum(1 for _ in iter_output_records(output_path))
+    cpu = usage.ru_utime + usage.ru_stime
+    first_request = stats["first_request_at"]
+    return {
+        "collector": collector,
+        "engine": engine,
+        "workers": workers,
+        "size": size,
+        "records": records,
+        "requests": stats["requests"],
+        "server_errors": stats["failed"],
+        "wall_seconds": wall,
+        "records_per_second": records / wall if wall > 0 else 0.0,
+        "requests_per_second": stats["requests"] / wall if wall > 0 else 0.0,
+        "cpu_seconds": cpu,
+        "cpu_percent": 100 * cpu / wall if wall > 0 else 0.0,
+        "peak_rss_mb": usage.ru_maxrss / 1024,  # Linux: KB
+        "startup_seconds": first_request - launched if first_request else None,
+    }
+
+
+def _key(row):
+    return row["collector"], row["engine"], row["workers"], row["size"]
+
+
+def print_table(rows, baseline=None):
+    baseline = {_key(row): row for row in baseline or []}
+    header = (f"{'collector':<9} {'engine':<6} {'workers':>7} {'size':>6} {'records/s':>10} {'req/s':>8} "
+              f"{'cpu%':>6} {'rss MB':>7} {'startup':>8}")
+    if baseline:
+        header += f" {'Δrec/s':>8} {'Δcpu':>7} {'Δrss':>7}"
+    print(header)
+    for row in rows:
+        startup = f"{row['startup_seconds']:.2f}s" if row["startup_seconds"] is not None else "-"
+        line = (f"{row['collector']:<9} {row['engine']:<6} {row['workers']:>7} {row['size']:>6} "
+                f"{row['records_per_second']:>10.1f} {row['requests_per_second']:>8.1f} "
+                f"{row['cpu_percent']:>6.0f} {row['peak_rss_mb']:>7.0f} {startup:>8}")
+        old = baseline.get(_key(row))
+        if old is not None:
+            def change(name):
+                return f"{100 * (row[name] - old[name]) / old[name]:+.0f}%" if old[name] else "-"
+            line += f" {change('records_per_second'):>8} {change('cpu_seconds'):>7} {change('peak_rss_mb'):>7}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the collectors against a local mock vLLM server.")
+    parser.add_argument("--collectors", type=str, default="dapo,science", help="Collectors to run (default: dapo,science)")
+    parser.add_argument("--engines", type=str, default="thread,async", help="Engines to run (default: thread,async)")
+    parser.add_argument("--workers", type=str, default="8,32,128", help="Comma-separated --max_workers values (default: 8,32,128)")
+    parser.add_argument("--sizes", type=str, default="200,1000", help="Comma-separated dataset sizes (default: 200,1000)")
+    parser.add_argument("--collector_args", type=str, default="",
+                        help="Extra arguments passed to every collector run, e.g. \"--stream --compression gzip\"")
+    parser.add_argument("--port", type=int, default=0, help="Mock server port (default: a free port)")
+    parser.add_argument("--report", type=str, default=None, help="Write the results to this JSON file")
+    parser.add_argument("--compare", type=str, default=None, help="Earlier --report to compare against")
+    parser.add_argument("--work_dir", type=str, default=None, help="Keep datasets, outputs and logs here (default: a temp dir)")
+    add_server_args(parser)
+    args = parser.parse_args()
+
+    collectors = [c for c in args.collectors.split(",") if c]
+    for collector in collectors:
+        if collector not in COLLECTORS:
+            parser.error(f"unknown collector {collector!r}, expected one of {list(COLLECTORS)}")
+    engines = [e for e in args.engines.split(",") if e]
+    workers_list, sizes = _int_list(args.workers), _int_list(args.sizes)
+    port = args.port or _free_port()
+
+    temp_dir = None
+    if args.work_dir:
+        work_dir = args.work_dir
+        os.makedirs(work_dir, exist_ok=True)
+    else:
+        temp_dir = tempfile.TemporaryDirectory(prefix="collect-bench-")
+        work_dir = temp_dir.name
+
+    datasets = {}
+    for collector in collectors:
+        datasets[collector] = os.path.join(work_dir, f"{collector}.jsonl")
+        write_dataset(collector, datasets[collector], max(sizes))
+
+    rows = []
+    server = start_server(args, port)
+    try:
+        for collector in collectors:
+            for engine in engines:
+                for size in sizes:
+                    for workers in workers_list:
+                        row = run_once(args, port, collector, engine, workers, size, datasets[collector], work_dir)
+                        rows.append(row)
+                        print(f"{collector} engine={engine} workers={workers} size={size}: "
+                              f"{row['records_per_second']:.1f} records/s, cpu {row['cpu_percent']:.0f}%, "
+                              f"rss {row['peak_rss_mb']:.0f}MB", flush=True)
+    finally:
+        server.terminate()
+        server.wait()
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print()
+    print_table(rows, baseline)
+
+    if args.report:
+        config = {name: getattr(args, name) for name in SERVER_ARGS}
+        config["collector_args"] = args.collector_args
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "results": rows}, f, ensure_ascii=False, indent=2)
+        print(f"\nReport written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
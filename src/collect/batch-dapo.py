@@ -1,117 +1,69 @@
 import argparse
-from src.utils.vllm_backend import get_response
-from tqdm import tqdm
-import json
-import os, re
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from src.collect.cli import add_collector_args, run_collector
+from src.collect.records import DapoRecord, DapoResult
+from src.collect.scoring import extract_boxed
 
 DEFAULT_INST = """Solve the following math problem step by step. The last line of your response should be of the form Answer: $Answer (without quotes) where $Answer is the answer to the problem.\n\n"""
 ORIGINAL_INST = """Remember to put your answer on its own line after "Answer:"."""
 COT_INST = """Let's think step by step and output your final answer within \\boxed{{}}."""
 
-def process_one(record, model_name, port, reasoning_effort):
+def build_prompt(record):
     # 构造新 prompt
-    content = record["prompt"][0]["content"]
-    new_content = content.replace(ORIGINAL_INST, COT_INST).replace(DEFAULT_INST, "")
+    content = record.content
+    return content.replace(ORIGINAL_INST, COT_INST).replace(DEFAULT_INST, "")
 
-    response = get_response(
+def build_result(record, new_content, generation, model_name, reasoning_effort, sample=None):
+    response = generation.text
+    # 原始 record 的字段原样保留（DapoResult 编码时拼进去）+ 新字段
+    standard_answer = record.ground_truth
+    model_answer = extract_boxed(response)
+    return DapoResult(
+        record, new_content, response, model_name, reasoning_effort, model_answer,
+        reward=1.0 if (standard_answer == model_answer and standard_answer != "") else 0.0,
+        truncated=generation.truncated,
+        stop_reason=generation.stop_reason or "completed",
+        sample=sample,
+    )
+
+def process_one(record, model_name, backend, reasoning_effort, idx, sample=None, record_timings=False):
+    # idx 就是 record.index（DapoResult 从 record 里取），签名和 batch-science.py 保持一致
+    new_content = build_prompt(record)
+    
+    # 获取模型回复（backend 负责选择 endpoint）
+    generation = backend.generate(
         new_content,
+        reasoning_effort=reasoning_effort,
         model_name=model_name,
-        port=port,
-        logout=False,
-        reasoning_effort=reasoning_effort
+        sample=sample or 0,
     )
     
-    # 返回原始 record + 新字段
-    updated_record = {**record}
-    updated_record["reasoning_prompt"] = new_content
-    updated_record["gpt-oss-120b-response"] = response
-    updated_record["model_name"] = model_name
-    updated_record["reasoning_effort"] = reasoning_effort
-    standard_answer = record.get("reward_model", {}).get("ground_truth", "")
-    model_answer = re.search(r"\\boxed\{(.*?)\}", response, re.DOTALL)
-    if model_answer:
-        model_answer = model_answer.group(1).strip()
-    else:
-        model_answer = ""
-    updated_record["standard_answer"] = standard_answer
-    updated_record["model_answer"] = model_answer
-    updated_record["reward"] = 1.0 if (standard_answer == model_answer and standard_answer != "") else 0.0
-    return updated_record
-
-def main():
-    parser = argparse.ArgumentParser(description="Run inference with vLLM backend.")
-    parser.add_argument("--raw_path", type=str, required=True, help="Path to input JSONL file")
-    parser.add_argument("--output_path", type=str, required=True, help="Path to output JSONL file")
-    parser.add_argument("--reasoning_effort", type=str, choices=["low", "medium", "high"], default="low",
-                        help="Reasoning effort level (default: low)")
-    parser.add_argument("--max_workers", type=int, default=32, help="Number of threads for concurrent processing (default: 32)")
-    parser.add_argument("--model_name", type=str, required=True, help="Model name/path for vLLM")
-    parser.add_argument("--port", type=int, default=1145, help="vLLM server port (default: 1145)")
-    parser.add_argument("--max_lines", type=int, default=-1, help="Maximum number of lines to process (default: all)")
-
-    args = parser.parse_args()
-
-    raw_path = args.raw_path
-    output_path = args.output_path
-    reasoning_effort = args.reasoning_effort
-    max_workers = args.max_workers
-    model_name = args.model_name
-    port = args.port
-
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    result = build_result(record, new_content, generation, model_name, reasoning_effort, sample)
+    result.cached = generation.cached
+    if record_timings:
+        result.timing = generation.timing()
+    return result
 
-    # Step 1: Load all questions
-    with open(raw_path, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-    if args.max_lines > 0:
-        lines = lines[:args.max_lines]
-    questions = [json.loads(line) for line in lines]
+async def process_one_async(record, model_name, backend, reasoning_effort, idx, sample=None, record_timings=False):
+    new_content = build_prompt(record)
 
-    # Step 2: Build set of already processed indices
-    completed_indices = set()
-    if os.path.exists(output_path):
-        with open(output_path, "r", encoding="utf-8") as f:
-            for line in f:
-                if line.strip():
-                    try:
-                        rec = json.loads(line)
-                        idx = rec.get("extra_info", {}).get("index")
-                        if idx is not None:
-                            completed_indices.add(idx)
-                    except json.JSONDecodeError:
-                        continue  # skip corrupted lines
-
-    # Step 3: Filter out completed
-    pending_questions = [
-        q for q in questions
-        if q.get("extra_info", {}).get("index") not in completed_indices
-    ]
-
-    print(f"Total: {len(questions)}, Already done: {len(completed_indices)}, Pending: {len(pending_questions)}")
-
-    # Step 4: Concurrent processing
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_record = {
-            executor.submit(process_one, record, model_name, port, reasoning_effort): record
-            for record in pending_questions
-        }
+    generation = await backend.generate(
+        new_content,
+        reasoning_effort=reasoning_effort,
+        model_name=model_name,
+        sample=sample or 0,
+    )
 
-        with tqdm(total=len(pending_questions), desc="Processing") as pbar:
-            with open(output_path, "a", encoding="utf-8") as fout:
-                for future in as_completed(future_to_record):
-                    try:
-                        result = future.result()
-                        fout.write(json.dumps(result, ensure_ascii=False) + "\n")
-                        fout.flush()
-                    except Exception as e:
-                        record = future_to_record[future]
-                        idx = record.get("extra_info", {}).get("index", "unknown")
-                        print(f"\nError processing index={idx}: {e}")
-                    finally:
-                        pbar.update(1)
+    result = build_result(record, new_content, generation, model_name, reasoning_effort, sample)
+    result.cached = generation.cached
+    if record_timings:
+        result.timing = generation.timing()
+    return result
 
-    print("All done.")
+def main():
+    parser = argparse.ArgumentParser(description="Run inference with vLLM backend.")
+    add_collector_args(parser)
+    args = parser.parse_args()
+    run_collector(args, DapoRecord.from_dict, process_one, process_one_async, error=parser.error)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,230 @@
+"""
+Sidecar resume index for collector outputs.
+
+`<output>.idx` holds a small header followed by one fixed-size entry per output line:
+(extra_info.index, extra_info.sample, byte offset just past the line). `sample` is 0 for
+single-sample outputs. An index that is not an integer (DAPO ids like "abc-1") is stored as a
+64-bit hash of its canonical JSON (`index_key`), and resume compares keys hashed the same way.
+Loading it is a single read of a few bytes per record instead of `json.loads` over multi-GB
+reasoning traces. The index is only trusted up to the last offset it covers: lines appended
+after that (e.g. the process died before the sidecar was flushed) are scanned and indexed on
+load, and a sidecar that does not match the output at all is rebuilt from scratch. The sidecar
+is only created once there is output to index.
+"""
+import hashlib
+import json
+import os
+import struct
+from array import array
+
+from src.collect.records import loads
+
+MAGIC = b"RIDX\x01\x00\x00\x00"
+ENTRY = struct.Struct("<qqq")
+NO_INDEX = -(2 ** 63)  # 输出里没有 extra_info.index 的行
+
+
+def checkpoint_path(output_path):
+    return output_path + ".idx"
+
+
+def _as_int(value):
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+def index_key(index) -> int:
+    """The int stored for an `extra_info.index`: the index itself, or a 64-bit hash of a non-int one"""
+    if index is None:
+        return NO_INDEX
+    if _as_int(index) is not None:
+        return index
+    canonical = json.dumps(index, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    key = int.from_bytes(hashlib.blake2b(canonical.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+    return key if key != NO_INDEX else NO_INDEX + 1
+
+
+def resume_key(key):
+    """A collector key (index, or (index, sample)) in the form the sidecar stores it"""
+    if isinstance(key, tuple):
+        return (index_key(key[0]),) + key[1:]
+    return index_key(key)
+
+
+def _record_key(record):
+    """(index, sample)；index 经 index_key 转换（没有 index 的行记为 NO_INDEX），没有 sample 的记为 0"""
+    if isinstance(record, dict):
+        extra_info = record.get("extra_info", {})
+        idx, sample = extra_info.get("index"), extra_info.get("sample")
+    else:  # DapoResult / ScienceResult
+        idx, sample = record.resume_key()
+    idx, sample = index_key(idx), _as_int(sample)
+    return idx, sample or 0
+
+
+def truncate_partial_line(output_path) -> int:
+    """如果最后一行没写完（没有换行符），截掉它；返回截掉的字节数"""
+    if not os.path.exists(output_path):
+        return 0
+    with open(output_path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return 0
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return 0
+        # 往回找最后一个换行符
+        pos = size
+        chunk = 1 << 16
+        while pos > 0:
+            start = max(0, pos - chunk)
+            f.seek(start)
+            block = f.read(pos - start)
+            nl = block.rfind(b"\n")
+            if nl >= 0:
+                keep = start + nl + 1
+                break
+            pos = start
+        else:
+            keep = 0
+        f.truncate(keep)
+    print(f"Truncated partially written last line ({size - keep} bytes) from {output_path}")
+    return size - keep
+
+
+class ResumeCheckpoint:
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.path = checkpoint_path(output_path)
+        self.indices = array("q")
+        self.samples = array("q")
+        self.offsets = array("q")
+        self._fout = None
+
+    @property
+    def covered(self) -> int:
+        return self.offsets[-1] if self.offsets else 0
+
+    def read(self) -> bool:
+        """Load entries from the sidecar; False if it is missing or not a resume index"""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "rb") as f:
+            data = f.read()
+        if not data.startswith(MAGIC):
+            return False
+        body = data[len(MAGIC):]
+        body = body[:len(body) - len(body) % ENTRY.size]  # 忽略写了一半的条目
+        entries = array("q")
+        entries.frombytes(body)
+        self.indices = entries[0::3]
+        self.samples = entries[1::3]
+        self.offsets = entries[2::3]
+        return True
+
+    def _scan(self, start):
+        """从 start 字节开始扫描输出文件，补上 sidecar 缺的条目"""
+        with open(self.output_path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                offset += len(line)
+                key = NO_INDEX, 0
+                if line.strip():
+                    try:
+                        key = _record_key(loads(line))
+                    except ValueError:  # JSONDecodeError
+                        pass  # skip corrupted lines
+                self.indices.append(key[0])
+                self.samples.append(key[1])
+                self.offsets.append(offset)
+
+    def save(self):
+        """Atomically rewrite the sidecar from the in-memory entries"""
+        entries = array("q", bytes(len(self.indices) * ENTRY.size))
+        entries[0::3] = self.indices
+        entries[1::3] = self.samples
+        entries[2::3] = self.offsets
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(entries.tobytes())
+        os.replace(tmp_path, self.path)
+
+    def _on_line_boundary(self, offset) -> bool:
+        if offset == 0:
+            return True
+        with open(self.output_path, "rb") as f:
+            f.seek(offset - 1)
+            return f.read(1) == b"\n"
+
+    def load(self) -> set:
+        """Return completed indices, repairing the output tail and the sidecar if needed"""
+        truncate_partial_line(self.output_path)
+        output_size = os.path.getsize(self.output_path) if os.path.exists(self.output_path) else 0
+
+        loaded = self.read()
+        if not loaded or self.covered > output_size or not self._on_line_boundary(self.covered):
+            # sidecar 缺失或和输出对不上：从头重建
+            if loaded:
+                print(f"Resume index {self.path} is stale, rebuilding from {self.output_path}")
+            self.indices, self.samples, self.offsets = array("q"), array("q"), array("q")
+            if output_size:
+                self._scan(0)
+                self.save()
+            elif os.path.exists(self.path):
+                os.remove(self.path)  # 输出是空的；sidecar 等真正写了东西再建
+        elif self.covered < output_size:
+            self._scan(self.covered)
+            self.save()
+
+        return self.completed()
+
+    def completed(self) -> set:
+        """Index keys (`index_key`) whose sample 0 is done (every line of a single-sample output)"""
+        completed = {idx for idx, sample in zip(self.indices, self.samples) if sample == 0}
+        completed.discard(NO_INDEX)
+        return completed
+
+    def completed_samples(self) -> set:
+        """(index key, sample) pairs that are done"""
+        return {key for key in zip(self.indices, self.samples) if key[0] != NO_INDEX}
+
+    def _is_current(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+
+    def open(self):
+        if self._fout is None:
+            if not self._is_current():
+                self.read()
+                self.save()
+            self._fout = open(self.path, "ab")
+        return self
+
+    def add(self, result, end_offset):
+        """只记在内存里（压缩分片关闭时再 save）"""
+        idx, sample = _record_key(result)
+        self.indices.append(idx)
+        self.samples.append(sample)
+        self.offsets.append(end_offset)
+
+    def record(self, result, end_offset):
+        """输出文件写完一行（并 flush）后调用"""
+        self._fout.write(ENTRY.pack(*_record_key(result), end_offset))
+
+    def flush(self):
+        if self._fout is not None:
+            self._fout.flush()
+
+    def close(self):
+        if self._fout is not None:
+            self._fout.close()
+            self._fout = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
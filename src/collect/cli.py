@@ -0,0 +1,341 @@
+"""
+Command line and run wiring shared by the batch collectors (batch-dapo.py, batch-science.py).
+
+A collector only supplies what depends on its dataset: how an input row is parsed into a typed
+record, and how one record is prompted and scored. Everything else (endpoints, concurrency,
+cache, budgets, retries, resume, sharding, effort ladder, output, metrics) is set up here from
+the flags `add_collector_args` registers.
+"""
+import os
+
+from src.collect.columnar import FORMATS as COLUMNAR_FORMATS, export_columnar, require_pyarrow
+from src.collect.ladder import EffortLadder, load_ladder_progress, parse_ladder
+from src.collect.multinode import parse_shard, select_shard
+from src.collect.retry import DeadLetter, RetryPolicy, dead_letter_path, finish_retry, take_dead_letter
+from src.collect.runner import (
+    ENGINES, Hedger, ResumeFilter, expand_samples, iter_jsonl, load_completed_indices, load_completed_samples, parse_records,
+    reject_to, run_async, run_threaded,
+)
+from src.collect.schedule import SCHEDULES, load_cost_history, order_longest_first
+from src.collect.scoring import final_answer_ready, passk_path, summarize_pass_at_k
+from src.collect.writer import COMPRESSIONS, ResultWriter, iter_output_records
+from src.utils.concurrency import AdaptiveConcurrency
+from src.utils.endpoints import EndpointPool, parse_endpoints
+from src.utils.metrics import RunMetrics
+from src.utils.response_cache import ResponseCache
+from src.utils.vllm_backend import AsyncVLLMBackend, configure_backend, parse_effort_budget
+
+
+def add_collector_args(parser):
+    """Register the flags every collector shares"""
+    parser.add_argument("--raw_path", type=str, required=True, help="Path to input JSONL file")
+    parser.add_argument("--output_path", type=str, required=True, help="Path to output JSONL file")
+    parser.add_argument("--reasoning_effort", type=str, choices=["low", "medium", "high"], default="low",
+                        help="Reasoning effort level (default: low)")
+    parser.add_argument("--max_workers", type=int, default=32,
+                        help="Number of threads, or in-flight requests with --engine async (default: 32)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Adapt in-flight requests between --min_workers and --max_workers from latency, "
+                             "errors and the servers' waiting queue")
+    parser.add_argument("--min_workers", type=int, default=8, help="Lower bound (and start) for --adaptive (default: 8)")
+    parser.add_argument("--max_waiting", type=int, default=16,
+                        help="Shrink concurrency when more requests than this wait in the vLLM queues (default: 16)")
+    parser.add_argument("--engine", type=str, choices=ENGINES, default="thread",
+                        help="Concurrency engine: thread pool or asyncio (default: thread)")
+    parser.add_argument("--model_name", type=str, required=True, help="Model name/path for vLLM")
+    parser.add_argument("--port", type=int, default=1145, help="vLLM server port (default: 1145)")
+    parser.add_argument("--endpoints", type=str, default=None,
+                        help="Comma-separated host:port list of vLLM servers, overrides --port (default: localhost:port)")
+    parser.add_argument("--health_interval", type=float, default=10.0,
+                        help="Seconds between endpoint health checks, 0 to disable (default: 10)")
+    parser.add_argument("--max_failures", type=int, default=3,
+                        help="Consecutive failures before an endpoint is ejected (default: 3)")
+    parser.add_argument("--num_samples", type=int, default=1,
+                        help="Responses per prompt; samples of a prompt are sent together so vLLM's prefix cache "
+                             "shares the prefill, resume is tracked per (index, sample) (default: 1)")
+    parser.add_argument("--shard", type=str, default=None,
+                        help="i/N: only process the records whose index hashes to shard i (0-based) of N, for "
+                             "multi-node runs; give each node its own --output_path and merge with src.collect.multinode")
+    parser.add_argument("--max_lines", type=int, default=-1, help="Maximum number of lines to process (default: all)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read the input lazily instead of loading it up front (no pending total in the progress bar)")
+    parser.add_argument("--window", type=int, default=-1,
+                        help="Maximum number of outstanding records (default: 2 * max_workers)")
+    parser.add_argument("--flush_interval", type=float, default=1.0,
+                        help="Seconds between output group commits (default: 1.0)")
+    parser.add_argument("--flush_records", type=int, default=64,
+                        help="Commit output after this many records even before --flush_interval (default: 64)")
+    parser.add_argument("--shard_size_mb", type=float, default=0,
+                        help="Roll output into shards of this many uncompressed MB (default: 0, single file)")
+    parser.add_argument("--compression", type=str, choices=list(COMPRESSIONS), default="none",
+                        help="Compress output shards (implies sharded output, default: none)")
+    parser.add_argument("--cache_path", type=str, default=None,
+                        help="SQLite response cache; identical prompts are answered from it and coalesced in flight")
+    parser.add_argument("--cache_max_gb", type=float, default=50.0,
+                        help="Evict least recently used cache entries above this size (default: 50)")
+    parser.add_argument("--stream_generation", action="store_true",
+                        help="Consume responses incrementally (implied by --time_budget and --early_stop)")
+    parser.add_argument("--token_budget", type=str, default=None,
+                        help="max_output_tokens per effort, e.g. low=8192,high=32768, or one value for all (default: none)")
+    parser.add_argument("--time_budget", type=str, default=None,
+                        help="Wall-clock seconds per response by effort, e.g. low=120,high=1200; "
+                             "the request is aborted and recorded as truncated (default: none)")
+    parser.add_argument("--early_stop", action="store_true",
+                        help="Stop generating once the final answer has a closed \\boxed{} or an 'Answer: X' line")
+    parser.add_argument("--metrics_json", type=str, default=None,
+                        help="Periodically write a JSON summary of request metrics here (latency percentiles, tok/s, errors)")
+    parser.add_argument("--metrics_prom", type=str, default=None,
+                        help="Periodically write the same metrics in Prometheus text format here")
+    parser.add_argument("--metrics_interval", type=float, default=30.0,
+                        help="Seconds between metrics dumps (default: 30)")
+    parser.add_argument("--record_timings", action="store_true",
+                        help="Add per-record timing and token usage fields (`timing`) to the output")
+    parser.add_argument("--columnar_dir", type=str, default=None,
+                        help="After the run, export the whole output as a partitioned Parquet/Arrow dataset here "
+                             "(scalar and text columns split, see src/collect/columnar.py)")
+    parser.add_argument("--columnar_format", type=str, choices=list(COLUMNAR_FORMATS), default="parquet",
+                        help="Format for --columnar_dir (default: parquet)")
+    parser.add_argument("--max_attempts", type=int, default=5,
+                        help="Attempts per record for connection errors, timeouts and 5xx, with jittered exponential "
+                             "backoff; 1 disables retries (default: 5)")
+    parser.add_argument("--retry_base_delay", type=float, default=1.0,
+                        help="Backoff after the first failed attempt, doubled per attempt (default: 1.0s)")
+    parser.add_argument("--retry_max_delay", type=float, default=60.0, help="Upper bound of the backoff (default: 60s)")
+    parser.add_argument("--dead_letter_path", type=str, default=None,
+                        help="Records that fail for good are appended here with the error (default: <output>.failed.jsonl)")
+    parser.add_argument("--retry_failed", action="store_true",
+                        help="Only reprocess the records in the dead-letter file (same --num_samples as the original run)")
+    parser.add_argument("--effort_ladder", type=str, default=None,
+                        help="Escalate reasoning effort, e.g. low,medium,high: each prompt starts at the first level "
+                             "and is resubmitted at the next one only while its reward is 0; every attempt is written "
+                             "with its effort (overrides --reasoning_effort)")
+    parser.add_argument("--schedule", type=str, choices=SCHEDULES, default="file",
+                        help="Submission order: input file order, or longest_first by predicted cost so the slowest "
+                             "records do not end up in the tail of the run (default: file)")
+    parser.add_argument("--cost_history", type=str, nargs="*", default=[],
+                        help="Earlier outputs (plain or sharded) whose output tokens per extra_info.index predict the "
+                             "cost for --schedule longest_first; other records are predicted from prompt length")
+    parser.add_argument("--hedge_after", type=float, default=0,
+                        help="With --engine async: once the input is exhausted, re-issue records running longer than this "
+                             "many times the median latency to another endpoint, keep the first result and cancel the "
+                             "other (default: 0, off)")
+    parser.add_argument("--pool_size", type=int, default=-1, help="Keep-alive connections per endpoint (default: max_workers)")
+    parser.add_argument("--request_timeout", type=float, default=3600.0, help="Per-request read timeout in seconds (default: 3600)")
+    parser.add_argument("--keepalive_expiry", type=float, default=60.0, help="Idle keep-alive connection expiry in seconds (default: 60)")
+
+
+def run_collector(args, parse_record, process_one, process_one_async, error=None):
+    """
+    Run a collector end to end from the parsed `add_collector_args` flags.
+
+    `parse_record(raw)` turns an input row into a typed record (RecordError rejects it to the
+    dead-letter file); records are keyed by `record.index`, or their line number when it is None.
+    `process_one(record, model_name, backend, reasoning_effort, idx, sample, record_timings)`
+    generates and scores one record and returns its result; `process_one_async` is the same
+    coroutine for --engine async. `error(message)` reports invalid flag combinations
+    (parser.error; default: raise ValueError).
+    """
+    if error is None:
+        def error(message):
+            raise ValueError(message)
+    shard = None
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            error(str(e))
+    ladder_levels = None
+    if args.effort_ladder:
+        try:
+            ladder_levels = parse_ladder(args.effort_ladder)
+        except ValueError as e:
+            error(str(e))
+        if args.hedge_after > 0:
+            error("--hedge_after cannot be combined with --effort_ladder (a hedge would redo the lower levels)")
+    if args.hedge_after > 0 and args.engine != "async":
+        # 线程打断不了：输掉的请求会一直跑到结束，进程退出也得等它
+        error("--hedge_after needs --engine async (a losing thread attempt cannot be aborted)")
+    if args.stream and args.schedule != "file":
+        error("--schedule longest_first needs the whole input, it cannot be combined with --stream")
+    if args.columnar_dir:
+        require_pyarrow()  # 在跑几个小时之前就报错
+
+    raw_path = args.raw_path
+    output_path = args.output_path
+    reasoning_effort = args.reasoning_effort
+    max_workers = args.max_workers
+    model_name = args.model_name
+    port = args.port
+    pool_size = args.pool_size if args.pool_size > 0 else max_workers
+    endpoints = EndpointPool(
+        parse_endpoints(args.endpoints, port),
+        max_failures=args.max_failures,
+        health_interval=args.health_interval,
+    )
+
+    controller = None
+    if args.adaptive:
+        controller = AdaptiveConcurrency(
+            initial=args.min_workers,
+            min_limit=args.min_workers,
+            max_limit=max_workers,
+            max_waiting=args.max_waiting,
+            metrics_urls=[ep.metrics_url for ep in endpoints.endpoints],
+        )
+
+    cache = None
+    if args.cache_path:
+        cache = ResponseCache(args.cache_path, max_bytes=int(args.cache_max_gb * 1024 ** 3))
+
+    metrics = RunMetrics(json_path=args.metrics_json, prom_path=args.metrics_prom, interval=args.metrics_interval)
+
+    backend_kwargs = dict(
+        model_name=model_name,
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=args.keepalive_expiry,
+        timeout=args.request_timeout,
+        endpoints=endpoints,
+        cache=cache,
+        max_output_tokens=parse_effort_budget(args.token_budget, int),
+        time_budget=parse_effort_budget(args.time_budget, float),
+        early_stop=final_answer_ready if args.early_stop else None,
+        stream=args.stream_generation,
+        metrics=metrics,
+        # 重试交给 RetryPolicy（会换 endpoint、带退避），不在同一个 client 里再叠加 openai 的重试
+        max_retries=0 if args.max_attempts > 1 else 2,
+    )
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    # Step 1: Build set of already processed indices ((index, sample) pairs with --num_samples)
+    # (--effort_ladder: done once an attempt passed or the last level was tried)
+    num_samples = args.num_samples
+    ladder_start = None
+    if ladder_levels:
+        completed_indices, ladder_start = load_ladder_progress(output_path, ladder_levels, num_samples)
+        print(f"Effort ladder {ladder_levels}: {len(ladder_start)} prompts continue at a higher level")
+    elif num_samples > 1:
+        completed_indices = load_completed_samples(output_path)
+    else:
+        completed_indices = load_completed_indices(output_path)
+
+    # Step 2: Read and validate questions lazily; malformed ones go straight to the dead-letter file
+    # (--retry_failed: only the dead-letter records, already keyed)
+    failed_path = args.dead_letter_path or dead_letter_path(output_path)
+    dead_letter = DeadLetter(failed_path)
+    reject = reject_to(dead_letter)
+    if args.retry_failed:
+        failed = take_dead_letter(failed_path)
+        print(f"Retrying {len(failed)} dead-letter records from {failed_path}")
+        questions = parse_records(failed, parse_record, reject)
+    else:
+        records = parse_records(enumerate(iter_jsonl(raw_path, args.max_lines, keep_invalid=True)), parse_record, reject)
+        # key 是 extra_info.index；没有的（早期的科学题输入）用行号
+        questions = ((position if record.index is None else record.index, record) for position, record in records)
+
+        if num_samples > 1:
+            questions = expand_samples(questions, num_samples)
+
+    if shard is not None:
+        questions = select_shard(questions, *shard)  # 同一题的样本哈希到同一个 shard
+
+    # Step 3: Filter out completed (keys are extra_info.index, or line numbers for inputs without it)
+    resume_filter = ResumeFilter(completed_indices)
+    pending_questions = resume_filter(questions)
+    total = None
+    if args.stream:
+        print(f"Already done: {len(completed_indices)}, streaming input")
+    else:
+        pending_questions = list(pending_questions)
+        total = len(pending_questions)
+        if args.schedule == "longest_first":
+            pending_questions = order_longest_first(pending_questions, load_cost_history(args.cost_history))
+        print(f"Total: {resume_filter.total}, Already done: {len(completed_indices)}, Pending: {total}")
+
+    # Step 4: Concurrent processing
+    retry = RetryPolicy(args.max_attempts, args.retry_base_delay, args.retry_max_delay)
+    hedger = Hedger(args.hedge_after) if args.hedge_after > 0 else None
+    writer = ResultWriter(
+        output_path,
+        flush_interval=args.flush_interval,
+        flush_records=args.flush_records,
+        shard_size=int(args.shard_size_mb * 1024 * 1024),
+        compression=args.compression,
+        metrics=metrics,
+    ).start()
+    ladder = EffortLadder(ladder_levels, writer, ladder_start) if ladder_levels else None
+    metrics.start()
+    endpoints.start()
+    if controller is not None:
+        controller.start()
+    try:
+        if args.engine == "async":
+            backend = AsyncVLLMBackend(**backend_kwargs)
+
+            async def process_fn(key, record):
+                idx, sample = key if num_samples > 1 else (key, None)
+
+                def attempt(effort):
+                    return process_one_async(record, model_name, backend, effort, idx, sample, args.record_timings)
+
+                if ladder is None:
+                    return await attempt(reasoning_effort)
+                return await ladder.run_async(key, attempt)
+
+            run_async(pending_questions, process_fn, writer, max_workers,
+                      window=args.window, total=total, backend=backend, controller=controller,
+                      retry=retry, dead_letter=dead_letter, hedger=hedger)
+        else:
+            backend = configure_backend(**backend_kwargs)
+
+            def process_fn(key, record):
+                idx, sample = key if num_samples > 1 else (key, None)
+
+                def attempt(effort):
+                    return process_one(record, model_name, backend, effort, idx, sample, args.record_timings)
+
+                if ladder is None:
+                    return attempt(reasoning_effort)
+                return ladder.run(key, attempt)
+
+            run_threaded(pending_questions, process_fn, writer, max_workers,
+                         window=args.window, total=total, controller=controller,
+                         retry=retry, dead_letter=dead_letter)
+    finally:
+        writer.close()
+        dead_letter.close()
+        metrics.stop()
+        endpoints.stop()
+        if cache is not None:
+            print(f"\nResponse cache: {cache.stats()}")
+            cache.close()
+        if controller is not None:
+            controller.stop()
+            print(f"\nFinal concurrency: {controller.limit}")
+    if len(endpoints.endpoints) > 1:
+        print(endpoints.summary())
+    print(metrics.summary())
+    if retry.retried:
+        print(f"Retried: {dict(retry.retried)}")
+    if ladder is not None:
+        print(ladder.summary())
+    if hedger is not None:
+        print(hedger.summary())
+    print(dead_letter.summary())
+    if args.retry_failed:
+        finish_retry(failed_path)
+
+    if args.stream:
+        print(f"Total: {resume_filter.total}, Skipped (already done): {resume_filter.skipped}")
+    if num_samples > 1:
+        summary_path = passk_path(output_path)
+        summary = summarize_pass_at_k(iter_output_records(output_path), num_samples, summary_path)
+        prompts = summary.pop("prompts")
+        print(f"pass@k over {prompts} prompts: "
+              + ", ".join(f"{key}={mean:.4f}" + (f" ({n} prompts)" if n != prompts else "")
+                          for key, (mean, n) in summary.items()) + f" (per prompt: {summary_path})")
+    if args.columnar_dir:
+        rows = export_columnar(iter_output_records(output_path), args.columnar_dir, args.columnar_format)
+        print(f"Exported {rows} records to {args.columnar_dir} ({args.columnar_format})")
+    print("All done.")
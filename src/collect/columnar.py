@@ -0,0 +1,235 @@
+"""
+Export collector outputs as partitioned Parquet / Arrow datasets for analytics.
+
+Each record is split into two tables written side by side under `--output_dir`:
+- `scalars/`: small columns (index, sample, model_name, reasoning_effort, reward, stop_reason,
+  extracted answers, prompt / response / reasoning lengths, token counts, ...)
+- `text/`: the large ones (prompt, response, and every remaining field as one JSON string)
+Both are hive-partitioned by --partition_by (default `model_name/reasoning_effort/reward`), and
+row i of a scalars file is row i of the text file next to it (`row_id` is shared), so filters and
+aggregations only touch the scalar files, and texts are read for the selected partitions only:
+
+    import pyarrow.dataset as ds
+    scalars = ds.dataset("out/columnar/scalars", partitioning="hive")
+    scalars.to_table(columns=["model_name", "response_chars"], filter=ds.field("reward") == 1)
+
+The input is streamed (any layout `iter_output_records` reads); memory is bounded by
+--row_group_size rows per partition. An existing export in --output_dir is replaced.
+
+Usage:
+    python -m src.collect.columnar --inputs output/results.jsonl --output_dir output/columnar
+"""
+import argparse
+import json
+import os
+import shutil
+from urllib.parse import quote
+
+from src.collect.writer import iter_output_records
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # only needed for the columnar export
+    pa = pq = None
+
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+TABLES = ("scalars", "text")
+DEFAULT_PARTITIONS = ("model_name", "reasoning_effort", "reward")
+
+# (name, pyarrow type)
+SCALAR_FIELDS = [
+    ("row_id", "int64"),
+    ("index", "string"),  # DAPO 的 index 不一定是整数，统一存字符串
+    ("sample", "int64"),
+    ("data_source", "string"),
+    ("ability", "string"),
+    ("category", "string"),
+    ("model_name", "string"),
+    ("reasoning_effort", "string"),
+    ("reward", "float64"),
+    ("truncated", "bool_"),
+    ("stop_reason", "string"),
+    ("standard_answer", "string"),
+    ("model_answer", "string"),
+    ("original_label", "string"),
+    ("new_label", "string"),
+    ("prompt_chars", "int64"),
+    ("response_chars", "int64"),
+    ("reasoning_chars", "int64"),
+    ("input_tokens", "int64"),
+    ("output_tokens", "int64"),
+    ("reasoning_tokens", "int64"),
+    ("latency", "float64"),
+]
+TEXT_FIELDS = [
+    ("row_id", "int64"),
+    ("prompt", "string"),
+    ("response", "string"),
+    ("extra", "string"),  # 其余字段（原始 prompt、messages 之外的元数据等）的 JSON
+]
+SCALAR_COLUMNS = [name for name, _ in SCALAR_FIELDS]
+# 拆到列里的字段，不再重复进 extra
+_CONSUMED = set(SCALAR_COLUMNS) | {
+    "reasoning_prompt", "gpt-oss-120b-response", "messages", "extra_info", "timing", "label",
+}
+_TIMING_FIELDS = ("input_tokens", "output_tokens", "reasoning_tokens", "latency")
+
+
+def _text_or_none(value):
+    if value is None:
+        return None
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+
+def _prompt_and_response(record):
+    if "gpt-oss-120b-response" in record:
+        return record.get("reasoning_prompt") or "", record.get("gpt-oss-120b-response") or ""
+    prompt = response = ""
+    for message in record.get("messages", []):
+        if message.get("role") == "user":
+            prompt = message.get("content") or ""
+        elif message.get("role") == "assistant":
+            response = message.get("content") or ""
+    return prompt, response
+
+
+def split_record(record, row_id):
+    """One collector record -> (scalar row, text row)"""
+    prompt, response = _prompt_and_response(record)
+    reasoning = response.split("</think>", 1)[0].replace("<think>", "", 1) if "</think>" in response else ""
+    extra_info = record.get("extra_info") or {}
+    timing = record.get("timing") or {}
+    index = extra_info.get("index")
+    scalars = {
+        "row_id": row_id,
+        "index": None if index is None else str(index),
+        "sample": extra_info.get("sample", 0),
+        "prompt_chars": len(prompt),
+        "response_chars": len(response),
+        "reasoning_chars": len(reasoning),
+    }
+    for name in ("data_source", "ability", "category", "model_name", "reasoning_effort", "stop_reason",
+                 "standard_answer", "model_answer", "original_label", "new_label"):
+        scalars[name] = _text_or_none(record.get(name))
+    scalars["reward"] = record.get("reward")
+    scalars["truncated"] = record.get("truncated")
+    for name in _TIMING_FIELDS:
+        scalars[name] = timing.get(name)
+    extra = {key: value for key, value in record.items() if key not in _CONSUMED}
+    extra_info_rest = {key: value for key, value in extra_info.items() if key not in ("index", "sample")}
+    if extra_info_rest:
+        extra["extra_info"] = extra_info_rest
+    text = {
+        "row_id": row_id,
+        "prompt": prompt,
+        "response": response,
+        "extra": json.dumps(extra, ensure_ascii=False) if extra else None,
+    }
+    return scalars, text
+
+
+def _partition_value(value):
+    if value is None:
+        return "__HIVE_DEFAULT_PARTITION__"  # pyarrow 的 hive 分区默认的 null 值
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # reward=1 而不是 reward=1.0，读回来推断成整数分区
+    return quote(str(value), safe="")  # model_name 里可能有 "/"
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("columnar export needs the `pyarrow` package: pip install pyarrow")
+
+
+def _schema(fields, exclude=()):
+    return pa.schema([(name, getattr(pa, kind)()) for name, kind in fields if name not in exclude])
+
+
+class _Partition:
+    """Buffered writers for one partition directory (scalars + text files)"""
+
+    def __init__(self, output_dir, relative_dir, fmt, schemas):
+        self.writers = []
+        self.schemas = schemas
+        self.buffers = ([], [])
+        for table, schema in zip(TABLES, schemas):
+            directory = os.path.join(output_dir, table, relative_dir)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, "part-00000" + FORMATS[fmt])
+            if fmt == "parquet":
+                writer = pq.ParquetWriter(path, schema, compression="zstd")
+            else:
+                writer = pa.ipc.new_file(path, schema)
+            self.writers.append(writer)
+
+    def add(self, scalars, text):
+        self.buffers[0].append(scalars)
+        self.buffers[1].append(text)
+
+    def flush(self):
+        for writer, schema, buffer in zip(self.writers, self.schemas, self.buffers):
+            if buffer:
+                writer.write_table(pa.Table.from_pylist(buffer, schema=schema))
+                buffer.clear()
+
+    def close(self):
+        self.flush()
+        for writer in self.writers:
+            writer.close()
+
+
+def export_columnar(records, output_dir, fmt="parquet", partition_by=DEFAULT_PARTITIONS, row_group_size=10000):
+    """Write records (an iterable of collector output dicts) as a columnar dataset; returns the row count"""
+    require_pyarrow()
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r}, expected one of {list(FORMATS)}")
+    unknown = [name for name in partition_by if name not in SCALAR_COLUMNS or name == "row_id"]
+    if unknown:
+        raise ValueError(f"cannot partition by {unknown}, pick scalar columns")
+    for table in TABLES:
+        shutil.rmtree(os.path.join(output_dir, table), ignore_errors=True)
+    # 分区列只出现在目录名里，不写进文件
+    schemas = (_schema(SCALAR_FIELDS, partition_by), _schema(TEXT_FIELDS))
+
+    partitions = {}
+    rows = 0
+    try:
+        for record in records:
+            scalars, text = split_record(record, rows)
+            key = tuple(scalars.pop(name) for name in partition_by)
+            partition = partitions.get(key)
+            if partition is None:
+                relative_dir = os.path.join(*(f"{name}={_partition_value(value)}" for name, value in zip(partition_by, key))) \
+                    if partition_by else ""
+                partition = partitions[key] = _Partition(output_dir, relative_dir, fmt, schemas)
+            partition.add(scalars, text)
+            if len(partition.buffers[0]) >= row_group_size:
+                partition.flush()
+            rows += 1
+    finally:
+        for partition in partitions.values():
+            partition.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export collector outputs as partitioned Parquet / Arrow datasets.")
+    parser.add_argument("--inputs", type=str, nargs="+", required=True,
+                        help="Collector output files (plain, or the --output_path of a sharded run)")
+    parser.add_argument("--output_dir", type=str, required=True, help="Dataset directory (scalars/ and text/ are replaced)")
+    parser.add_argument("--format", type=str, choices=list(FORMATS), default="parquet",
+                        help="parquet (compressed, predicate pushdown) or arrow (IPC files, memory-mappable) (default: parquet)")
+    parser.add_argument("--partition_by", type=str, default=",".join(DEFAULT_PARTITIONS),
+                        help=f"Comma-separated scalar columns to partition by, empty for none (default: {','.join(DEFAULT_PARTITIONS)})")
+    parser.add_argument("--row_group_size", type=int, default=10000, help="Rows per row group / record batch (default: 10000)")
+    args = parser.parse_args()
+
+    partition_by = tuple(name for name in args.partition_by.split(",") if name)
+    records = (record for path in args.inputs for record in iter_output_records(path))
+    rows = export_columnar(records, args.output_dir, args.format, partition_by, args.row_group_size)
+    print(f"Exported {rows} records to {args.output_dir} ({args.format}, partitioned by {list(partition_by)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Reasoning-effort escalation for the collectors (--effort_ladder low,medium,high).
+
+Every prompt (every sample with --num_samples) is first generated at the cheapest level and
+resubmitted at the next level only while its reward is 0, so high effort is spent on the
+problems low effort gets wrong. Each attempt is written as its own output line with its
+`reasoning_effort`; a failed attempt is written as soon as it is scored, before the next level
+is requested.
+
+Resume reads the attempts back from the output: a prompt is done once an attempt passed or the
+last level was tried, otherwise it continues at the level after the highest one it reached.
+The output is first loaded through the resume index like any other run (a partial last line
+left by a crash is cut off, the sidecar is brought up to date); the attempts are then read with
+one JSON decode per line, since the `.idx` sidecar has no effort or reward.
+"""
+import threading
+from collections import Counter
+
+from src.collect.checkpoint import resume_key
+from src.collect.writer import iter_output_records, load_completed_samples
+
+EFFORTS = ["low", "medium", "high"]
+
+
+def parse_ladder(spec: str) -> list:
+    """'low,medium,high' -> ['low', 'medium', 'high'] (strictly increasing effort)"""
+    levels = [level.strip() for level in spec.split(",") if level.strip()]
+    unknown = [level for level in levels if level not in EFFORTS]
+    if unknown:
+        raise ValueError(f"unknown reasoning effort(s) {unknown} in effort ladder {spec!r}, expected {EFFORTS}")
+    if not levels or [EFFORTS.index(level) for level in levels] != sorted({EFFORTS.index(level) for level in levels}):
+        raise ValueError(f"effort ladder {spec!r} must list distinct levels from low to high")
+    return levels
+
+
+def _passed(reward) -> bool:
+    return isinstance(reward, (int, float)) and reward > 0
+
+
+def load_ladder_progress(output_path, levels, num_samples=1):
+    """
+    (completed keys, {key: level position to start from}) for the partially escalated ones.
+    Keys are in the sidecar form (`resume_key`) of the collectors' keys: index, or (index, sample)
+    with num_samples > 1. Attempts at efforts outside the ladder are ignored.
+    """
+    # 和普通 resume 一样先修复输出（截掉半行、补 sidecar），否则这次追加的第一条会接在半行后面
+    if not load_completed_samples(output_path):
+        return set(), {}
+    reached = {}  # key -> highest level position tried
+    solved = set()
+    for record in iter_output_records(output_path):
+        position = levels.index(record["reasoning_effort"]) if record.get("reasoning_effort") in levels else None
+        if position is None:
+            continue
+        extra_info = record.get("extra_info") or {}
+        key = extra_info.get("index")
+        if key is None:
+            continue
+        key = resume_key((key, extra_info.get("sample", 0)) if num_samples > 1 else key)
+        if _passed(record.get("reward")):
+            solved.add(key)
+        reached[key] = max(reached.get(key, -1), position)
+
+    completed = set(solved)
+    start = {}
+    for key, position in reached.items():
+        if key in solved:
+            continue
+        if position == len(levels) - 1:
+            completed.add(key)
+        else:
+            start[key] = position + 1
+    return completed, start
+
+
+class EffortLadder:
+    """
+    Runs one record up the ladder: `attempt(effort)` generates and scores one response. Failed
+    attempts below the top are handed to `writer`; the last attempt is returned, so the runner
+    writes it like any other result. Progress is kept per key (`resume_key` form, like `start`),
+    so a retried record (RetryPolicy) continues at the level it failed on instead of rewriting
+    the lower attempts.
+    """
+
+    def __init__(self, levels, writer, start=None):
+        self.levels = levels
+        self.writer = writer
+        self._next = dict(start or {})  # key -> level position to try next
+        self.solved = Counter()  # effort -> prompts that first passed there
+        self.attempts = Counter()
+        self._lock = threading.Lock()
+
+    def _advance(self, key, result) -> bool:
+        """Record one scored attempt; True when the record is finished"""
+        position = self.levels.index(result.reasoning_effort)
+        passed = _passed(result.reward)
+        with self._lock:
+            self.attempts[result.reasoning_effort] += 1
+            if passed:
+                self.solved[result.reasoning_effort] += 1
+        if not passed and position < len(self.levels) - 1:
+            self.writer.put(result)  # 没做对，先落盘，再升一档
+            self._next[key] = position + 1
+            return False
+        self._next.pop(key, None)
+        return True
+
+    def run(self, key, attempt):
+        key = resume_key(key)
+        while True:
+            result = attempt(self.levels[self._next.get(key, 0)])
+            if self._advance(key, result):
+                return result
+
+    async def run_async(self, key, attempt):
+        key = resume_key(key)
+        while True:
+            result = await attempt(self.levels[self._next.get(key, 0)])
+            if self._advance(key, result):
+                return result
+
+    def summary(self) -> str:
+        solved = ", ".join(f"{level}={self.solved[level]}" for level in self.levels)
+        attempts = ", ".join(f"{level}={self.attempts[level]}" for level in self.levels)
+        return f"Effort ladder: solved at {solved}; attempts {attempts}"
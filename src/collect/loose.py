@@ -1,14 +1,157 @@
-"""Make loose reward scores for oss output"""
+"""
+Make loose reward scores for oss output
 
+Rescores existing collector outputs offline (no model calls): math records get a brace-balanced
+`\\boxed{}` extraction and loose equivalence against the ground truth (LaTeX / unit / whitespace
+normalization, numeric tolerance), science records get their option letter re-extracted.
+`model_answer` / `new_label` and `reward` are rewritten; everything else is passed through.
 
+Usage:
+    python -m src.collect.loose --inputs release/slim_100_low.jsonl --output_dir release/loose
+"""
+import argparse
+import os
+from collections import Counter
+from multiprocessing import Pool
 
+from tqdm import tqdm
 
+from src.collect.records import encode_line, loads
+from src.collect.scoring import extract_boxed, extract_letter_from_response, math_reward
+from src.collect.writer import iter_complete_lines, list_shards, open_compressed
+from src.utils.parallel import imap_bounded
 
+_rel_tol = 1e-6
 
 
+def _init_worker(rel_tol):
+    global _rel_tol
+    _rel_tol = rel_tol
+
+
+def rescore_math(record, rel_tol=1e-6):
+    response = record.get("gpt-oss-120b-response") or ""
+    standard_answer = record.get("standard_answer")
+    if standard_answer is None:
+        standard_answer = record.get("reward_model", {}).get("ground_truth", "")
+    model_answer = extract_boxed(response)
+    record["standard_answer"] = standard_answer
+    record["model_answer"] = model_answer
+    record["reward"] = math_reward(model_answer, standard_answer, rel_tol)
+    return record
+
+
+def rescore_science(record):
+    response = ""
+    for msg in reversed(record.get("messages", [])):
+        if msg.get("role") == "assistant":
+            response = msg.get("content", "")
+            break
+    label = record.get("original_label", record.get("label"))
+    new_label = extract_letter_from_response(response)
+    record["new_label"] = new_label
+    record["reward"] = 1.0 if label == new_label and label is not None else 0.0
+    return record
+
+
+def rescore(record, rel_tol=1e-6):
+    """Rescore one output record in place; returns its kind ("math", "science" or None if unknown)"""
+    if "gpt-oss-120b-response" in record:
+        rescore_math(record, rel_tol)
+        return "math"
+    if "messages" in record and ("original_label" in record or "label" in record):
+        rescore_science(record)
+        return "science"
+    return None
+
+
+def _rescore_chunk(lines):
+    """worker: raw JSONL lines -> (rescored bytes, stats)"""
+    out = []
+    stats = Counter()
+    for line in lines:
+        try:
+            record = loads(line)
+        except ValueError:  # JSONDecodeError
+            stats["corrupted"] += 1
+            continue  # skip corrupted lines
+        before = record.get("reward", 0.0)
+        kind = rescore(record, _rel_tol)
+        stats["total"] += 1
+        if kind is None:
+            stats["unknown"] += 1
+        else:
+            stats[kind] += 1
+            stats["reward_before"] += before or 0.0
+            stats["reward_after"] += record["reward"]
+            if record["reward"] > (before or 0.0):
+                stats["gained"] += 1
+            elif record["reward"] < (before or 0.0):
+                stats["lost"] += 1
+        out.append(encode_line(record))
+    return b"".join(out), stats
+
+
+def _iter_chunks(path, compression, chunk_size):
+    chunk = []
+    for line in iter_complete_lines(path, compression):
+        if line.strip():
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def expand_inputs(paths):
+    """[(path, compression)]：一个 collector 输出路径可能对应多个分片"""
+    files = []
+    for path in paths:
+        shards = list_shards(path)
+        files.extend((shard, compression) for _, shard, compression in shards)
+        if os.path.exists(path) or not shards:
+            files.append((path, "none"))
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rescore collected outputs with loose answer matching (no model calls).")
+    parser.add_argument("--inputs", type=str, nargs="+", required=True,
+                        help="Collector output files (plain, or the --output_path of a sharded run)")
+    parser.add_argument("--output_dir", type=str, required=True, help="Directory for the rescored files (same names)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (default: all CPUs)")
+    parser.add_argument("--chunk_size", type=int, default=1000, help="Records per worker task (default: 1000)")
+    parser.add_argument("--rel_tol", type=float, default=1e-6,
+                        help="Relative tolerance for non-integer numeric answers (default: 1e-6)")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    files = expand_inputs(args.inputs)
+
+    with Pool(args.workers, initializer=_init_worker, initargs=(args.rel_tol,)) as pool:
+        for path, compression in files:
+            output_path = os.path.join(args.output_dir, os.path.basename(path))
+            if os.path.abspath(output_path) == os.path.abspath(path):
+                raise ValueError(f"--output_dir would overwrite the input {path}")
+            stats = Counter()
+            with open_compressed(output_path, "wb", compression) as fout, tqdm(desc=os.path.basename(path)) as pbar:
+                chunks = _iter_chunks(path, compression, args.chunk_size)
+                for data, chunk_stats in imap_bounded(pool, _rescore_chunk, chunks, 2 * args.workers):
+                    fout.write(data)
+                    stats.update(chunk_stats)
+                    pbar.update(chunk_stats["total"])
+
+            scored = stats["math"] + stats["science"]
+            print(f"{path} -> {output_path}: {stats['total']} records "
+                  f"(math {stats['math']}, science {stats['science']}, unknown {stats['unknown']}, "
+                  f"corrupted {stats['corrupted']})")
+            if scored:
+                print(f"  mean reward {stats['reward_before'] / scored:.4f} -> {stats['reward_after'] / scored:.4f} "
+                      f"(gained {stats['gained']}, lost {stats['lost']})")
+
+    print("All done.")
 
 
 if __name__ == "__main__":
-    
-    data_path = "release/slim_100_low.jsonl"
-    
\ No newline at end of file
+    main()
@@ -0,0 +1,248 @@
+"""
+Multi-node collection: deterministic input sharding, and merging the per-node outputs.
+
+`--shard i/N` on the collectors keeps the records whose index hashes to shard i (0-based) of N.
+The hash is a stable digest of the record's index (`extra_info.index` for DAPO, the line number
+for science), so it does not depend on file order, Python's hash seed or the machine; all
+samples of a prompt land on the same node. Run each node with its own --output_path.
+
+The merge combines the node outputs (any layout `iter_output_records` reads, restarts included)
+into one JSONL ordered by (index, sample). Every input is cut into sorted runs of about
+--chunk_mb, spilled to temporary files, and the runs are k-way merged, so memory stays bounded
+for outputs of any size. Records with the same key are deduplicated, keeping the latest one
+(later input, later line) or the best reward. Indices missing from the result are reported,
+compared against the collector input (--expected) or, without it, as gaps in the integer range.
+
+Usage:
+    python -m src.collect.multinode --inputs output/node0.jsonl output/node1.jsonl \
+        --output output/merged.jsonl --expected datasets/dapo-math-17k.jsonl --keep best
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import tempfile
+
+from src.collect.checkpoint import checkpoint_path
+from src.collect.records import loads
+from src.collect.runner import iter_jsonl
+from src.collect.writer import iter_output_lines
+
+KEEP = ["latest", "best"]
+
+
+def parse_shard(spec: str):
+    """'i/N' -> (i, N) with 0 <= i < N"""
+    try:
+        shard, num_shards = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"--shard must look like i/N, got {spec!r}") from None
+    if num_shards < 1 or not 0 <= shard < num_shards:
+        raise ValueError(f"--shard {spec!r}: need 0 <= i < N")
+    return shard, num_shards
+
+
+def shard_of(index, num_shards: int) -> int:
+    digest = hashlib.blake2b(str(index).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % num_shards
+
+
+def select_shard(indexed_records, shard, num_shards):
+    """Keep the (key, record) pairs of one shard; key is index or (index, sample)"""
+    for key, record in indexed_records:
+        index = key[0] if isinstance(key, tuple) else key
+        if shard_of(index, num_shards) == shard:
+            yield key, record
+
+
+# --- merge ---------------------------------------------------------------------------
+
+def _index_order(index):
+    # 整数 index 按数值排，其余（字符串 index、缺 index 的旧输出）排在后面
+    if isinstance(index, int) and not isinstance(index, bool):
+        return [0, index]
+    return [1, "" if index is None else str(index)]
+
+
+def _sort_key(record, seq, by_effort):
+    """[index order, sample, effort, reward, seq]; the first three identify a record"""
+    extra_info = record.get("extra_info") or {}
+    reward = record.get("reward")
+    return [
+        _index_order(extra_info.get("index")),
+        extra_info.get("sample", 0) if isinstance(extra_info.get("sample"), int) else 0,
+        (record.get("reasoning_effort") or "") if by_effort else "",
+        float(reward) if isinstance(reward, (int, float)) else -1.0,
+        seq,
+    ]
+
+
+class _Runs:
+    """Sorted runs spilled to a temporary directory; lines are `<sort key JSON>\\t<record line>`"""
+
+    def __init__(self, tmp_dir, chunk_bytes):
+        self.dir = tempfile.TemporaryDirectory(prefix="merge-", dir=tmp_dir)
+        self.chunk_bytes = chunk_bytes
+        self.paths = []
+        self._chunk = []
+        self._size = 0
+
+    def add(self, key, line):
+        self._chunk.append((key, line))
+        self._size += len(line)
+        if self._size >= self.chunk_bytes:
+            self._spill()
+
+    def _spill(self):
+        self._chunk.sort(key=lambda item: item[0])
+        path = os.path.join(self.dir.name, f"run-{len(self.paths):05d}.tsv")
+        with open(path, "wb") as f:
+            for key, line in self._chunk:
+                # JSON 行里的制表符一定是转义过的，可以放心用 \t 分隔
+                f.write(json.dumps(key).encode("utf-8") + b"\t" + line)
+        self.paths.append(path)
+        self._chunk = []
+        self._size = 0
+
+    @staticmethod
+    def _read(path):
+        with open(path, "rb") as f:
+            for line in f:
+                key, _, record = line.partition(b"\t")
+                yield loads(key), record
+
+    def merged(self):
+        """Every (key, line) in key order"""
+        self._chunk.sort(key=lambda item: item[0])
+        sources = [self._read(path) for path in self.paths] + [iter(self._chunk)]
+        return heapq.merge(*sources, key=lambda item: item[0])
+
+    def close(self):
+        self.dir.cleanup()
+
+
+def _dedup(merged, keep, stats):
+    """One (key, line) per record identity; `merged` is sorted, so duplicates are adjacent"""
+    group, chosen = None, None
+    for key, line in merged:
+        identity = key[:3]
+        if identity != group:
+            if chosen is not None:
+                yield chosen
+            group, chosen = identity, (key, line)
+            continue
+        stats["duplicates"] += 1
+        # 组内按 (reward, seq) 排序到达，不是写入顺序：latest 比 seq，best 比 (reward, seq)（平手取更晚的）
+        if keep == "latest":
+            newer = key[4] > chosen[0][4]
+        else:
+            newer = (key[3], key[4]) > (chosen[0][3], chosen[0][4])
+        if newer:
+            chosen = (key, line)
+    if chosen is not None:
+        yield chosen
+
+
+def expected_indices(path, index_from="extra_info"):
+    """Indices the collector input covers: `extra_info.index` of every line, or line numbers"""
+    indices = set()
+    for position, record in enumerate(iter_jsonl(path, keep_invalid=True)):
+        if index_from == "line":
+            indices.add(position)
+        elif isinstance(record, dict):
+            index = (record.get("extra_info") or {}).get("index")
+            if index is not None:
+                indices.add(index)
+    return indices
+
+
+def merge_outputs(inputs, output, keep="latest", by_effort=False, chunk_mb=512.0, tmp_dir=None):
+    """Merge collector outputs into `output`; returns (stats, {index: set of samples written})"""
+    if keep not in KEEP:
+        raise ValueError(f"unknown keep policy {keep!r}, expected one of {KEEP}")
+    directory = os.path.dirname(os.path.abspath(output))
+    os.makedirs(directory, exist_ok=True)
+    runs = _Runs(tmp_dir or directory, int(chunk_mb * 1024 * 1024))
+    stats = {"read": 0, "corrupted": 0, "duplicates": 0, "written": 0}
+    written = {}
+    try:
+        seq = 0
+        for path in inputs:
+            for line in iter_output_lines(path):
+                try:
+                    record = loads(line)
+                except ValueError:
+                    stats["corrupted"] += 1
+                    continue
+                if not line.endswith(b"\n"):
+                    line += b"\n"
+                runs.add(_sort_key(record, seq, by_effort), line)
+                seq += 1
+        stats["read"] = seq
+
+        tmp_output = output + ".tmp"
+        with open(tmp_output, "wb") as f:
+            for key, line in _dedup(runs.merged(), keep, stats):
+                f.write(line)
+                stats["written"] += 1
+                index = key[0][1]
+                written.setdefault(index, set()).add(key[1])
+        os.replace(tmp_output, output)  # 写完再替换，中途失败不会留下半个结果
+        if os.path.exists(checkpoint_path(output)):
+            os.remove(checkpoint_path(output))  # 旧的 resume sidecar 对不上新文件了
+    finally:
+        runs.close()
+    return stats, written
+
+
+def missing_keys(written, expected=None, num_samples=1):
+    """Sorted (index, sample) pairs not in `written`; without `expected`, gaps in the integer index range"""
+    if expected is None:
+        integers = [index for index in written if isinstance(index, int)]
+        expected = range(min(integers), max(integers) + 1) if integers else ()
+    missing = []
+    for index in expected:
+        samples = written.get(index, ())
+        missing.extend((index, sample) for sample in range(num_samples) if sample not in samples)
+    return sorted(missing, key=lambda key: (_index_order(key[0]), key[1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge per-node collector outputs, dropping duplicates and reporting gaps.")
+    parser.add_argument("--inputs", type=str, nargs="+", required=True,
+                        help="Node outputs (plain, or the --output_path of a sharded run); later inputs count as newer")
+    parser.add_argument("--output", type=str, required=True, help="Merged JSONL, ordered by (index, sample)")
+    parser.add_argument("--keep", type=str, choices=KEEP, default="latest",
+                        help="Which duplicate to keep: the latest one, or the best reward (ties: latest) (default: latest)")
+    parser.add_argument("--by_effort", action="store_true",
+                        help="Records at different reasoning efforts are distinct (keep every --effort_ladder attempt)")
+    parser.add_argument("--expected", type=str, default=None,
+                        help="The collector input JSONL; indices it has but the output lacks are reported as missing")
+    parser.add_argument("--index_from", type=str, choices=["extra_info", "line"], default="extra_info",
+                        help="Index of an --expected record: extra_info.index (DAPO) or its line number (science)")
+    parser.add_argument("--num_samples", type=int, default=1, help="Samples expected per index (default: 1)")
+    parser.add_argument("--missing_path", type=str, default=None,
+                        help="Write the missing (index, sample) pairs here as JSONL")
+    parser.add_argument("--chunk_mb", type=float, default=512.0, help="Size of the sorted runs held in memory (default: 512)")
+    parser.add_argument("--tmp_dir", type=str, default=None, help="Directory for the sorted runs (default: next to --output)")
+    args = parser.parse_args()
+
+    stats, written = merge_outputs(args.inputs, args.output, args.keep, args.by_effort, args.chunk_mb, args.tmp_dir)
+    print(f"Read {stats['read']} records from {len(args.inputs)} inputs ({stats['corrupted']} corrupted lines skipped), "
+          f"dropped {stats['duplicates']} duplicates, wrote {stats['written']} to {args.output}")
+
+    expected = expected_indices(args.expected, args.index_from) if args.expected else None
+    missing = missing_keys(written, expected, args.num_samples)
+    scope = f"of {len(expected)} expected indices" if expected is not None else "in the integer index range"
+    print(f"Missing: {len(missing)} (index, sample) pairs {scope}"
+          + (f", e.g. {missing[:10]}" if missing else ""))
+    if args.missing_path:
+        with open(args.missing_path, "w", encoding="utf-8") as f:
+            for index, sample in missing:
+                f.write(json.dumps({"index": index, "sample": sample}, ensure_ascii=False) + "\n")
+        print(f"Saved missing pairs to {args.missing_path}")
+
+
+if __name__ == "__main__":
+    main()
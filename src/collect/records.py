@@ -0,0 +1,281 @@
+"""
+Typed records for the collection hot path, and the JSON codec used to read and write them.
+
+Input lines are parsed into slotted `DapoRecord` / `ScienceRecord` objects as they are read, so
+a malformed record is rejected before any request is sent, and what every sample of a prompt
+needs (prompt text, ground truth, the reference label) is derived once per prompt. Results are
+`DapoResult` / `ScienceResult` objects that ResultWriter encodes straight to a JSON line; the
+fields that only depend on the input are encoded once per prompt and spliced into each line,
+so the input record is never copied.
+
+JSON goes through orjson when it is installed (several times faster on long reasoning strings),
+otherwise through the standard library. Both produce UTF-8 without escaping and read each
+other's output; orjson just leaves out the spaces after `:` and `,`.
+"""
+import json
+
+from src.collect.scoring import extract_answer_from_output
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the json module
+    orjson = None
+
+
+class RecordError(ValueError):
+    """A malformed input record"""
+
+
+class InvalidLine:
+    """An input line that is not valid JSON, kept in place so record positions do not shift"""
+
+    __slots__ = ("text", "error")
+
+    def __init__(self, text, error):
+        self.text = text
+        self.error = error
+
+
+def _std_dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+if orjson is not None:
+    loads = orjson.loads  # orjson.JSONDecodeError 是 json.JSONDecodeError 的子类
+
+    def dumps(obj) -> bytes:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:  # 非字符串 key、超过 64 位的整数等，退回标准库
+            return _std_dumps(obj)
+else:
+    loads = json.loads
+    dumps = _std_dumps
+
+
+def encode_line(result) -> bytes:
+    """A result (typed or a plain dict) -> one JSONL line"""
+    data = dumps(result) if isinstance(result, dict) else result.to_json()
+    return data + b"\n"
+
+
+def _join_objects(*parts) -> bytes:
+    """Concatenate encoded JSON objects with distinct keys into one object"""
+    return b"{" + b",".join(part[1:-1] for part in parts if len(part) > 2) + b"}"
+
+
+def _user_content(messages, field):
+    if not isinstance(messages, list):
+        raise RecordError(f"{field} must be a list of messages")
+    for message in messages:
+        if isinstance(message, dict) and message.get("role") == "user":
+            content = message.get("content")
+            if not isinstance(content, str) or not content:
+                raise RecordError(f"{field}: user message has no text content")
+            return content
+    raise RecordError(f"{field} has no user message")
+
+
+# --- DAPO-Math -------------------------------------------------------------------
+
+DAPO_RESULT_FIELDS = (
+    "reasoning_prompt", "gpt-oss-120b-response", "model_name", "reasoning_effort", "standard_answer",
+    "model_answer", "reward", "truncated", "stop_reason", "timing",
+)
+
+
+class DapoRecord:
+    """One DAPO-Math input row; `raw` is the parsed JSON, passed through to the output"""
+
+    __slots__ = ("raw", "index", "content", "ground_truth", "_base_json")
+
+    def __init__(self, raw, index, content, ground_truth):
+        self.raw = raw
+        self.index = index
+        self.content = content
+        self.ground_truth = ground_truth
+        self._base_json = None
+
+    @classmethod
+    def from_dict(cls, raw):
+        if not isinstance(raw, dict):
+            raise RecordError("record is not a JSON object")
+        prompt = raw.get("prompt")
+        if not isinstance(prompt, list) or not prompt or not isinstance(prompt[0], dict) \
+                or not isinstance(prompt[0].get("content"), str):
+            raise RecordError("prompt must be a non-empty list of messages with text content")
+        reward_model = raw.get("reward_model", {})
+        if not isinstance(reward_model, dict):
+            raise RecordError("reward_model must be an object")
+        ground_truth = reward_model.get("ground_truth", "")
+        if isinstance(ground_truth, (dict, list)):
+            raise RecordError("reward_model.ground_truth must be a string")
+        extra_info = raw.get("extra_info", {})
+        if not isinstance(extra_info, dict):
+            raise RecordError("extra_info must be an object")
+        index = extra_info.get("index")
+        if index is None:
+            # index 是 resume / 分片 / 合并的 key，缺了的行会全挤在同一个 key 上
+            raise RecordError("extra_info.index is missing (number the rows with `python -m src.data.reorg --assign_index`)")
+        return cls(raw, index, prompt[0]["content"], ground_truth)
+
+    def base_json(self) -> bytes:
+        """The input fields the result keeps as they are, encoded once and shared by all samples"""
+        if self._base_json is None:
+            self._base_json = dumps({
+                key: value for key, value in self.raw.items()
+                if key != "extra_info" and key not in DAPO_RESULT_FIELDS
+            })
+        return self._base_json
+
+
+class DapoResult:
+    __slots__ = ("record", "prompt", "response", "model_name", "reasoning_effort", "model_answer", "reward",
+                 "truncated", "stop_reason", "sample", "timing", "cached")
+
+    def __init__(self, record: DapoRecord, prompt, response, model_name, reasoning_effort, model_answer, reward,
+                 truncated=False, stop_reason="completed", sample=None):
+        self.record = record
+        self.prompt = prompt
+        self.response = response
+        self.model_name = model_name
+        self.reasoning_effort = reasoning_effort
+        self.model_answer = model_answer
+        self.reward = reward
+        self.truncated = truncated
+        self.stop_reason = stop_reason
+        self.sample = sample
+        self.timing = None
+        self.cached = False  # 结果没有真正发请求（缓存命中或合并到同样的请求上），不写进输出
+
+    def resume_key(self):
+        return self.record.index, self.sample
+
+    def _fields(self) -> dict:
+        fields = {}
+        extra_info = self.record.raw.get("extra_info")
+        if self.sample is not None:
+            fields["extra_info"] = {**(extra_info or {}), "sample": self.sample}
+        elif extra_info is not None:
+            fields["extra_info"] = extra_info
+        fields["reasoning_prompt"] = self.prompt
+        fields["gpt-oss-120b-response"] = self.response
+        fields["model_name"] = self.model_name
+        fields["reasoning_effort"] = self.reasoning_effort
+        fields["standard_answer"] = self.record.ground_truth
+        fields["model_answer"] = self.model_answer
+        fields["reward"] = self.reward
+        fields["truncated"] = self.truncated
+        fields["stop_reason"] = self.stop_reason
+        if self.timing is not None:
+            fields["timing"] = self.timing
+        return fields
+
+    def to_dict(self) -> dict:
+        return {**{key: value for key, value in self.record.raw.items() if key not in DAPO_RESULT_FIELDS},
+                **self._fields()}
+
+    def to_json(self) -> bytes:
+        return _join_objects(self.record.base_json(), dumps(self._fields()))
+
+
+# --- Nemotron science ------------------------------------------------------------
+
+# 输出里原样照抄输入的字段和默认值（顺序就是输出的顺序）
+SCIENCE_META_FIELDS = (
+    ("category", "science"),
+    ("license", "cc-by-4.0"),
+    ("reasoning", "on"),
+    ("generator", ""),
+    ("used_in_training", ""),
+    ("version", "v1"),
+    ("system_prompt", ""),
+)
+
+
+class ScienceRecord:
+    """
+    One science input row; the reference label is extracted from its `output` once.
+    `index` is the row's `extra_info.index` (set by src/data/nemotron_data.py), None without one.
+    """
+
+    __slots__ = ("raw", "content", "original_label", "index", "_meta_json")
+
+    def __init__(self, raw, content, original_label, index=None):
+        self.raw = raw
+        self.content = content
+        self.original_label = original_label
+        self.index = index
+        self._meta_json = None
+
+    @classmethod
+    def from_dict(cls, raw):
+        if not isinstance(raw, dict):
+            raise RecordError("record is not a JSON object")
+        content = _user_content(raw.get("input", []), "input")
+        output = raw.get("output", "")
+        if not isinstance(output, str):
+            raise RecordError("output must be a string")
+        extra_info = raw.get("extra_info")
+        index = extra_info.get("index") if isinstance(extra_info, dict) else None
+        return cls(raw, content, extract_answer_from_output(output), index)
+
+    def meta_json(self) -> bytes:
+        if self._meta_json is None:
+            self._meta_json = dumps({key: self.raw.get(key, default) for key, default in SCIENCE_META_FIELDS})
+        return self._meta_json
+
+
+class ScienceResult:
+    __slots__ = ("record", "index", "prompt", "response", "model_name", "reasoning_effort", "new_label", "reward",
+                 "truncated", "stop_reason", "sample", "timing", "cached")
+
+    def __init__(self, record: ScienceRecord, index, prompt, response, model_name, reasoning_effort, new_label,
+                 reward, truncated=False, stop_reason="completed", sample=None):
+        self.record = record
+        self.index = index
+        self.prompt = prompt
+        self.response = response
+        self.model_name = model_name
+        self.reasoning_effort = reasoning_effort
+        self.new_label = new_label
+        self.reward = reward
+        self.truncated = truncated
+        self.stop_reason = stop_reason
+        self.sample = sample
+        self.timing = None
+        self.cached = False  # 结果没有真正发请求（缓存命中或合并到同样的请求上），不写进输出
+
+    def resume_key(self):
+        return self.index, self.sample
+
+    def _messages(self) -> dict:
+        return {"messages": [
+            {"role": "user", "content": self.prompt},
+            {"role": "assistant", "content": self.response},
+        ]}
+
+    def _fields(self) -> dict:
+        extra_info = {"index": self.index}
+        if self.sample is not None:
+            extra_info["sample"] = self.sample
+        fields = {
+            "model_name": self.model_name,
+            "reasoning_effort": self.reasoning_effort,
+            "original_label": self.record.original_label,
+            "new_label": self.new_label,
+            "label": self.record.original_label,
+            "reward": self.reward,
+            "truncated": self.truncated,
+            "stop_reason": self.stop_reason,
+            "extra_info": extra_info,
+        }
+        if self.timing is not None:
+            fields["timing"] = self.timing
+        return fields
+
+    def to_dict(self) -> dict:
+        return {**self._messages(), **loads(self.record.meta_json()), **self._fields()}
+
+    def to_json(self) -> bytes:
+        return _join_objects(dumps(self._messages()), self.record.meta_json(), dumps(self._fields()))
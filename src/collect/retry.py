@@ -0,0 +1,215 @@
+"""
+Per-record retries for the collectors, and the dead-letter file for records that fail for good.
+
+Errors are classified before retrying: connection errors, timeouts, 5xx / 429 and generations
+the server aborted are worth another attempt (with jittered exponential backoff, so a restarting
+or OOM-killed server is not hammered by every worker at once); 4xx and parse errors are not,
+they would fail the same way again.
+
+Records that run out of attempts go to `<output root>.failed.jsonl`, one line per record:
+`{"key", "error_class", "error", "attempts", "failed_at", "record"}`. `--retry_failed`
+reprocesses only that file (see `take_dead_letter`).
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+import httpx
+import openai
+
+from src.utils.vllm_backend import GenerationFailed
+
+RETRYABLE = ("connection", "timeout", "server", "rate_limit")
+
+
+def classify_error(error: BaseException) -> str:
+    """connection / timeout / server (5xx) / rate_limit (429) / client (其他 4xx) / parse / other"""
+    # APITimeoutError 是 APIConnectionError 的子类，httpx.TimeoutException 是 TransportError 的子类，先判断超时
+    if isinstance(error, (openai.APITimeoutError, httpx.TimeoutException, TimeoutError)):
+        return "timeout"
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError, ConnectionError)):
+        return "connection"
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code == 429:
+            return "rate_limit"
+        if error.status_code == 408:
+            return "timeout"
+        return "server" if error.status_code >= 500 else "client"
+    if isinstance(error, GenerationFailed):
+        return "server"
+    # json.JSONDecodeError 是 ValueError；缺字段、类型不对都是输入或返回格式的问题
+    if isinstance(error, (ValueError, KeyError, TypeError, IndexError, AttributeError)):
+        return "parse"
+    return "other"
+
+
+class RetriesExhausted(Exception):
+    """The last error of a record that will not be retried again"""
+
+    def __init__(self, error: BaseException, attempts: int):
+        super().__init__(f"{classify_error(error)} error after {attempts} attempt(s): {error}")
+        self.error = error
+        self.attempts = attempts
+        self.error_class = classify_error(error)
+
+
+class RetryPolicy:
+    """
+    Full-jitter exponential backoff: after the n-th failed attempt (1-based) sleep
+    uniform(0, min(max_delay, base_delay * 2 ** (n - 1))), at most `max_attempts` attempts.
+    Thread-safe; `retried` counts retries by error class.
+    """
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 1.0, max_delay: float = 60.0,
+                 retry_on=RETRYABLE):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = frozenset(retry_on)
+        self.retried = Counter()
+        self._lock = threading.Lock()
+
+    def should_retry(self, error: BaseException, attempts: int) -> bool:
+        error_class = classify_error(error)
+        if attempts >= self.max_attempts or error_class not in self.retry_on:
+            return False
+        with self._lock:
+            self.retried[error_class] += 1
+        return True
+
+    def delay(self, attempts: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempts - 1)))
+
+    def wrap(self, process_fn):
+        def call(idx, record):
+            attempts = 0
+            while True:
+                attempts += 1
+                try:
+                    return process_fn(idx, record)
+                except Exception as e:
+                    if not self.should_retry(e, attempts):
+                        raise RetriesExhausted(e, attempts) from e
+                time.sleep(self.delay(attempts))
+        return call
+
+    def wrap_async(self, process_fn):
+        async def call(idx, record):
+            attempts = 0
+            while True:
+                attempts += 1
+                try:
+                    return await process_fn(idx, record)
+                except Exception as e:
+                    if not self.should_retry(e, attempts):
+                        raise RetriesExhausted(e, attempts) from e
+                await asyncio.sleep(self.delay(attempts))
+        return call
+
+
+def dead_letter_path(output_path):
+    root, _ = os.path.splitext(output_path)
+    return root + ".failed.jsonl"
+
+
+def _encode_key(key):
+    return list(key) if isinstance(key, tuple) else key
+
+
+def _decode_key(key):
+    return tuple(key) if isinstance(key, list) else key
+
+
+class DeadLetter:
+    """Appends records that failed for good to a JSONL file (created on the first failure)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.errors = Counter()
+        self._file = None
+        self._lock = threading.Lock()
+
+    def put(self, key, record, error: BaseException):
+        attempts = error.attempts if isinstance(error, RetriesExhausted) else 1
+        cause = error.error if isinstance(error, RetriesExhausted) else error
+        error_class = classify_error(cause)
+        entry = {
+            "key": _encode_key(key),
+            "error_class": error_class,
+            "error": f"{type(cause).__name__}: {cause}",
+            "attempts": attempts,
+            "failed_at": time.time(),
+            "record": getattr(record, "raw", record),  # DapoRecord / ScienceRecord -> 原始输入
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()  # 死信很少，逐条落盘，崩溃也不丢
+            self.count += 1
+            self.errors[error_class] += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def summary(self) -> str:
+        if not self.count:
+            return "Dead letters: 0"
+        return f"Dead letters: {self.count} {dict(self.errors)} -> {self.path}"
+
+
+def iter_dead_letter(path):
+    """
+    (key, record) for every entry, skipping a torn last line. A resumed run appends its failures
+    again, so identical (key, record) entries are returned once.
+    """
+    entries = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            identity = json.dumps([entry["key"], entry["record"]], ensure_ascii=False, sort_keys=True)
+            entries[identity] = (_decode_key(entry["key"]), entry["record"])
+    yield from entries.values()
+
+
+def take_dead_letter(path):
+    """
+    For --retry_failed: move the dead-letter file aside to `path + ".retrying"` and return its
+    (key, record) pairs; records that fail again are appended to a fresh `path`. Call
+    `finish_retry(path)` once the run completes. After a crash the `.retrying` file is picked
+    up again (merged with any new failures), so nothing is lost.
+    """
+    retrying = path + ".retrying"
+    if os.path.exists(path):
+        if os.path.exists(retrying):
+            with open(path, "r", encoding="utf-8") as src, open(retrying, "a", encoding="utf-8") as dst:
+                dst.write("\n" + src.read())  # 空行会被跳过；防止接在半行后面
+            os.remove(path)
+        else:
+            os.replace(path, retrying)
+    if not os.path.exists(retrying):
+        return []
+    return list(iter_dead_letter(retrying))
+
+
+def finish_retry(path):
+    retrying = path + ".retrying"
+    if os.path.exists(retrying):
+        os.remove(retrying)
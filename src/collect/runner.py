@@ -0,0 +1,354 @@
+"""Shared collection loop for the batch collectors (thread and asyncio engines)"""
+import asyncio
+import statistics
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from tqdm import tqdm
+
+from src.collect.checkpoint import resume_key
+from src.collect.records import InvalidLine, RecordError, loads
+from src.collect.writer import load_completed_indices, load_completed_samples  # re-exported for the collectors
+from src.utils.endpoints import Routing, routed
+
+ENGINES = ["thread", "async"]
+
+
+def iter_jsonl(path, max_lines=-1, keep_invalid=False):
+    """
+    逐行解析 JSONL，不把整个文件读进内存；max_lines > 0 时只读前 max_lines 行。
+    keep_invalid=True 时不是合法 JSON 的行产出 InvalidLine（交给 parse_records 拒绝），否则直接抛出。
+    """
+    with open(path, "rb") as f:
+        for line_no, line in enumerate(f):
+            if 0 < max_lines <= line_no:
+                break
+            if line.strip():
+                try:
+                    yield loads(line)
+                except ValueError as e:  # JSONDecodeError / UnicodeDecodeError
+                    if not keep_invalid:
+                        raise
+                    yield InvalidLine(line.decode("utf-8", "replace").rstrip("\n"), e)
+
+
+def parse_records(indexed_records, parse, on_error=None):
+    """
+    (key, raw dict) -> (key, parse(raw))，parse 是 DapoRecord.from_dict 之类。
+    格式不对的记录（包括 InvalidLine）在读入时就被拒绝（交给 on_error(key, raw, error) 并跳过），
+    不会跑到一半才出错。
+    """
+    for key, raw in indexed_records:
+        try:
+            if isinstance(raw, InvalidLine):
+                raw, error = raw.text, raw.error
+                raise RecordError(f"invalid JSON: {error}") from error
+            record = parse(raw)
+        except RecordError as e:
+            if on_error is None:
+                raise
+            on_error(key, raw, e)
+            continue
+        yield key, record
+
+
+def reject_to(dead_letter):
+    """on_error for parse_records: report the bad record and dead-letter it"""
+    def reject(key, raw, error):
+        print(f"\nRejected input {key}: {error}")
+        dead_letter.put(key, raw, error)
+    return reject
+
+
+class ResumeFilter:
+    """
+    在记录流过时跳过已完成的 index，并统计数量（流式模式下没有预先的总数）。
+    completed_indices 里是 sidecar 的形式（见 checkpoint.resume_key），字符串 index 按同样的方式哈希后比较。
+    """
+
+    def __init__(self, completed_indices):
+        self.completed_indices = completed_indices
+        self.total = 0
+        self.skipped = 0
+
+    def __call__(self, indexed_records):
+        for idx, record in indexed_records:
+            self.total += 1
+            if resume_key(idx) in self.completed_indices:
+                self.skipped += 1
+                continue
+            yield idx, record
+
+
+def expand_samples(indexed_records, num_samples):
+    """
+    (idx, record) -> ((idx, sample), record)，每题 num_samples 份。
+    同一题的样本挨着提交，vLLM 的 prefix cache 可以让它们共享一次 prefill。
+    """
+    for idx, record in indexed_records:
+        for sample in range(num_samples):
+            yield (idx, sample), record
+
+
+def _observed(process_fn, controller):
+    """在 worker 里记录每个请求的耗时和错误，交给 AdaptiveConcurrency"""
+    def call(idx, record):
+        start = time.monotonic()
+        try:
+            result = process_fn(idx, record)
+        except Exception as e:
+            controller.record(time.monotonic() - start, e)
+            raise
+        if not getattr(result, "cached", False):  # 缓存命中没打到服务器，不算延迟样本
+            controller.record(time.monotonic() - start)
+        return result
+    return call
+
+
+def _observed_async(process_fn, controller):
+    async def call(idx, record):
+        start = time.monotonic()
+        try:
+            result = await process_fn(idx, record)
+        except Exception as e:
+            controller.record(time.monotonic() - start, e)
+            raise
+        if not getattr(result, "cached", False):
+            controller.record(time.monotonic() - start)
+        return result
+    return call
+
+
+def _record_failure(idx, record, error, dead_letter):
+    print(f"\nError processing index={idx}: {error}")
+    if dead_letter is not None:
+        dead_letter.put(idx, record, error)
+
+
+def _capacity(window, controller):
+    return window if controller is None else min(window, controller.limit)
+
+
+def _update_progress(pbar, controller, in_flight):
+    pbar.update(1)
+    if controller is not None:
+        pbar.set_postfix(in_flight=in_flight, **controller.status(), refresh=False)
+
+
+class Hedger:
+    """
+    Hedges stragglers at the end of a run: once the input is exhausted and a slot is free, a
+    record still running after `factor` x the median latency of the completed ones gets a second
+    attempt, routed away from the endpoint the first one is on. The first result is kept and the
+    other attempt is cancelled, so only the asyncio engine hedges (a thread cannot be interrupted).
+    Needs `min_samples` completed records before it hedges anything.
+    """
+
+    def __init__(self, factor: float, min_samples: int = 20, window: int = 1000, check_interval: float = 1.0):
+        self.factor = factor
+        self.min_samples = min_samples
+        self.check_interval = check_interval
+        self._latencies = deque(maxlen=window)
+        self.hedged = 0
+        self.won = 0
+
+    def observe(self, seconds):
+        self._latencies.append(seconds)
+
+    def threshold(self):
+        if len(self._latencies) < self.min_samples:
+            return None
+        return self.factor * statistics.median(self._latencies)
+
+    def stragglers(self, tasks, free_slots):
+        """The tasks to hedge now, longest running first"""
+        threshold = self.threshold()
+        if threshold is None or free_slots <= 0:
+            return []
+        now = time.monotonic()
+        candidates = [task for task in tasks if task.hedge is None and now - task.started > threshold]
+        candidates.sort(key=lambda task: task.started)
+        return candidates[:free_slots]
+
+    def summary(self) -> str:
+        return f"Hedged: {self.hedged} (hedge finished first: {self.won})"
+
+
+class _Task:
+    """One record in flight: its original attempt and, once hedged, the second one"""
+
+    __slots__ = ("key", "record", "started", "routing", "attempts", "hedge", "done")
+
+    def __init__(self, key, record, hedging):
+        self.key = key
+        self.record = record
+        self.started = time.monotonic()
+        self.routing = Routing() if hedging else None
+        self.attempts = set()
+        self.hedge = None
+        self.done = False
+
+    def hedge_routing(self):
+        return Routing(avoid=self.routing.used, hedge=True)
+
+
+async def _attempt_async(process_fn, idx, record, routing):
+    if routing is None:
+        return await process_fn(idx, record)
+    with routed(routing):  # 每个 asyncio task 有自己的 context，互不影响
+        return await process_fn(idx, record)
+
+
+def _hedge_candidates(hedger, exhausted, tasks, slots):
+    # 输入读完之后才对冲：这时才有空出来的并发名额，不会挤掉还没开始的记录
+    if hedger is None or not exhausted:
+        return []
+    return hedger.stragglers(tasks, slots)
+
+
+def _settle(task, attempt, error, hedger, dead_letter):
+    """
+    Bookkeeping for one finished attempt; True when its result is the one to keep.
+    An error only counts once no other attempt at the record is still running.
+    """
+    task.attempts.discard(attempt)
+    if task.done:
+        return False  # 对冲输掉的一方
+    if error is not None:
+        if task.attempts:
+            return False
+        task.done = True
+        _record_failure(task.key, task.record, error, dead_letter)
+        return False
+    task.done = True
+    if hedger is not None:
+        hedger.observe(time.monotonic() - task.started)
+        if attempt is task.hedge:
+            hedger.won += 1
+    return True
+
+
+def run_threaded(pending, process_fn, writer, max_workers, window=-1, total=None, controller=None,
+                 retry=None, dead_letter=None):
+    """
+    pending: iterable of (idx, record), consumed lazily; process_fn(idx, record) -> result,
+    handed to `writer` (a started ResultWriter)
+
+    At most `window` (default 2 * max_workers) records are outstanding at a time, so memory
+    stays bounded however long `pending` is. With an AdaptiveConcurrency `controller`, the
+    number of outstanding requests follows `controller.limit` (capped by max_workers).
+    With a RetryPolicy `retry`, retryable errors are retried inside the worker (backoff included);
+    records that still fail go to `dead_letter` (a DeadLetter) instead of being dropped.
+    """
+    window = window if window > 0 else 2 * max_workers
+    if controller is not None:
+        window = min(window, max_workers)
+        process_fn = _observed(process_fn, controller)
+    if retry is not None:
+        process_fn = retry.wrap(process_fn)  # 每次尝试都单独计入 controller
+    pending = iter(pending)
+    in_flight = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        with tqdm(total=total, desc="Processing") as pbar:
+            while True:
+                # 补满窗口；窗口满了就等有结果再读下一条（backpressure）
+                while len(in_flight) < _capacity(window, controller):
+                    item = next(pending, None)
+                    if item is None:
+                        break
+                    idx, record = item
+                    in_flight[executor.submit(process_fn, idx, record)] = (idx, record)
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    idx, record = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        _record_failure(idx, record, e, dead_letter)
+                    else:
+                        writer.put(result)
+                    finally:
+                        _update_progress(pbar, controller, len(in_flight))
+
+
+async def _run_async(pending, process_fn, writer, max_concurrency, window, total, backend, controller,
+                     retry, dead_letter, hedger):
+    semaphore = asyncio.Semaphore(max_concurrency)
+    window = window if window > 0 else 2 * max_concurrency
+    if controller is not None:
+        window = min(window, max_concurrency)
+        process_fn = _observed_async(process_fn, controller)
+    if retry is not None:
+        process_fn = retry.wrap_async(process_fn)
+    pending = iter(pending)
+    in_flight = {}  # asyncio.Task -> _Task
+    tasks = set()
+    exhausted = False
+
+    async def worker(idx, record, routing):
+        async with semaphore:
+            try:
+                return await _attempt_async(process_fn, idx, record, routing), None
+            except Exception as e:
+                return None, e
+
+    def submit(task, routing):
+        attempt = asyncio.create_task(worker(task.key, task.record, routing))
+        task.attempts.add(attempt)
+        in_flight[attempt] = task
+        return attempt
+
+    try:
+        with tqdm(total=total, desc="Processing") as pbar:
+            while True:
+                while not exhausted and len(in_flight) < _capacity(window, controller):
+                    item = next(pending, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    task = _Task(*item, hedging=hedger is not None)
+                    tasks.add(task)
+                    submit(task, task.routing)
+                if not tasks:
+                    break  # 对冲输掉的请求可能还在飞，不等它们
+
+                free_slots = min(_capacity(window, controller), max_concurrency) - len(in_flight)
+                for task in _hedge_candidates(hedger, exhausted, tasks, free_slots):
+                    task.hedge = submit(task, task.hedge_routing())
+                    hedger.hedged += 1
+
+                timeout = hedger.check_interval if hedger is not None else None
+                done, _ = await asyncio.wait(in_flight, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    task = in_flight.pop(attempt)
+                    if attempt.cancelled():
+                        continue
+                    result, error = attempt.result()
+                    finished = task.done
+                    if _settle(task, attempt, error, hedger, dead_letter):
+                        writer.put(result)
+                        for other in task.attempts:
+                            other.cancel()  # 取消输掉的一方，关闭连接后 vLLM 会中止那个请求
+                    if task.done and not finished:
+                        tasks.discard(task)
+                        _update_progress(pbar, controller, len(in_flight))
+    finally:
+        if backend is not None:
+            await backend.close()
+
+
+def run_async(pending, process_fn, writer, max_concurrency, window=-1, total=None, backend=None,
+              controller=None, retry=None, dead_letter=None, hedger=None):
+    """
+    asyncio 版本：process_fn(idx, record) 是协程，最多 max_concurrency 个请求同时在飞，
+    最多 window 条记录处于未完成状态（有 controller 时跟随 controller.limit）。
+    retry / dead_letter 同 run_threaded；退避中的记录仍占着并发名额，服务端出问题时整体自然放慢。
+    hedger（Hedger）给收尾阶段的慢请求再发一次，输掉的一方会被取消。结束时关闭 backend（AsyncVLLMBackend）。
+    """
+    asyncio.run(_run_async(pending, process_fn, writer, max_concurrency, window, total, backend, controller,
+                           retry, dead_letter, hedger))
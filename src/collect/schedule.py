@@ -0,0 +1,76 @@
+"""
+Cost-aware ordering of pending work, so the expensive records start first instead of last.
+
+In file order the slowest (long-reasoning) problems are as likely to be submitted at the very
+end as anywhere else, and the run then idles the GPUs on a handful of stragglers. With
+`--schedule longest_first` the pending records are sorted by predicted cost, descending:
+- a record whose `extra_info.index` appears in an earlier run's output (--cost_history) is
+  predicted by that run's mean output tokens (`timing.output_tokens`, or response chars / 4);
+- any other record by its prompt length, scaled by the output/prompt ratio of the records
+  that do have history (or by prompt length alone when there is none).
+Samples of one prompt share a prediction and stay adjacent (the sort is stable), so they
+still share vLLM's prefix cache.
+"""
+from collections import defaultdict
+
+from src.collect.writer import iter_output_records
+
+SCHEDULES = ["file", "longest_first"]
+CHARS_PER_TOKEN = 4
+
+
+def _response_text(record) -> str:
+    if "gpt-oss-120b-response" in record:
+        return record.get("gpt-oss-120b-response") or ""
+    for message in reversed(record.get("messages", [])):
+        if message.get("role") == "assistant":
+            return message.get("content") or ""
+    return ""
+
+
+def record_cost(record) -> float:
+    """Output tokens of one collected record (estimated from its length without `timing`)"""
+    tokens = (record.get("timing") or {}).get("output_tokens")
+    if tokens is not None:
+        return float(tokens)
+    return len(_response_text(record)) / CHARS_PER_TOKEN
+
+
+def load_cost_history(paths) -> dict:
+    """extra_info.index -> mean output tokens over every sample in the given collector outputs"""
+    totals = defaultdict(lambda: [0.0, 0])
+    for path in paths:
+        for record in iter_output_records(path):
+            idx = (record.get("extra_info") or {}).get("index")
+            if idx is None:
+                continue
+            total = totals[idx]
+            total[0] += record_cost(record)
+            total[1] += 1
+    return {idx: cost / n for idx, (cost, n) in totals.items()}
+
+
+def _index(key):
+    return key[0] if isinstance(key, tuple) else key
+
+
+def order_longest_first(pending, history=None) -> list:
+    """
+    pending: [(key, record)] with typed records (`record.content` is the prompt text);
+    returns a new list sorted by predicted cost, most expensive first.
+    """
+    history = history or {}
+    known_cost = known_prompt = 0.0
+    for key, record in pending:
+        cost = history.get(_index(key))
+        if cost is not None:
+            known_cost += cost
+            known_prompt += len(record.content)
+    ratio = known_cost / known_prompt if known_prompt else 1.0
+
+    def predicted(item):
+        key, record = item
+        cost = history.get(_index(key))
+        return cost if cost is not None else ratio * len(record.content)
+
+    return sorted(pending, key=predicted, reverse=True)
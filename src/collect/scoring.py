@@ -0,0 +1,325 @@
+"""
+Answer extraction and reward checks shared by the collectors and the offline rescorer (loose.py).
+
+Math: brace-balanced `\\boxed{...}` extraction, LaTeX / unit / whitespace normalization and
+numeric equivalence with a relative tolerance.
+Science: option-letter extractors; all patterns are compiled once at import.
+pass@k: unbiased per-prompt estimates over --num_samples outputs.
+"""
+import json
+import math
+import os
+import re
+import string
+from fractions import Fraction
+
+# ---------------------------------------------------------------------------
+# Math answers
+# ---------------------------------------------------------------------------
+
+_BOXED_RE = re.compile(r"\\(?:boxed|fbox)\s*\{")
+
+
+def strip_chain_of_thought(text: str) -> str:
+    """移除 chain of thought，只保留最终答案部分"""
+    if not text:
+        return ""
+
+    if "</think>" in text:
+        return text.rsplit("</think>", 1)[-1].strip()
+
+    return text.strip()
+
+
+def _balanced_group(text: str, start: int) -> str | None:
+    """text[start - 1] 是 '{'，返回到与之匹配的 '}' 之前的内容；括号不闭合时返回 None"""
+    depth = 1
+    for pos in range(start, len(text)):
+        char = text[pos]
+        if char == "{" and text[pos - 1] != "\\":
+            depth += 1
+        elif char == "}" and text[pos - 1] != "\\":
+            depth -= 1
+            if depth == 0:
+                return text[start:pos]
+    return None
+
+
+def extract_boxed(response: str) -> str:
+    """
+    Content of the last complete `\\boxed{...}` in the final answer (after `</think>`),
+    falling back to the whole response. Nested braces such as `\\boxed{\\frac{1}{2}}` are kept.
+    """
+    if not response:
+        return ""
+    for text in (strip_chain_of_thought(response), response):
+        boxed = None
+        for match in _BOXED_RE.finditer(text):
+            content = _balanced_group(text, match.end())
+            if content is not None:
+                boxed = content
+        if boxed is not None:
+            return boxed.strip()
+    return ""
+
+
+_ANSWER_LINE_RE = re.compile(r"^[\*\_\s]*Answer[\*\_]*\s*:.*\S.*\n", re.IGNORECASE | re.MULTILINE)
+
+
+def final_answer_ready(answer_text: str) -> bool:
+    """
+    Early-stop check for streamed generation: the final answer segment (after the reasoning)
+    already has a closed `\\boxed{...}` or a complete `Answer: X` line.
+    """
+    if _ANSWER_LINE_RE.search(answer_text):
+        return True
+    return any(_balanced_group(answer_text, match.end()) is not None for match in _BOXED_RE.finditer(answer_text))
+
+
+_TEXT_RE = re.compile(r"\\(?:text|textbf|mathrm|mathbf|mbox|operatorname)\s*\{([^{}]*)\}")
+_FRAC_SHORT_RE = re.compile(r"\\frac\s*(\d)\s*(\d)")
+_FRAC_HALF_SHORT_RE = re.compile(r"\\frac\s*\{([^{}]*)\}\s*(\d)")
+_SQRT_SHORT_RE = re.compile(r"\\sqrt\s*(\w)")
+_DEGREE_RE = re.compile(r"\^\s*\{?\s*\\circ\s*\}?")
+_THOUSANDS_RE = re.compile(r"(?<![\d.])\d{1,3}(?:,\d{3})+(?![\d,])")
+_ASSIGNMENT_RE = re.compile(r"^[a-zA-Z]\w*\s*(?:=|\\in)\s*(?=\S)")
+# 单字母（m、s、g…）不算单位：答案里它们通常是变量，比如 2m
+_UNIT_WORDS = (
+    "degrees", "degree", "units", "unit", "square", "sq", "cubic", "meters", "meter", "cm", "mm", "km",
+    "inches", "inch", "feet", "foot", "ft", "miles", "mile", "hours", "hour", "hrs", "hr", "minutes", "minute",
+    "mins", "min", "seconds", "second", "days", "day", "dollars", "dollar", "cents", "cent", "grams", "gram", "kg",
+)
+# 单位必须和数字隔着空白（\text{...} 取出来时会补一个空格），2cm 这种连写的不动
+_UNIT_RE = re.compile(r"(?<=[\d}])\s+(?:\^?\{?[23]\}?\s*)?(?:" + "|".join(_UNIT_WORDS) + r")\b(?:\s*\^?\{?[23]\}?)?\s*$")
+_INEQUALITY_RE = re.compile(r"(\\[lg]e)(?![a-zA-Z])")
+_LATEX_NOISE = ("\\left", "\\right", "\\!", "\\,", "\\;", "\\:", "\\displaystyle", "$")
+
+
+def normalize_answer(answer: str) -> str:
+    """Canonical string form of a math answer (LaTeX spacing, \\text{}, units, fractions, whitespace)"""
+    if answer is None:
+        return ""
+    text = str(answer).strip()
+    for noise in _LATEX_NOISE:
+        text = text.replace(noise, "")
+    text = text.replace("\\dfrac", "\\frac").replace("\\tfrac", "\\frac")
+    text = text.replace("\\%", "%").replace("\\$", "").replace("\\ ", " ")
+    text = _INEQUALITY_RE.sub(lambda m: m.group(1) + "q", text)
+    # \text{cm} 等单位/说明：先取出内容（前面补空格，当成隔开的词），再按单位词去掉
+    for _ in range(2):
+        text = _TEXT_RE.sub(r" \1", text)
+    text = _DEGREE_RE.sub("", text)
+    text = _UNIT_RE.sub("", text.strip())
+    text = _FRAC_SHORT_RE.sub(r"\\frac{\1}{\2}", text)
+    text = _FRAC_HALF_SHORT_RE.sub(r"\\frac{\1}{\2}", text)
+    text = _SQRT_SHORT_RE.sub(r"\\sqrt{\1}", text)
+    text = _ASSIGNMENT_RE.sub("", text.strip())
+    text = _THOUSANDS_RE.sub(lambda m: m.group(0).replace(",", ""), text)
+    text = text.rstrip(".").strip()
+    text = re.sub(r"\s+", "", text)
+    if text.endswith("%"):
+        text = text[:-1]
+    return text
+
+
+_NUMBER_RE = re.compile(r"^[+-]?(?:\d+\.?\d*|\.\d+)(?:e[+-]?\d+)?$", re.IGNORECASE)
+_LATEX_FRAC_RE = re.compile(r"^([+-]?)\\frac\{([^{}]+)\}\{([^{}]+)\}$")
+_SLASH_FRAC_RE = re.compile(r"^([+-]?[\d.]+)/([\d.]+)$")
+_MIXED_RE = re.compile(r"^([+-]?\d+)\\frac\{(\d+)\}\{(\d+)\}$")
+
+
+def parse_number(text: str) -> Fraction | None:
+    """Numeric value of a normalized answer: integers, decimals, `a/b`, `\\frac{a}{b}`, mixed numbers"""
+    try:
+        if _NUMBER_RE.match(text):
+            return Fraction(text)
+        match = _LATEX_FRAC_RE.match(text)
+        if match:
+            numerator, denominator = parse_number(match.group(2)), parse_number(match.group(3))
+            if numerator is None or not denominator:
+                return None
+            value = numerator / denominator
+            return -value if match.group(1) == "-" else value
+        match = _SLASH_FRAC_RE.match(text)
+        if match:
+            denominator = Fraction(match.group(2))
+            return Fraction(match.group(1)) / denominator if denominator else None
+        match = _MIXED_RE.match(text)
+        if match:
+            whole, fraction = int(match.group(1)), Fraction(int(match.group(2)), int(match.group(3)))
+            return whole - fraction if match.group(1).startswith("-") else whole + fraction
+    except (ValueError, ZeroDivisionError):
+        return None
+    return None
+
+
+def _split_top_level(text: str) -> list[str]:
+    """按最外层逗号切分，忽略括号里的逗号"""
+    parts, depth, current = [], 0, []
+    for char in text:
+        if char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+    return parts
+
+
+def _unwrap_sequence(text: str):
+    """(开括号, 内容)：(a,b) / [a,b] / \\{a,b\\} / {a,b}"""
+    if text.startswith("\\{") and text.endswith("\\}"):
+        return "{", text[2:-2]
+    if len(text) >= 2 and text[0] + text[-1] in ("()", "[]", "{}"):
+        return text[0], text[1:-1]
+    return None, text
+
+
+def answers_match(predicted: str, reference: str, rel_tol: float = 1e-6) -> bool:
+    """Loose equivalence: normalized string equality, numeric equality within `rel_tol`, element-wise for tuples/sets"""
+    predicted, reference = normalize_answer(predicted), normalize_answer(reference)
+    if not predicted or not reference:
+        return False
+    if predicted == reference:
+        return True
+
+    a, b = parse_number(predicted), parse_number(reference)
+    if a is not None and b is not None:
+        if a.denominator == 1 and b.denominator == 1:
+            return a == b  # 整数答案不放宽
+        return a == b or math.isclose(float(a), float(b), rel_tol=rel_tol, abs_tol=rel_tol)
+
+    open_a, inner_a = _unwrap_sequence(predicted)
+    open_b, inner_b = _unwrap_sequence(reference)
+    parts_a, parts_b = _split_top_level(inner_a), _split_top_level(inner_b)
+    if len(parts_a) > 1 and len(parts_a) == len(parts_b) and open_a == open_b:
+        if open_a == "{":  # 集合：与顺序无关
+            return all(any(answers_match(x, y, rel_tol) for y in parts_b) for x in parts_a) and \
+                all(any(answers_match(y, x, rel_tol) for x in parts_a) for y in parts_b)
+        return all(answers_match(x, y, rel_tol) for x, y in zip(parts_a, parts_b))
+    return False
+
+
+def math_reward(model_answer: str, standard_answer: str, rel_tol: float = 1e-6) -> float:
+    return 1.0 if answers_match(model_answer, standard_answer, rel_tol) else 0.0
+
+
+# ---------------------------------------------------------------------------
+# Science (multiple choice) answers
+# ---------------------------------------------------------------------------
+
+DEFAULT_LETTERS = frozenset(string.ascii_uppercase[:10])  # A-J
+
+# 优先匹配 "The answer is (X)" 或 "Answer: (X)" 等格式
+_RESPONSE_PATTERNS = [
+    re.compile(r"(?:answer|option|choice|solution)\s*(?:is|:)?\s*\(?([A-J])\)?", re.IGNORECASE),
+    re.compile(r"\(?([A-J])\)?\s*(?:is\s*(?:the)?\s*correct|is\s*the\s*answer)", re.IGNORECASE),
+    re.compile(r"final\s*(?:answer|option)\s*(?:is|:)?\s*\(?([A-J])\)?", re.IGNORECASE),
+]
+_LONE_LETTER_RE = re.compile(r"\b([A-J])\b")
+
+# 原始 output 的答案格式
+_OUTPUT_PATTERNS = [
+    re.compile(r"(?:answer|option|choice)\s*(?:is|:)?\s*\(?([A-J])\)?", re.IGNORECASE | re.DOTALL),
+    re.compile(r"(?i)[\*\_]{0,2}Answer[\*\_]{0,2}\s*:[\s\*\_]{0,2}\s*([A-Z])(?![a-zA-Z0-9])", re.IGNORECASE | re.DOTALL),
+    re.compile(r"\boxed\{[^}]*([A-Z])[^}]*\}", re.IGNORECASE | re.DOTALL),
+    re.compile(r"answer is ([a-zA-Z])", re.IGNORECASE | re.DOTALL),
+    re.compile(r"^.*\(([A-J])\)\.*$", re.IGNORECASE | re.DOTALL),  # 最后出现的 (X)
+]
+
+
+def normalize_text(text: str) -> str:
+    """标准化文本"""
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+
+def extract_letter_from_response(response: str, valid_letters=None) -> str | None:
+    """
+    从模型回复中提取选择的选项字母
+    """
+    if not response:
+        return None
+    valid_letters = DEFAULT_LETTERS if valid_letters is None else {letter.upper() for letter in valid_letters}
+
+    text = strip_chain_of_thought(response)
+
+    for pattern in _RESPONSE_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            letter = match.group(1).upper()
+            if letter in valid_letters:
+                return letter
+
+    # Fallback: 找最后一个有效的单独大写字母
+    for letter in reversed(_LONE_LETTER_RE.findall(text)):
+        letter = letter.upper()
+        if letter in valid_letters:
+            return letter
+
+    return None
+
+
+def extract_answer_from_output(output: str) -> str | None:
+    """
+    从原始 output 中提取答案字母
+    """
+    if not output:
+        return None
+
+    # 答案通常在最后，格式如 "The answer is (E)."
+    text = strip_chain_of_thought(output)
+
+    for pattern in _OUTPUT_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            return match.group(1).upper()
+
+    return None
+
+
+# ---------------------------------------------------------------------------
+# pass@k
+# ---------------------------------------------------------------------------
+
+def pass_at_k(n: int, c: int, k: int) -> float:
+    """Unbiased pass@k from n samples with c correct: 1 - C(n-c, k) / C(n, k)"""
+    if n - c < k:
+        return 1.0
+    return 1.0 - math.comb(n - c, k) / math.comb(n, k)
+
+
+def passk_path(output_path):
+    root, _ = os.path.splitext(output_path)
+    return root + ".passk.jsonl"
+
+
+def summarize_pass_at_k(records, num_samples, summary_path) -> dict:
+    """
+    Group output records by `extra_info.index`, write one line per prompt to `summary_path`
+    (samples, correct, pass@1 ... pass@num_samples at powers of two) and return
+    {"prompts": n, "pass@k": (mean, prompts with at least k samples), ...}. A prompt with fewer
+    than k samples (partial run, dead-lettered samples) has no pass@k and is left out of its mean.
+    """
+    counts = {}
+    for record in records:
+        idx = record.get("extra_info", {}).get("index")
+        seen = counts.setdefault(idx, {})
+        seen[record.get("extra_info", {}).get("sample", 0)] = record.get("reward", 0.0) == 1.0  # 重跑时同一 sample 只算一次
+    ks = sorted({k for k in (1 << i for i in range(num_samples.bit_length())) if k <= num_samples} | {num_samples})
+
+    totals = {f"pass@{k}": [0.0, 0] for k in ks}  # [sum, prompts]
+    with open(summary_path, "w", encoding="utf-8") as f:
+        for idx, seen in counts.items():
+            n, c = len(seen), sum(seen.values())
+            line = {"index": idx, "samples": n, "correct": c}
+            for k in ks:
+                if k <= n:
+                    line[f"pass@{k}"] = pass_at_k(n, c, k)
+                    totals[f"pass@{k}"][0] += line[f"pass@{k}"]
+                    totals[f"pass@{k}"][1] += 1
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    return {"prompts": len(counts), **{key: (total / prompts, prompts) for key, (total, prompts) in totals.items() if prompts}}
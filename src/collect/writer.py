@@ -0,0 +1,371 @@
+"""
+Background output writer for the collectors, plus the output layouts resume understands.
+
+Layouts for an output path like `out/results.jsonl`:
+- plain: `out/results.jsonl` with its `.idx` resume sidecar (see checkpoint.py)
+- sharded: `out/results.00000.jsonl[.gz|.zst]`, `out/results.00001.jsonl[...]`, ...
+  Each run starts a new shard and rolls to the next one after `shard_size` uncompressed
+  bytes. A shard's `.idx` is written when the shard is closed; a shard without one was
+  cut short by a crash and is repaired (complete lines kept) on the next load.
+"""
+import gzip
+import io
+import os
+import queue
+import re
+import threading
+import time
+import zlib
+
+from src.collect.checkpoint import ResumeCheckpoint, checkpoint_path, truncate_partial_line
+from src.collect.records import encode_line, loads
+
+try:
+    import zstandard
+except ImportError:  # only needed for --compression zstd
+    zstandard = None
+
+COMPRESSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+_SUFFIX_TO_COMPRESSION = {suffix: name for name, suffix in COMPRESSIONS.items()}
+
+
+def _require_zstd():
+    if zstandard is None:
+        raise ImportError("zstd output needs the `zstandard` package: pip install zstandard")
+
+
+def shard_path(output_path, shard_id, compression="none"):
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.{shard_id:05d}{ext or '.jsonl'}{COMPRESSIONS[compression]}"
+
+
+def list_shards(output_path):
+    """[(shard_id, path, compression)] sorted by shard id"""
+    root, ext = os.path.splitext(output_path)
+    directory = os.path.dirname(root) or "."
+    pattern = re.compile(
+        re.escape(os.path.basename(root)) + r"\.(\d{5})" + re.escape(ext or ".jsonl") + r"(\.gz|\.zst)?$"
+    )
+    if not os.path.isdir(directory):
+        return []
+    shards = []
+    for name in os.listdir(directory):
+        match = pattern.match(name)
+        if match:
+            compression = _SUFFIX_TO_COMPRESSION[match.group(2) or ""]
+            shards.append((int(match.group(1)), os.path.join(directory, name), compression))
+    return sorted(shards)
+
+
+def open_compressed(path, mode="rb", compression=None):
+    """Open a (possibly compressed) JSONL file in binary mode; compression is guessed from the suffix"""
+    if compression is None:
+        compression = _SUFFIX_TO_COMPRESSION.get(os.path.splitext(path)[1], "none")
+    if compression == "gzip":
+        return gzip.open(path, mode)
+    if compression == "zstd":
+        _require_zstd()
+        fh = open(path, mode)
+        if "r" in mode:
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(fh, read_across_frames=True, closefd=True))
+        return zstandard.ZstdCompressor(level=3).stream_writer(fh, closefd=True)
+    return open(path, mode)
+
+
+def _decompressor(compression):
+    if compression == "gzip":
+        return zlib.decompressobj(wbits=31)
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def _iter_decompressed(path, compression, chunk_size=1 << 20):
+    """
+    增量解压：被截断的流只是在最后一个完整 block 处结束，不会把前面已经写好的数据一起丢掉
+    （流式 reader 遇到截断会直接抛异常）。
+    """
+    if compression == "zstd":
+        _require_zstd()
+    with open(path, "rb") as f:
+        decompressor = _decompressor(compression)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            while chunk:
+                try:
+                    data = decompressor.decompress(chunk)
+                except (zlib.error, *_zstd_errors()):
+                    return
+                if data:
+                    yield data
+                chunk = decompressor.unused_data if decompressor.eof else b""
+                if chunk:
+                    decompressor = _decompressor(compression)  # 下一个 gzip member / zstd frame
+
+
+def _zstd_errors():
+    return (zstandard.ZstdError,) if zstandard is not None else ()
+
+
+def iter_complete_lines(path, compression):
+    """逐行读取，丢弃最后不完整的一行（没写完的行或被截断的压缩流）"""
+    if compression == "none":
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    return
+                yield line
+        return
+
+    pending = b""
+    for data in _iter_decompressed(path, compression):
+        pending += data
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + b"\n"
+
+
+def _repair_shard(path, compression) -> ResumeCheckpoint:
+    """重写一个没有正常关闭的分片，只保留完整的行，并生成它的 .idx"""
+    checkpoint = ResumeCheckpoint(path)
+    if compression == "none":
+        truncate_partial_line(path)
+        checkpoint.load()
+        return checkpoint
+
+    tmp_path = path + ".tmp"
+    offset = 0
+    with open_compressed(tmp_path, "wb", compression) as fout:
+        for line in iter_complete_lines(path, compression):
+            fout.write(line)
+            offset += len(line)
+            try:
+                checkpoint.add(loads(line), offset)
+            except ValueError:  # JSONDecodeError
+                checkpoint.add({}, offset)
+    os.replace(tmp_path, path)
+    checkpoint.save()
+    print(f"Repaired unfinished shard {path} ({len(checkpoint.offsets)} complete records)")
+    return checkpoint
+
+
+def _load_shard(path, compression) -> ResumeCheckpoint:
+    checkpoint = ResumeCheckpoint(path)
+    if os.path.exists(checkpoint_path(path)) and checkpoint.read():
+        return checkpoint
+    return _repair_shard(path, compression)
+
+
+def _load_checkpoints(output_path):
+    """Resume indexes of every layout present for `output_path`: the plain file and any shards"""
+    shards = list_shards(output_path)
+    for _, path, compression in shards:
+        yield _load_shard(path, compression)
+    if os.path.exists(output_path) or not shards:
+        checkpoint = ResumeCheckpoint(output_path)
+        checkpoint.load()
+        yield checkpoint
+
+
+def load_completed_indices(output_path) -> set:
+    """
+    Set of already processed `extra_info.index` values (as `index_key`s) over every layout present
+    for `output_path`: the plain file (via its `.idx` sidecar) and any shards.
+    """
+    completed = set()
+    for checkpoint in _load_checkpoints(output_path):
+        completed |= checkpoint.completed()
+    return completed
+
+
+def load_completed_samples(output_path) -> set:
+    """Like `load_completed_indices`, but (index, sample) pairs for --num_samples outputs"""
+    completed = set()
+    for checkpoint in _load_checkpoints(output_path):
+        completed |= checkpoint.completed_samples()
+    return completed
+
+
+def iter_output_lines(output_path):
+    """Yield every non-empty complete line of an output (shards in order, then the plain file)"""
+    paths = [(path, compression) for _, path, compression in list_shards(output_path)]
+    if os.path.exists(output_path):
+        paths.append((output_path, "none"))
+    for path, compression in paths:
+        for line in iter_complete_lines(path, compression):
+            if line.strip():
+                yield line
+
+
+def iter_output_records(output_path):
+    """Yield every record of an output (shards in order, then the plain file), skipping corrupted lines"""
+    for line in iter_output_lines(output_path):
+        try:
+            yield loads(line)
+        except ValueError:  # JSONDecodeError
+            continue  # skip corrupted lines
+
+
+class ResultWriter:
+    """
+    Serializes and writes results on a background thread.
+
+    `put` only enqueues. The writer thread commits a batch every `flush_records` results or
+    `flush_interval` seconds, whichever comes first: one write and one flush per batch, then
+    the resume index entries (commit time goes to `metrics`, a RunMetrics, if given). With `shard_size` > 0 or a compression other than "none",
+    results go to rolling shards instead of the plain output file.
+    """
+
+    _CLOSE = object()
+
+    def __init__(
+        self,
+        output_path,
+        flush_interval: float = 1.0,
+        flush_records: int = 64,
+        shard_size: int = 0,
+        compression: str = "none",
+        max_queue: int = 10000,
+        metrics=None,
+    ):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"unknown compression {compression!r}, expected one of {list(COMPRESSIONS)}")
+        if compression == "zstd":
+            _require_zstd()
+        self.output_path = output_path
+        self.flush_interval = flush_interval
+        self.flush_records = max(1, flush_records)
+        self.shard_size = shard_size
+        self.compression = compression
+        self.sharded = shard_size > 0 or compression != "none"
+        self.written = 0
+        self.metrics = metrics
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._error = None
+        # plain layout
+        self._fout = None
+        self._checkpoint = None
+        # sharded layout
+        self._shard_id = None
+        self._shard = None
+        self._shard_checkpoint = None
+        self._shard_bytes = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def put(self, result):
+        if self._error is not None:
+            raise RuntimeError("result writer failed") from self._error
+        self._queue.put(result)
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(self._CLOSE)
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            raise RuntimeError("result writer failed") from self._error
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        try:
+            closing = False
+            while not closing:
+                batch = []
+                item = self._queue.get()
+                deadline = time.monotonic() + self.flush_interval
+                while True:
+                    if item is self._CLOSE:
+                        closing = True
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.flush_records:
+                        break
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                if batch:
+                    self._commit(batch)
+        except BaseException as e:
+            self._error = e
+            # 把队列排空，避免生产者在 put 上卡住
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+        finally:
+            self._close_outputs()
+
+    def _commit(self, batch):
+        start = time.monotonic()
+        lines = [encode_line(result) for result in batch]
+        if self.sharded:
+            self._commit_sharded(batch, lines)
+        else:
+            self._commit_plain(batch, lines)
+        self.written += len(batch)
+        if self.metrics is not None:
+            self.metrics.record_write(time.monotonic() - start, len(batch))
+
+    def _commit_plain(self, batch, lines):
+        if self._fout is None:
+            self._fout = open(self.output_path, "ab")
+            self._checkpoint = ResumeCheckpoint(self.output_path).open()
+        offset = self._fout.tell()
+        self._fout.write(b"".join(lines))
+        self._fout.flush()
+        for result, line in zip(batch, lines):
+            offset += len(line)
+            self._checkpoint.record(result, offset)
+        self._checkpoint.flush()
+
+    def _commit_sharded(self, batch, lines):
+        for result, line in zip(batch, lines):
+            if self._shard is None or (self.shard_size > 0 and self._shard_bytes >= self.shard_size):
+                self._roll_shard()
+            self._shard.write(line)
+            self._shard_bytes += len(line)
+            self._shard_checkpoint.add(result, self._shard_bytes)
+        self._shard.flush()
+
+    def _roll_shard(self):
+        self._close_shard()
+        if self._shard_id is None:
+            existing = list_shards(self.output_path)
+            self._shard_id = existing[-1][0] + 1 if existing else 0
+        else:
+            self._shard_id += 1
+        path = shard_path(self.output_path, self._shard_id, self.compression)
+        self._shard = open_compressed(path, "wb", self.compression)
+        self._shard_checkpoint = ResumeCheckpoint(path)
+        self._shard_bytes = 0
+
+    def _close_shard(self):
+        if self._shard is not None:
+            self._shard.close()
+            self._shard_checkpoint.save()
+            self._shard = None
+            self._shard_checkpoint = None
+
+    def _close_outputs(self):
+        if self._fout is not None:
+            self._fout.close()
+            self._checkpoint.close()
+            self._fout = None
+        self._close_shard()
@@ -1,94 +1,387 @@
-from src.utils.vllm_backend import get_response
-from tqdm import tqdm
+"""
+Exact + near-duplicate removal for prompt datasets (DAPO-Math, Nemotron science, collected outputs).
+
+Pipeline, all streaming so memory stays bounded by chunk and partition size:
+1. Scan: input lines are parsed in a process pool. For every record we compute a 64-bit hash of
+   the normalized prompt (exact pass) and a MinHash signature whose LSH bands are spilled to
+   hash-partitioned files on disk; signatures go to a memory-mapped file.
+2. Group: each partition is sorted in a worker. Records sharing an exact hash are linked directly;
+   records sharing an LSH band become candidates, and every candidate pair in a band is linked if
+   its estimated Jaccard similarity reaches --threshold. Bands and rows are chosen so that pairs
+   just above the threshold are rarely missed (`choose_bands`).
+3. Union-find over the links gives clusters. Inside a cluster the earliest record of the --inputs
+   is kept; if a cluster contains any --reference record, all of its --inputs records are dropped
+   (decontamination).
+4. The inputs are streamed again into `<name>.kept.jsonl` / `<name>.dropped.jsonl`, plus
+   `clusters.jsonl` and `summary.json`.
+
+Usage:
+    python -m src.data.dedup --inputs datasets/dapo-math-17k.jsonl datasets/science.jsonl \
+        --reference datasets/eval/aime.jsonl --output_dir datasets/dedup
+"""
+import argparse
+import hashlib
 import json
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import re
+import shutil
+import unicodedata
+from array import array
+from bisect import bisect_right
+from multiprocessing import Pool
 
+import numpy as np
+from tqdm import tqdm
+
+from src.utils.parallel import imap_bounded
+
+DEFAULT_INST = """Solve the following math problem step by step. The last line of your response should be of the form Answer: $Answer (without quotes) where $Answer is the answer to the problem.\n\n"""
 ORIGINAL_INST = """Remember to put your answer on its own line after "Answer:"."""
 COT_INST = """Let's think step by step and output your final answer within \\boxed{{}}."""
+# 所有题目共享的指令模板，不去掉的话任意两道 DAPO 题的 MinHash 相似度都会偏高
+BOILERPLATE = [DEFAULT_INST, ORIGINAL_INST, COT_INST]
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+EXACT_KIND = 0xFFFF
+ENTRY = np.dtype([("kind", "<u2"), ("key", "<u8"), ("id", "<i8")])
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def prompt_text(record) -> str:
+    """Prompt of a DAPO input, science input or collector output record"""
+    for field in ("prompt", "input", "messages"):
+        messages = record.get(field)
+        if isinstance(messages, list):
+            for msg in messages:
+                if isinstance(msg, dict) and msg.get("role") == "user":
+                    return msg.get("content", "")
+        elif isinstance(messages, str):
+            return messages
+    for field in ("problem", "question"):
+        if isinstance(record.get(field), str):
+            return record[field]
+    return ""
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text)
+    for boilerplate in BOILERPLATE:
+        text = text.replace(boilerplate, " ")
+    return _SPACE_RE.sub(" ", text.lower()).strip()
+
+
+def exact_hash(normalized: str) -> int:
+    return int.from_bytes(hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def shingles(normalized: str, ngram: int) -> set:
+    tokens = _TOKEN_RE.findall(normalized)
+    if len(tokens) <= ngram:
+        return {" ".join(tokens)}
+    return {" ".join(tokens[i:i + ngram]) for i in range(len(tokens) - ngram + 1)}
+
+
+def _integrate(f, start, end, steps=200):
+    """中点法数值积分，够选参数用了"""
+    width = (end - start) / steps
+    return float(np.sum(f(start + width * (np.arange(steps) + 0.5)))) * width
+
+
+def choose_bands(threshold: float, num_perm: int, false_positive_weight: float = 0.1,
+                 false_negative_weight: float = 0.9) -> tuple[int, int]:
+    """
+    (bands, rows) with bands * rows <= num_perm minimizing the weighted areas under the LSH
+    S-curve 1 - (1 - s^r)^b below `threshold` (false positives) and above it (false negatives),
+    as datasketch does. False negatives weigh more: candidates are verified against the full
+    signature anyway, so an extra candidate only costs a comparison, a missed one is a kept duplicate.
+    """
+    best = None
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            def candidate(s):
+                return 1 - (1 - s ** rows) ** bands
+
+            false_positives = _integrate(candidate, 0.0, threshold)
+            false_negatives = _integrate(lambda s: 1 - candidate(s), threshold, 1.0)
+            error = false_positive_weight * false_positives + false_negative_weight * false_negatives
+            if best is None or error < best[0]:
+                best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class MinHasher:
+    def __init__(self, num_perm: int, bands: int, rows: int, ngram: int, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, np.iinfo(np.int64).max, size=num_perm, dtype=np.int64).astype(np.uint64)
+        self.b = rng.randint(0, np.iinfo(np.int64).max, size=num_perm, dtype=np.int64).astype(np.uint64)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = rows  # bands * rows 可以小于 num_perm：多出的排列只用于校验
+        self.ngram = ngram
+
+    def signature(self, normalized: str) -> np.ndarray:
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+             for s in shingles(normalized, self.ngram)),
+            dtype=np.uint64,
+        )
+        with np.errstate(over="ignore"):
+            permuted = ((hashes[:, None] * self.a + self.b) % MERSENNE_PRIME) & MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def band_keys(self, signature: np.ndarray) -> list[int]:
+        keys = []
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            keys.append(int.from_bytes(hashlib.blake2b(chunk, digest_size=8).digest(), "little"))
+        return keys
+
+
+_hasher = None
+
+
+def _init_worker(num_perm, bands, rows, ngram):
+    global _hasher
+    _hasher = MinHasher(num_perm, bands, rows, ngram)
+
+
+def _hash_chunk(lines):
+    """worker: raw JSONL lines -> (valid mask, exact keys, band keys, signatures)"""
+    valid = np.zeros(len(lines), dtype=bool)
+    exact = np.zeros(len(lines), dtype=np.uint64)
+    bands = np.zeros((len(lines), _hasher.bands), dtype=np.uint64)
+    signatures = np.zeros((len(lines), _hasher.num_perm), dtype=np.uint32)
+    for i, line in enumerate(lines):
+        try:
+            text = normalize(prompt_text(json.loads(line)))
+        except json.JSONDecodeError:
+            text = ""
+        if not text:
+            continue  # 取不到 prompt 的记录不参与去重，原样保留
+        valid[i] = True
+        exact[i] = exact_hash(text)
+        signatures[i] = _hasher.signature(text)
+        bands[i] = _hasher.band_keys(signatures[i])
+    return valid, exact, bands, signatures
+
+
+def _iter_lines(path):
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+
+def _iter_chunks(paths, chunk_size, counts):
+    """按 chunk_size 切分所有文件的行；顺带把每个文件的行数追加到 counts"""
+    chunk = []
+    for path in paths:
+        counts.append(0)
+        for line in _iter_lines(path):
+            counts[-1] += 1
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def _group_partition(args):
+    """worker: sort one partition and return verified (id, id) links"""
+    partition_path, signatures_path, num_records, num_perm, threshold = args
+    entries = np.fromfile(partition_path, dtype=ENTRY)
+    if len(entries) < 2:
+        return []
+    signatures = np.memmap(signatures_path, dtype=np.uint32, mode="r", shape=(num_records, num_perm))
+    entries = entries[np.lexsort((entries["id"], entries["key"], entries["kind"]))]
+    same = (entries["kind"][1:] == entries["kind"][:-1]) & (entries["key"][1:] == entries["key"][:-1])
+    bounds = np.flatnonzero(np.concatenate([[True], ~same, [True]]))
+    links = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if end - start < 2:
+            continue
+        ids = [int(record_id) for record_id in entries["id"][start:end]]
+        if entries["kind"][start] == EXACT_KIND:
+            links.extend((ids[0], other) for other in ids[1:])  # 完全相同是传递的，连到第一个就够了
+            continue
+        # 近似重复不传递：B、C 相似但都不像 A 时也要连上，所以桶内两两比较
+        group_signatures = signatures[ids]
+        local = UnionFind(len(ids))
+        for i in range(len(ids) - 1):
+            similar = np.mean(group_signatures[i + 1:] == group_signatures[i], axis=1) >= threshold
+            for j in np.flatnonzero(similar) + i + 1:
+                if local.find(i) != local.find(int(j)):
+                    local.union(i, int(j))
+                    links.append((ids[i], ids[j]))
+    return links
+
+
+class UnionFind:
+    def __init__(self, size):
+        self.parent = array("q", range(size))
+
+    def find(self, x):
+        parent = self.parent
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            # 小 id 做根，这样根就是最早出现的记录
+            if rb < ra:
+                ra, rb = rb, ra
+            self.parent[rb] = ra
 
-def process_one(record, model_name, port):
-    # 构造新 prompt
-    content = record["prompt"][0]["content"]
-    new_content = content.replace(ORIGINAL_INST, COT_INST)
-    # 注意：这里假设 prompt 是 list of dict，只改第一个
-    new_prompt = [{"role": record["prompt"][0]["role"], "content": new_content}]
-    
-    response = get_response(
-        new_prompt,
-        model_name=model_name,
-        port=port,
-        logout=True,
-        reasoning_effort="high"
-    )
-    
-    # 返回原始 record + 新字段
-    updated_record = {**record}
-    updated_record["gpt-oss-120b-response"] = response
-    return updated_record
 
 def main():
-    raw_path = "datasets/DAPO-Math-17k/data/dapo-math-100.jsonl"
-    output_path = "outputs/dapo-math-100_gpt-oss-120b.jsonl"
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-
-    # Step 1: Load all questions
-    with open(raw_path, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-    questions = [json.loads(line) for line in lines]
-
-    # Step 2: Build set of already processed indices
-    completed_indices = set()
-    if os.path.exists(output_path):
-        with open(output_path, "r", encoding="utf-8") as f:
-            for line in f:
-                if line.strip():
+    parser = argparse.ArgumentParser(description="Exact and MinHash-LSH near-duplicate removal for JSONL datasets.")
+    parser.add_argument("--inputs", type=str, nargs="+", required=True, help="JSONL files to deduplicate (jointly)")
+    parser.add_argument("--reference", type=str, nargs="*", default=[],
+                        help="JSONL files to decontaminate against; never written, their near-duplicates are dropped")
+    parser.add_argument("--output_dir", type=str, required=True, help="Directory for kept/dropped files and the report")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Estimated Jaccard similarity for near-duplicates (default: 0.8)")
+    parser.add_argument("--num_perm", type=int, default=128, help="MinHash permutations (default: 128)")
+    parser.add_argument("--ngram", type=int, default=5, help="Token n-gram size for shingles (default: 5)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (default: all CPUs)")
+    parser.add_argument("--chunk_size", type=int, default=2000, help="Records per worker task (default: 2000)")
+    parser.add_argument("--partitions", type=int, default=64, help="On-disk LSH partitions (default: 64)")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    work_dir = os.path.join(args.output_dir, ".dedup_tmp")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+
+    bands, rows = choose_bands(args.threshold, args.num_perm)
+    print(f"MinHash: {args.num_perm} permutations, {bands} bands x {rows} rows, threshold {args.threshold}")
+
+    # 参考集在前，这样 id < num_reference 的就是参考集记录
+    paths = list(args.reference) + list(args.inputs)
+    signatures_path = os.path.join(work_dir, "signatures.u32")
+    partition_paths = [os.path.join(work_dir, f"part-{i:04d}.bin") for i in range(args.partitions)]
+    exact_keys = array("Q")
+
+    # Step 1: hash everything, spill LSH bands to partitions
+    with Pool(args.workers, initializer=_init_worker, initargs=(args.num_perm, bands, rows, args.ngram)) as pool:
+        counts = []
+        partition_files = [open(p, "wb") for p in partition_paths]
+        num_records = 0
+        with open(signatures_path, "wb") as sig_file, tqdm(desc="Hashing") as pbar:
+            chunks = _iter_chunks(paths, args.chunk_size, counts)
+            for valid, exact, band_keys, signatures in imap_bounded(pool, _hash_chunk, chunks, 2 * args.workers):
+                n = len(exact)
+                ids = np.arange(num_records, num_records + n, dtype=np.int64)[valid]
+                num_records += n
+                exact_keys.extend(exact.tolist())
+                sig_file.write(signatures.tobytes())
+
+                exact, band_keys = exact[valid], band_keys[valid]
+                m = len(ids)
+                entries = np.empty(m * (bands + 1), dtype=ENTRY)
+                entries["kind"] = np.concatenate([np.full(m, EXACT_KIND)] + [np.full(m, b) for b in range(bands)])
+                entries["key"] = np.concatenate([exact] + [band_keys[:, b] for b in range(bands)])
+                entries["id"] = np.tile(ids, bands + 1)
+                # 同一 kind 的同一 key 一定落在同一个 partition
+                target = (entries["key"] ^ entries["kind"].astype(np.uint64)) % np.uint64(args.partitions)
+                order = np.argsort(target, kind="stable")
+                entries, target = entries[order], target[order]
+                bounds = np.searchsorted(target, np.arange(args.partitions + 1, dtype=np.uint64))
+                for p in range(args.partitions):
+                    if bounds[p] < bounds[p + 1]:
+                        partition_files[p].write(entries[bounds[p]:bounds[p + 1]].tobytes())
+                pbar.update(n)
+        for f in partition_files:
+            f.close()
+        file_starts = [sum(counts[:i]) for i in range(len(counts))]
+
+        # Step 2: group partitions in parallel, union verified links
+        union_find = UnionFind(num_records)
+        tasks = [(p, signatures_path, num_records, args.num_perm, args.threshold) for p in partition_paths]
+        for links in tqdm(pool.imap_unordered(_group_partition, tasks), total=len(tasks), desc="Grouping"):
+            for a, b in links:
+                union_find.union(a, b)
+
+    # Step 3: decide which records survive
+    num_reference = sum(counts[:len(args.reference)])
+    contaminated_roots = {union_find.find(i) for i in range(num_reference)}
+    kept_by_root = {}
+    clusters = {}
+    for i in range(num_reference, num_records):
+        root = union_find.find(i)
+        if root != i or root in contaminated_roots:
+            clusters.setdefault(root, []).append(i)
+        if root not in contaminated_roots:
+            kept_by_root.setdefault(root, i)
+
+    def locate(record_id):
+        file_idx = bisect_right(file_starts, record_id) - 1
+        return {"file": paths[file_idx], "line": record_id - file_starts[file_idx]}
+
+    def drop_reason(record_id):
+        root = union_find.find(record_id)
+        if root in contaminated_roots:
+            return "reference", root
+        keeper = kept_by_root[root]
+        if keeper == record_id:
+            return None, None
+        return ("exact" if exact_keys[keeper] == exact_keys[record_id] else "near"), keeper
+
+    # Step 4: stream inputs again into kept / dropped files
+    summary = {"threshold": args.threshold, "num_perm": args.num_perm, "bands": bands, "rows": rows, "files": {}}
+    record_id = num_reference
+    for path in args.inputs:
+        name = os.path.splitext(os.path.basename(path))[0]
+        stats = {"total": 0, "kept": 0, "exact": 0, "near": 0, "reference": 0}
+        kept_path = os.path.join(args.output_dir, f"{name}.kept.jsonl")
+        dropped_path = os.path.join(args.output_dir, f"{name}.dropped.jsonl")
+        with open(kept_path, "wb") as kept, open(dropped_path, "w", encoding="utf-8") as dropped:
+            for line in _iter_lines(path):
+                reason, other = drop_reason(record_id)
+                stats["total"] += 1
+                if reason is None:
+                    kept.write(line if line.endswith(b"\n") else line + b"\n")
+                    stats["kept"] += 1
+                else:
+                    stats[reason] += 1
                     try:
-                        rec = json.loads(line)
-                        idx = rec.get("extra_info", {}).get("index")
-                        if idx is not None:
-                            completed_indices.add(idx)
+                        record = json.loads(line)
                     except json.JSONDecodeError:
-                        continue  # skip corrupted lines
-
-    # Step 3: Filter out completed
-    pending_questions = [
-        q for q in questions
-        if q.get("extra_info", {}).get("index") not in completed_indices
-    ]
-
-    print(f"Total: {len(questions)}, Already done: {len(completed_indices)}, Pending: {len(pending_questions)}")
-
-    # Step 4: Concurrent processing
-    model_name = "gpt-oss-120b/"
-    port = 1145
-    max_workers = 32
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all pending tasks
-        future_to_record = {
-            executor.submit(process_one, record, model_name, port): record
-            for record in pending_questions
-        }
-
-        # Use tqdm to track progress
-        with tqdm(total=len(pending_questions), desc="Processing") as pbar:
-            with open(output_path, "a", encoding="utf-8") as fout:
-                for future in as_completed(future_to_record):
-                    try:
-                        result = future.result()
-                        # Write immediately (append mode)
-                        fout.write(json.dumps(result, ensure_ascii=False) + "\n")
-                        fout.flush()  # Ensure write is persisted
-                    except Exception as e:
-                        # Log error but don't crash
-                        record = future_to_record[future]
-                        idx = record.get("extra_info", {}).get("index", "unknown")
-                        print(f"\nError processing index={idx}: {e}")
-                    finally:
-                        pbar.update(1)
+                        record = {"raw": line.decode("utf-8", errors="replace")}
+                    record["dedup"] = {"reason": reason, "duplicate_of": locate(other)}
+                    dropped.write(json.dumps(record, ensure_ascii=False) + "\n")
+                record_id += 1
+        summary["files"][path] = stats
+        print(f"{path}: {stats}")
+
+    with open(os.path.join(args.output_dir, "clusters.jsonl"), "w", encoding="utf-8") as f:
+        for root, members in clusters.items():
+            contaminated = root in contaminated_roots
+            report = {
+                "kind": "reference" if contaminated else "duplicate",
+                "kept": None if contaminated else locate(kept_by_root[root]),
+                "reference": locate(root) if contaminated else None,
+                "dropped": [
+                    {**locate(m), "reason": drop_reason(m)[0]}
+                    for m in members if drop_reason(m)[0] is not None
+                ],
+            }
+            f.write(json.dumps(report, ensure_ascii=False) + "\n")
+    summary["clusters"] = len(clusters)
+    with open(os.path.join(args.output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
 
+    shutil.rmtree(work_dir, ignore_errors=True)
     print("All done.")
 
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,20 +1,228 @@
-from datasets import load_dataset
-import shutil
+"""
+Streaming ingestion of the Nemotron science split into collector-ready JSONL.
+
+Rows are streamed from local JSONL / Parquet files (--inputs), or from the JSONL in the local
+Hugging Face cache (--hf_repo / --hf_file, `--download` to fetch it first), and filtered on the
+fly in a process pool:
+- --categories: keep only these `category` values
+- --used_in_training: keep rows whose `used_in_training` lists one of these values
+  ("none" matches an empty field or "no")
+- a reference answer letter must be extractable from `output` (the same
+  `extract_answer_from_output` the science collector scores against; --keep_unanswered to skip)
+- --max_prompt_chars / --max_output_chars: length caps
+Kept rows are written unchanged plus `extra_info.index`, the row number in the source (over all
+--inputs, in order), so indices stay stable whatever the filters drop; batch-science.py uses it
+as the record key. Output goes to `<output_dir>/<name>.00000.jsonl`, `...00001.jsonl`, ... with
+--rows_per_shard rows each (0: a single `<name>.jsonl`). Nothing but the rows in flight is ever
+held in memory.
+
+Usage:
+    python -m src.data.nemotron_data --output_dir datasets/Nemotron-sft --max_prompt_chars 8000
+    python -m src.data.nemotron_data --inputs science.jsonl --output_dir datasets/Nemotron-sft --rows_per_shard 0
+"""
+import argparse
 import os
+from collections import Counter
+from multiprocessing import Pool
+
+from tqdm import tqdm
+
+from src.collect.records import RecordError, ScienceRecord, dumps, loads
+from src.utils.parallel import imap_bounded
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # only needed for Parquet inputs
+    pq = None
+
+HF_REPO = "nvidia/Llama-Nemotron-Post-Training-Dataset"
+HF_FILE = "SFT/science/science.jsonl"
+
+_filters = None
+
+
+def _init_worker(filters):
+    global _filters
+    _filters = filters
+
+
+def _used_in_training_values(value):
+    values = {part.strip().lower() for part in str(value or "").split(",") if part.strip()}
+    return values - {"no"} or {"none"}
+
+
+def _check(raw, filters):
+    """None if the row is kept, otherwise why it is dropped"""
+    try:
+        record = ScienceRecord.from_dict(raw)
+    except RecordError:
+        return "malformed"
+    if filters["categories"] and raw.get("category") not in filters["categories"]:
+        return "category"
+    if filters["used_in_training"] and not _used_in_training_values(raw.get("used_in_training")) & filters["used_in_training"]:
+        return "used_in_training"
+    if filters["require_answer"] and record.original_label is None:
+        return "no_answer"
+    if filters["max_prompt_chars"] and len(record.content) > filters["max_prompt_chars"]:
+        return "prompt_too_long"
+    if filters["max_output_chars"] and len(raw.get("output") or "") > filters["max_output_chars"]:
+        return "output_too_long"
+    return None
+
+
+def _filter_chunk(task):
+    """worker: (row number of the first row, JSONL lines or a Parquet record batch) -> (kept lines, drop counts)"""
+    start, rows = task
+    if not isinstance(rows, list):
+        rows = rows.to_pylist()
+    kept = []
+    dropped = Counter()
+    for offset, row in enumerate(rows):
+        if isinstance(row, bytes):
+            try:
+                row = loads(row)
+            except ValueError:
+                dropped["invalid_json"] += 1
+                continue
+        reason = _check(row, _filters)
+        if reason is not None:
+            dropped[reason] += 1
+            continue
+        extra_info = row.get("extra_info")
+        row["extra_info"] = {**(extra_info if isinstance(extra_info, dict) else {}), "index": start + offset}
+        kept.append(dumps(row) + b"\n")
+    return kept, dropped
+
+
+def _iter_tasks(paths, batch_size):
+    """(row number of the first row, rows) over every input in order; blank JSONL lines are not rows"""
+    start = 0
+    for path in paths:
+        if path.endswith(".parquet"):
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+                yield start, batch
+                start += batch.num_rows
+            continue
+        with open(path, "rb") as f:
+            lines = []
+            for line in f:
+                if line.strip():
+                    lines.append(line)
+                if len(lines) >= batch_size:
+                    yield start, lines
+                    start += len(lines)
+                    lines = []
+            if lines:
+                yield start, lines
+                start += len(lines)
+
+
+def resolve_hf_file(repo, filename, download=False):
+    """Local path of a dataset file in the Hugging Face cache (fetched first with `download`)"""
+    from huggingface_hub import hf_hub_download  # 只有从 HF 缓存读时才需要
+
+    return hf_hub_download(repo, filename, repo_type="dataset", local_files_only=not download)
+
+
+class _ShardedOutput:
+    """Rolls to a new `<name>.<i>.jsonl` every `rows_per_shard` rows (0: one `<name>.jsonl`)"""
+
+    def __init__(self, output_dir, name, rows_per_shard):
+        self.output_dir = output_dir
+        self.name = name
+        self.rows_per_shard = rows_per_shard
+        self.paths = []
+        self.rows = 0
+        self._file = None
+        self._shard_rows = 0
+
+    def _open(self):
+        if self.rows_per_shard > 0:
+            path = os.path.join(self.output_dir, f"{self.name}.{len(self.paths):05d}.jsonl")
+        else:
+            path = os.path.join(self.output_dir, f"{self.name}.jsonl")
+        self.paths.append(path)
+        self._file = open(path + ".tmp", "wb")
+        self._shard_rows = 0
+
+    def _close_shard(self):
+        self._file.close()
+        os.replace(self.paths[-1] + ".tmp", self.paths[-1])  # 写完才改名，半截的分片不会被当成输入
+        self._file = None
+
+    def write(self, lines):
+        pos = 0
+        while pos < len(lines):
+            if self._file is None:
+                self._open()
+            room = self.rows_per_shard - self._shard_rows if self.rows_per_shard > 0 else len(lines)
+            chunk = lines[pos:pos + room]
+            self._file.write(b"".join(chunk))
+            self._shard_rows += len(chunk)
+            self.rows += len(chunk)
+            pos += len(chunk)
+            if self.rows_per_shard > 0 and self._shard_rows >= self.rows_per_shard:
+                self._close_shard()
+
+    def close(self):
+        if self._file is None and not self.paths:
+            self._open()  # 一行都没留下也写一个空文件
+        if self._file is not None:
+            self._close_shard()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream, filter and shard the Nemotron science data for batch-science.py.")
+    parser.add_argument("--inputs", type=str, nargs="*", default=[],
+                        help="Local JSONL / Parquet files, read in order (default: the file from the Hugging Face cache)")
+    parser.add_argument("--hf_repo", type=str, default=HF_REPO, help=f"Dataset repo without --inputs (default: {HF_REPO})")
+    parser.add_argument("--hf_file", type=str, default=HF_FILE, help=f"File in the repo (default: {HF_FILE})")
+    parser.add_argument("--download", action="store_true", help="Download --hf_file if it is not in the local cache")
+    parser.add_argument("--output_dir", type=str, required=True, help="Output directory")
+    parser.add_argument("--name", type=str, default="science", help="Output file stem (default: science)")
+    parser.add_argument("--rows_per_shard", type=int, default=100000,
+                        help="Kept rows per output shard, 0 for a single file (default: 100000)")
+    parser.add_argument("--categories", type=str, nargs="*", default=[], help="Keep only these categories (default: all)")
+    parser.add_argument("--used_in_training", type=str, nargs="*", default=[],
+                        help="Keep only rows whose used_in_training lists one of these values; 'none' matches "
+                             "rows not used in training (default: all)")
+    parser.add_argument("--keep_unanswered", action="store_true",
+                        help="Keep rows without an extractable answer letter in `output`")
+    parser.add_argument("--max_prompt_chars", type=int, default=0, help="Drop rows with a longer user prompt (default: 0, off)")
+    parser.add_argument("--max_output_chars", type=int, default=0,
+                        help="Drop rows with a longer reference output (default: 0, off)")
+    parser.add_argument("--batch_size", type=int, default=2000, help="Rows per worker task (default: 2000)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (default: all CPUs)")
+    args = parser.parse_args()
+
+    paths = args.inputs or [resolve_hf_file(args.hf_repo, args.hf_file, args.download)]
+    if pq is None and any(path.endswith(".parquet") for path in paths):
+        parser.error("Parquet inputs need the `pyarrow` package: pip install pyarrow")
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    filters = {
+        "categories": set(args.categories),
+        "used_in_training": {value.lower() for value in args.used_in_training},
+        "require_answer": not args.keep_unanswered,
+        "max_prompt_chars": args.max_prompt_chars,
+        "max_output_chars": args.max_output_chars,
+    }
+    output = _ShardedOutput(args.output_dir, args.name, args.rows_per_shard)
+    dropped = Counter()
+    rows = 0
+    with Pool(args.workers, initializer=_init_worker, initargs=(filters,)) as pool, \
+            tqdm(desc="Ingesting", unit=" rows") as pbar:
+        for kept, chunk_dropped in imap_bounded(pool, _filter_chunk, _iter_tasks(paths, args.batch_size), 2 * args.workers):
+            output.write(kept)
+            dropped.update(chunk_dropped)
+            rows += len(kept) + sum(chunk_dropped.values())
+            pbar.update(len(kept) + sum(chunk_dropped.values()))
+    output.close()
+
+    print(f"Read {rows} rows from {len(paths)} file(s), kept {output.rows}, dropped {sum(dropped.values())} "
+          f"{dict(dropped.most_common())}")
+    print(f"Saved to {output.paths[0]}" + (f" ... ({len(output.paths)} shards)" if len(output.paths) > 1 else ""))
+
 
-# 目标保存路径
-save_path = "/home/disk1/jiangdazhi/research/math-oss-reasoning/datasets/Nemotron-sft/science.jsonl"
-# 加载数据集（指定具体文件）
-ds = load_dataset(
-    "nvidia/Llama-Nemotron-Post-Training-Dataset",
-    data_files={"train": "SFT/science/science.jsonl"},
-    split="train"
-)
-# 先保存到临时目录，再移动到指定路径
-temp_path = ds.to_json(save_path + ".tmp")
-shutil.move(temp_path, save_path)
-# 验证文件
-if os.path.exists(save_path):
-    print(f"文件下载成功，路径：{save_path}，文件大小：{os.path.getsize(save_path)/1024/1024:.2f} MB")
-else:
-    print("文件下载失败")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
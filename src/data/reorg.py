@@ -1,22 +1,209 @@
-import pandas as pd
+"""
+Streaming Parquet -> JSONL conversion for the collector inputs.
+
+The Parquet file is read in record batches (never the whole table), batches are encoded to
+JSON lines in a process pool, and every requested output is written in the same single pass:
+- `<name>.jsonl`: all rows (skip with --no_full)
+- `<name>.head<N>.jsonl`: the first --head rows
+- `<name>.sample<N>.jsonl`: a uniform random sample of --sample rows (reservoir sampling, in input order)
+- `<name>.<i>-of-<N>.jsonl`: --shards contiguous shards of (almost) equal size
+--assign_index sets `extra_info.index` to the row number, which the collectors use as the resume key.
+
+Memory is bounded by --batch_size rows x the batches in flight (plus the --sample reservoir).
+
+Usage:
+    python -m src.data.reorg --input datasets/DAPO-Math-17k/data/dapo-math-17k.parquet \
+        --head 100 --head_output datasets/DAPO-Math-17k/data/dapo-math-100.jsonl
+"""
+import argparse
+import json
 import os
+import random
+from multiprocessing import Pool
+
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from src.utils.parallel import imap_bounded
+
+_assign_index = False
+
+
+def _init_worker(assign_index):
+    global _assign_index
+    _assign_index = assign_index
+
+
+def _encode_batch(task):
+    """worker: (record batch, row number of its first row) -> one JSON line (bytes) per row"""
+    batch, start = task
+    lines = []
+    for offset, row in enumerate(batch.to_pylist()):
+        if _assign_index:
+            extra_info = row.get("extra_info")
+            if not isinstance(extra_info, dict):
+                extra_info = row["extra_info"] = {}
+            extra_info["index"] = start + offset
+        # default=str：日期、Decimal 之类 JSON 没有的类型转成字符串
+        lines.append((json.dumps(row, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+    return lines
+
+
+def _iter_batches(parquet_file, batch_size):
+    start = 0
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        yield batch, start
+        start += batch.num_rows
+
+
+class _FullOutput:
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self._file = open(path, "wb")
+
+    def write(self, start, lines):
+        self._file.write(b"".join(lines))
+        self.rows += len(lines)
+
+    def close(self):
+        self._file.close()
+
+
+class _HeadOutput:
+    def __init__(self, path, limit):
+        self.path = path
+        self.limit = limit
+        self.rows = 0
+        self._file = open(path, "wb")
+
+    def write(self, start, lines):
+        if self.rows < self.limit:
+            lines = lines[:self.limit - self.rows]
+            self._file.write(b"".join(lines))
+            self.rows += len(lines)
+
+    def close(self):
+        self._file.close()
+
+
+class _ShardOutput:
+    """Row r goes to shard i with bounds[i] <= r < bounds[i + 1]"""
+
+    def __init__(self, path_pattern, num_shards, num_rows):
+        self.paths = [path_pattern.format(i=i, n=num_shards) for i in range(num_shards)]
+        self.bounds = [i * num_rows // num_shards for i in range(num_shards + 1)]
+        self.rows = [0] * num_shards
+        self._shard = 0
+        self._file = open(self.paths[0], "wb")
+
+    def write(self, start, lines):
+        pos = 0
+        while pos < len(lines):
+            row = start + pos
+            while self._shard < len(self.paths) - 1 and row >= self.bounds[self._shard + 1]:
+                self._file.close()
+                self._shard += 1
+                self._file = open(self.paths[self._shard], "wb")
+            end = len(lines) if self._shard == len(self.paths) - 1 else min(len(lines), self.bounds[self._shard + 1] - start)
+            self._file.write(b"".join(lines[pos:end]))
+            self.rows[self._shard] += end - pos
+            pos = end
+
+    def close(self):
+        self._file.close()
+        # 行数少于分片数时后面的分片是空的，也建出来，下游按 i-of-N 找文件不会缺
+        for path in self.paths[self._shard + 1:]:
+            open(path, "wb").close()
+
+
+class _SampleOutput:
+    """Reservoir sampling (Algorithm R); written in input order on close"""
+
+    def __init__(self, path, size, seed):
+        self.path = path
+        self.size = size
+        self.rows = 0
+        self._reservoir = []
+        self._rng = random.Random(seed)
+
+    def write(self, start, lines):
+        for offset, line in enumerate(lines):
+            row = start + offset
+            if len(self._reservoir) < self.size:
+                self._reservoir.append((row, line))
+            else:
+                slot = self._rng.randrange(row + 1)
+                if slot < self.size:
+                    self._reservoir[slot] = (row, line)
+
+    def close(self):
+        self._reservoir.sort()
+        with open(self.path, "wb") as f:
+            f.write(b"".join(line for _, line in self._reservoir))
+        self.rows = len(self._reservoir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a Parquet dataset to JSONL (full / head / sample / shards) in one pass.")
+    parser.add_argument("--input", type=str, required=True, help="Parquet file")
+    parser.add_argument("--output_dir", type=str, default=None, help="Output directory (default: next to --input)")
+    parser.add_argument("--name", type=str, default=None, help="Output file stem (default: --input file name without extension)")
+    parser.add_argument("--no_full", action="store_true", help="Do not write the full <name>.jsonl")
+    parser.add_argument("--head", type=int, default=0, help="Also write the first N rows (default: 0, off)")
+    parser.add_argument("--head_output", type=str, default=None, help="Path for --head (default: <name>.head<N>.jsonl)")
+    parser.add_argument("--sample", type=int, default=0, help="Also write a uniform random sample of N rows (default: 0, off)")
+    parser.add_argument("--sample_output", type=str, default=None, help="Path for --sample (default: <name>.sample<N>.jsonl)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for --sample (default: 0)")
+    parser.add_argument("--shards", type=int, default=0, help="Also split into N contiguous shards (default: 0, off)")
+    parser.add_argument("--assign_index", action="store_true",
+                        help="Set extra_info.index to the row number (overwrites existing values)")
+    parser.add_argument("--batch_size", type=int, default=4096, help="Rows per Parquet batch / worker task (default: 4096)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes for JSON encoding (default: all CPUs)")
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.input))
+    name = args.name or os.path.splitext(os.path.basename(args.input))[0]
+    os.makedirs(output_dir, exist_ok=True)
+
+    parquet_file = pq.ParquetFile(args.input)
+    num_rows = parquet_file.metadata.num_rows
+    print(f"Total rows in {args.input}: {num_rows} ({parquet_file.metadata.num_row_groups} row groups)")
+
+    outputs = []
+    if not args.no_full:
+        outputs.append(_FullOutput(os.path.join(output_dir, f"{name}.jsonl")))
+    if args.head > 0:
+        outputs.append(_HeadOutput(args.head_output or os.path.join(output_dir, f"{name}.head{args.head}.jsonl"), args.head))
+    if args.sample > 0:
+        outputs.append(_SampleOutput(args.sample_output or os.path.join(output_dir, f"{name}.sample{args.sample}.jsonl"),
+                                     args.sample, args.seed))
+    if args.shards > 0:
+        outputs.append(_ShardOutput(os.path.join(output_dir, f"{name}.{{i:05d}}-of-{{n:05d}}.jsonl"), args.shards, num_rows))
+    if not outputs:
+        parser.error("nothing to write: drop --no_full or pass --head / --sample / --shards")
+
+    start = 0
+    with Pool(args.workers, initializer=_init_worker, initargs=(args.assign_index,)) as pool, \
+            tqdm(total=num_rows, desc="Converting") as pbar:
+        tasks = _iter_batches(parquet_file, args.batch_size)
+        for lines in imap_bounded(pool, _encode_batch, tasks, 2 * args.workers):
+            for output in outputs:
+                output.write(start, lines)
+            start += len(lines)
+            pbar.update(len(lines))
+            if all(isinstance(output, _HeadOutput) for output in outputs) and start >= args.head:
+                break  # 只要 head 时不必读完整个文件
+    for output in outputs:
+        output.close()
+
+    for output in outputs:
+        if isinstance(output, _ShardOutput):
+            print(f"Saved {len(output.paths)} shards ({min(output.rows)}-{max(output.rows)} rows each): "
+                  f"{output.paths[0]} ...")
+        else:
+            print(f"Saved {output.rows} rows to {output.path}")
+
 
-# 1. 读取 Parquet 文件并统计行数
-parquet_path = "datasets/DAPO-Math-17k/data/dapo-math-17k.parquet"
-df = pd.read_parquet(parquet_path)
-num_rows = len(df)
-print(f"Total rows in {parquet_path}: {num_rows}")
-
-# 确保输出目录存在
-output_dir = "datasets/DAPO-Math-17k/data"
-os.makedirs(output_dir, exist_ok=True)
-
-# 2. 保存前 100 行为 JSONL
-first_100_path = os.path.join(output_dir, "dapo-math-100.jsonl")
-df.head(100).to_json(first_100_path, orient="records", lines=True)
-print(f"Saved first 100 rows to {first_100_path}")
-
-# 3. 保存全部数据为 JSONL
-full_jsonl_path = os.path.join(output_dir, "dapo-math-17k.jsonl")
-df.to_json(full_jsonl_path, orient="records", lines=True)
-print(f"Saved full dataset to {full_jsonl_path}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""AIMD concurrency limit driven by request latency, errors and vLLM queue depth"""
+import re
+import threading
+
+import httpx
+
+from src.utils.endpoints import is_endpoint_failure
+
+_WAITING_RE = re.compile(r"^vllm:num_requests_waiting(?:\{[^}]*\})?\s+([0-9.eE+-]+)", re.MULTILINE)
+
+
+def parse_waiting(metrics_text: str) -> float:
+    """Sum `vllm:num_requests_waiting` over all label sets in a Prometheus /metrics page"""
+    return sum(float(value) for value in _WAITING_RE.findall(metrics_text))
+
+
+class AdaptiveConcurrency:
+    """
+    Additive-increase / multiplicative-decrease limit on in-flight requests.
+
+    - After a full round (`limit` completions) with healthy latency and an empty server
+      queue, the limit grows: doubling until the first decrease (slow start), by
+      `increase` afterwards.
+    - An endpoint failure (connection, timeout, 5xx), a latency EWMA above
+      `latency_tolerance` x the (slowly drifting) best EWMA, or more than `max_waiting`
+      requests queued on the servers shrinks it by `decrease`, at most once per round.
+
+    Queue depth is read from each server's `/metrics` page by a background thread when
+    `metrics_urls` is given. Thread-safe.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int = 1,
+        max_limit: int = 512,
+        increase: int = 1,
+        decrease: float = 0.7,
+        latency_tolerance: float = 2.0,
+        max_waiting: int = 16,
+        metrics_urls: list[str] | None = None,
+        metrics_interval: float = 5.0,
+        ewma_alpha: float = 0.1,
+        baseline_drift: float = 0.01,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self._limit = min(max(initial, self.min_limit), self.max_limit)
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.max_waiting = max_waiting
+        self.metrics_urls = metrics_urls or []
+        self.metrics_interval = metrics_interval
+        self.ewma_alpha = ewma_alpha
+        self.baseline_drift = baseline_drift
+        self.latency_ewma = None
+        self.best_latency = None
+        self.waiting = None
+        self._since_change = 0
+        self._slow_start = True
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._poll_thread = None
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    def record(self, latency: float, error: BaseException | None = None):
+        """每个请求结束时调用一次"""
+        with self._lock:
+            self._since_change += 1
+            if error is not None:
+                if is_endpoint_failure(error):
+                    self._shrink()
+                return
+
+            if self.latency_ewma is None:
+                self.latency_ewma = latency
+            else:
+                self.latency_ewma = self.ewma_alpha * latency + (1 - self.ewma_alpha) * self.latency_ewma
+            if self.best_latency is None or self.latency_ewma < self.best_latency:
+                self.best_latency = self.latency_ewma
+            else:
+                # 基线缓慢跟随持续的变化（比如后面的题目本身更难、更长）
+                self.best_latency += self.baseline_drift * (self.latency_ewma - self.best_latency)
+
+            if self.latency_ewma > self.best_latency * self.latency_tolerance:
+                self._shrink()
+            elif self.waiting is not None and self.waiting > self.max_waiting:
+                self._shrink()
+            elif self.waiting is None or self.waiting == 0:
+                # 服务端有排队时保持不变，没有排队（或拿不到指标）才继续加
+                self._grow()
+
+    def _grow(self):
+        if self._since_change >= self._limit and self._limit < self.max_limit:
+            step = self._limit if self._slow_start else self.increase
+            self._limit = min(self.max_limit, self._limit + step)
+            self._since_change = 0
+
+    def _shrink(self):
+        # 一轮之内只降一次，避免同一批超时把 limit 压到底
+        if self._since_change >= self._limit and self._limit > self.min_limit:
+            self._limit = max(self.min_limit, int(self._limit * self.decrease))
+            self._since_change = 0
+            self._slow_start = False
+
+    def poll_metrics(self):
+        total = 0.0
+        seen = False
+        for url in self.metrics_urls:
+            try:
+                response = httpx.get(url, timeout=5.0)
+                if response.status_code == 200:
+                    total += parse_waiting(response.text)
+                    seen = True
+            except httpx.HTTPError:
+                continue
+        with self._lock:
+            self.waiting = total if seen else None
+
+    def _poll_loop(self):
+        while not self._stop.wait(self.metrics_interval):
+            self.poll_metrics()
+
+    def start(self):
+        if self.metrics_urls and self._poll_thread is None:
+            self._poll_thread = threading.Thread(target=self._poll_loop, daemon=True)
+            self._poll_thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._poll_thread is not None:
+            self._poll_thread.join()
+            self._poll_thread = None
+
+    def status(self) -> dict:
+        status = {"concurrency": self._limit}
+        if self.waiting is not None:
+            status["waiting"] = int(self.waiting)
+        return status
@@ -0,0 +1,200 @@
+"""Least-outstanding-requests load balancing over several vLLM servers"""
+import contextvars
+import threading
+from contextlib import contextmanager
+
+import httpx
+import openai
+
+
+def parse_endpoints(spec: str | None, default_port: int = 1145) -> list[str]:
+    """'host:port,host:port' -> ['http://host:port/v1', ...]; empty spec -> localhost:default_port"""
+    if not spec:
+        return [f"http://localhost:{default_port}/v1"]
+    base_urls = []
+    for item in spec.split(","):
+        item = item.strip().rstrip("/")
+        if not item:
+            continue
+        if not item.startswith(("http://", "https://")):
+            item = f"http://{item}"
+        if not item.endswith("/v1"):
+            item = f"{item}/v1"
+        base_urls.append(item)
+    return base_urls
+
+
+def is_endpoint_failure(error: BaseException) -> bool:
+    """连接失败、超时和 5xx 算 endpoint 的问题；4xx 和解析错误不算"""
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return False
+
+
+class Routing:
+    """
+    Per-record routing state, installed with `routed()` around one attempt at a record:
+    the endpoints it has used so far, and endpoints to stay away from (a hedged re-issue
+    avoids the endpoint the straggling original is running on).
+    """
+
+    __slots__ = ("avoid", "used", "hedge")
+
+    def __init__(self, avoid=(), hedge=False):
+        self.avoid = frozenset(avoid)
+        self.used = []
+        self.hedge = hedge
+
+
+_routing = contextvars.ContextVar("endpoint_routing", default=None)
+
+
+@contextmanager
+def routed(routing: Routing):
+    """Requests made in this context (this thread / asyncio task) follow `routing`"""
+    token = _routing.set(routing)
+    try:
+        yield routing
+    finally:
+        _routing.reset(token)
+
+
+def hedging() -> bool:
+    """True inside a hedged re-issue; it must not be coalesced with the original request"""
+    routing = _routing.get()
+    return routing is not None and routing.hedge
+
+
+class Endpoint:
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        root_url = base_url.rsplit("/v1", 1)[0]
+        self.health_url = root_url + "/health"
+        self.metrics_url = root_url + "/metrics"
+        self.outstanding = 0
+        self.served = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected = False
+
+    def __repr__(self):
+        state = "ejected" if self.ejected else "ok"
+        return (f"{self.base_url} [{state}] outstanding={self.outstanding} "
+                f"served={self.served} failures={self.failures}")
+
+
+class EndpointPool:
+    """
+    Routes each request to the healthy endpoint with the fewest outstanding requests.
+
+    An endpoint is ejected after `max_failures` consecutive failures (requests or health
+    checks) and re-admitted once its `/health` check passes again. If every endpoint is
+    ejected, requests still go to the least loaded one rather than failing outright.
+    Thread-safe; `acquire`/`release` never block, so they can be used from asyncio too.
+    """
+
+    def __init__(
+        self,
+        base_urls: list[str],
+        max_failures: int = 3,
+        health_interval: float = 10.0,
+        health_timeout: float = 5.0,
+    ):
+        if not base_urls:
+            raise ValueError("EndpointPool needs at least one endpoint")
+        self.endpoints = [Endpoint(url) for url in base_urls]
+        self.max_failures = max_failures
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread = None
+
+    def acquire(self) -> Endpoint:
+        routing = _routing.get()
+        with self._lock:
+            candidates = [ep for ep in self.endpoints if not ep.ejected] or self.endpoints
+            if routing is not None and routing.avoid:
+                candidates = [ep for ep in candidates if ep.base_url not in routing.avoid] or candidates
+            endpoint = min(candidates, key=lambda ep: ep.outstanding)
+            endpoint.outstanding += 1
+        if routing is not None:
+            routing.used.append(endpoint.base_url)
+        return endpoint
+
+    def release(self, endpoint: Endpoint, error: BaseException | None = None):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if error is not None and is_endpoint_failure(error):
+                self._record_failure(endpoint)
+            else:
+                endpoint.served += 1
+                endpoint.consecutive_failures = 0
+
+    @contextmanager
+    def lease(self):
+        endpoint = self.acquire()
+        try:
+            yield endpoint
+        except BaseException as e:
+            self.release(endpoint, e)
+            raise
+        else:
+            self.release(endpoint)
+
+    def _record_failure(self, endpoint: Endpoint):
+        endpoint.failures += 1
+        endpoint.consecutive_failures += 1
+        if not endpoint.ejected and endpoint.consecutive_failures >= self.max_failures:
+            endpoint.ejected = True
+            print(f"\nEjecting endpoint {endpoint.base_url} after {endpoint.consecutive_failures} failures")
+
+    def check_health(self, eject_unhealthy: bool = False):
+        """对所有 endpoint 做一次 /health 检查；eject_unhealthy 时失败一次就直接摘除"""
+        for endpoint in self.endpoints:
+            try:
+                healthy = httpx.get(endpoint.health_url, timeout=self.health_timeout).status_code == 200
+            except httpx.HTTPError:
+                healthy = False
+            with self._lock:
+                if healthy:
+                    endpoint.consecutive_failures = 0
+                    if endpoint.ejected:
+                        endpoint.ejected = False
+                        print(f"\nRe-admitting endpoint {endpoint.base_url}")
+                elif eject_unhealthy and not endpoint.ejected:
+                    endpoint.failures += 1
+                    endpoint.ejected = True
+                    print(f"Endpoint {endpoint.base_url} failed its initial health check, ejecting")
+                else:
+                    self._record_failure(endpoint)
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_interval):
+            self.check_health()
+
+    def start(self):
+        """Eject endpoints that are already down, then keep checking in the background"""
+        if self.health_interval > 0 and self._health_thread is None:
+            self.check_health(eject_unhealthy=True)
+            self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+            self._health_thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._health_thread is not None:
+            self._health_thread.join()
+            self._health_thread = None
+
+    def summary(self) -> str:
+        with self._lock:
+            return "\n".join(repr(ep) for ep in self.endpoints)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
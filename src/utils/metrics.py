@@ -0,0 +1,237 @@
+"""
+Request-level metrics for the collection runs.
+
+`RunMetrics` is fed by VLLMBackend (one `RequestTimer` per request sent to a server) and by
+ResultWriter (time spent committing output). It keeps running totals plus a window of recent
+latencies for percentiles, and can periodically dump a JSON summary and a Prometheus text file
+(for node_exporter's textfile collector or a quick `cat`).
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    pos = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[pos]
+
+
+def _write_atomic(path, text):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class RequestTimer:
+    """Times one request; `finish(generation)` or `fail(error)` must be called exactly once"""
+
+    def __init__(self, metrics, reasoning_effort):
+        self.metrics = metrics
+        self.reasoning_effort = reasoning_effort
+        self.start = time.monotonic()
+        if metrics is not None:
+            metrics.request_started()
+
+    def finish(self, generation, first_token_at=None):
+        generation.latency = time.monotonic() - self.start
+        if first_token_at is not None:
+            generation.first_token = first_token_at - self.start
+        if self.metrics is not None:
+            self.metrics.request_finished(generation, self.reasoning_effort)
+        return generation
+
+    def fail(self, error):
+        if self.metrics is not None:
+            self.metrics.request_failed(error, time.monotonic() - self.start)
+
+
+class RunMetrics:
+    def __init__(self, window: int = 10000, json_path: str | None = None, prom_path: str | None = None,
+                 interval: float = 30.0, prefix: str = "collect"):
+        self.json_path = json_path
+        self.prom_path = prom_path
+        self.interval = interval
+        self.prefix = prefix
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._first_tokens = deque(maxlen=window)
+        self.requests = 0
+        self.in_flight = 0
+        self.errors = Counter()
+        self.hedge_cancelled = 0
+        self.stop_reasons = Counter()
+        self.cache_hits = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.server_seconds = 0.0
+        self.write_seconds = 0.0
+        self.written = 0
+        self._reasoning = defaultdict(lambda: [0, 0, 0])  # effort -> [responses, reasoning tokens, max]
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- recording -------------------------------------------------------------
+
+    def timer(self, reasoning_effort) -> RequestTimer:
+        return RequestTimer(self, reasoning_effort)
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self, generation, reasoning_effort):
+        with self._lock:
+            self.in_flight -= 1
+            self.requests += 1
+            self.server_seconds += generation.latency
+            self._latencies.append(generation.latency)
+            if generation.first_token is not None:
+                self._first_tokens.append(generation.first_token)
+            self.stop_reasons[generation.stop_reason or "completed"] += 1
+            self.input_tokens += generation.input_tokens or 0
+            self.output_tokens += generation.output_tokens or 0
+            if generation.reasoning_tokens is not None:
+                stats = self._reasoning[reasoning_effort]
+                stats[0] += 1
+                stats[1] += generation.reasoning_tokens
+                stats[2] = max(stats[2], generation.reasoning_tokens)
+
+    def request_failed(self, error, latency):
+        with self._lock:
+            self.in_flight -= 1
+            self.requests += 1
+            self.server_seconds += latency
+            if isinstance(error, asyncio.CancelledError):
+                self.hedge_cancelled += 1  # 对冲输掉被取消的请求，不是失败
+            else:
+                self.errors[type(error).__name__] += 1
+
+    def cache_hit(self):
+        with self._lock:
+            self.cache_hits += 1
+
+    def record_write(self, seconds, records):
+        with self._lock:
+            self.write_seconds += seconds
+            self.written += records
+
+    # --- reporting -------------------------------------------------------------
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            first_tokens = sorted(self._first_tokens)
+            wall = time.time() - self.started
+            return {
+                "wall_seconds": wall,
+                "requests": self.requests,
+                "in_flight": self.in_flight,
+                "errors": dict(self.errors),
+                "error_rate": sum(self.errors.values()) / self.requests if self.requests else 0.0,
+                "hedge_cancelled": self.hedge_cancelled,
+                "stop_reasons": dict(self.stop_reasons),
+                "cache_hits": self.cache_hits,
+                "latency_seconds": {f"p{int(q * 100)}": _percentile(latencies, q) for q in QUANTILES},
+                "first_token_seconds": {f"p{int(q * 100)}": _percentile(first_tokens, q) for q in QUANTILES},
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "output_tokens_per_second": self.output_tokens / wall if wall > 0 else 0.0,
+                "reasoning_tokens": {
+                    effort: {"responses": n, "mean": total / n if n else 0.0, "max": peak}
+                    for effort, (n, total, peak) in self._reasoning.items()
+                },
+                # server_seconds 是所有并发请求耗时之和；write_seconds 是写线程提交输出花的时间
+                "server_seconds": self.server_seconds,
+                "write_seconds": self.write_seconds,
+                "written": self.written,
+            }
+
+    def summary(self) -> str:
+        snap = self.snapshot()
+        latency = snap["latency_seconds"]
+        if latency["p50"] is None:
+            return f"Requests: {snap['requests']}, cache hits: {snap['cache_hits']}"
+        return (
+            f"Requests: {snap['requests']} (errors {sum(snap['errors'].values())}, "
+            + (f"hedge cancelled {snap['hedge_cancelled']}, " if snap["hedge_cancelled"] else "")
+            + f"cache hits {snap['cache_hits']}), "
+            f"latency p50/p95/p99 {latency['p50']:.1f}/{latency['p95']:.1f}/{latency['p99']:.1f}s, "
+            f"output {snap['output_tokens_per_second']:.0f} tok/s, write {snap['write_seconds']:.1f}s "
+            f"of {snap['wall_seconds']:.0f}s wall"
+        )
+
+    def prometheus(self) -> str:
+        snap = self.snapshot()
+        p = self.prefix
+        lines = []
+
+        def metric(name, kind, value, labels=None):
+            if value is None:
+                return
+            if not any(line.startswith(f"# TYPE {p}_{name} ") for line in lines):
+                lines.append(f"# TYPE {p}_{name} {kind}")
+            label_text = "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}" if labels else ""
+            lines.append(f"{p}_{name}{label_text} {value}")
+
+        metric("requests_total", "counter", snap["requests"])
+        metric("in_flight", "gauge", snap["in_flight"])
+        for error, count in snap["errors"].items():
+            metric("request_errors_total", "counter", count, {"type": error})
+        metric("hedge_cancelled_total", "counter", snap["hedge_cancelled"])
+        for reason, count in snap["stop_reasons"].items():
+            metric("stop_reason_total", "counter", count, {"reason": reason})
+        metric("cache_hits_total", "counter", snap["cache_hits"])
+        for key, value in snap["latency_seconds"].items():
+            metric("request_latency_seconds", "summary", value, {"quantile": int(key[1:]) / 100})
+        for key, value in snap["first_token_seconds"].items():
+            metric("first_token_seconds", "summary", value, {"quantile": int(key[1:]) / 100})
+        metric("input_tokens_total", "counter", snap["input_tokens"])
+        metric("output_tokens_total", "counter", snap["output_tokens"])
+        metric("output_tokens_per_second", "gauge", snap["output_tokens_per_second"])
+        for effort, stats in snap["reasoning_tokens"].items():
+            metric("reasoning_tokens_mean", "gauge", stats["mean"], {"effort": effort})
+            metric("reasoning_tokens_max", "gauge", stats["max"], {"effort": effort})
+        metric("server_seconds_total", "counter", snap["server_seconds"])
+        metric("write_seconds_total", "counter", snap["write_seconds"])
+        metric("written_total", "counter", snap["written"])
+        metric("wall_seconds", "gauge", snap["wall_seconds"])
+        return "\n".join(lines) + "\n"
+
+    def dump(self):
+        if self.json_path:
+            _write_atomic(self.json_path, json.dumps(self.snapshot(), ensure_ascii=False, indent=2))
+        if self.prom_path:
+            _write_atomic(self.prom_path, self.prometheus())
+
+    def start(self):
+        if self._thread is None and (self.json_path or self.prom_path) and self.interval > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="run-metrics", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.dump()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.dump()
+            except OSError as e:
+                print(f"\nFailed to write metrics: {e}")
@@ -0,0 +1,17 @@
+"""Process-pool helpers for the offline data tools"""
+from collections import deque
+
+
+def imap_bounded(pool, func, iterable, max_pending):
+    """
+    Like `pool.imap(func, iterable)` (results in input order), but keeps at most `max_pending`
+    tasks submitted. `Pool.imap` drains the whole input iterator up front, which for
+    multi-GB JSONL means holding every chunk in memory.
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
@@ -1,36 +1,544 @@
-from openai import OpenAI
+import asyncio
+import socket
+import threading
+import time
+from concurrent.futures import Future
 
+import httpx
+from openai import AsyncOpenAI, OpenAI
 
-def get_response(
-    user_prompt: str,
-    model_name: str = "gpt-oss-120b",
-    port: int = 8000,
-    logout: bool = True,
-    reasoning_effort: str = "medium",
-):
-    client = OpenAI(
-        base_url=f"http://localhost:{port}/v1",
-        api_key="EMPTY",
-    )
+from src.utils.endpoints import EndpointPool, hedging
+from src.utils.metrics import RequestTimer, RunMetrics
+from src.utils.response_cache import ResponseCache, cache_key
 
-    response = client.responses.create(
-        model=model_name,
-        instructions="You are a helfpul assistant.",
-        input=user_prompt,
-        reasoning={"effort": reasoning_effort},
-    )
+DEFAULT_INSTRUCTIONS = "You are a helfpul assistant."
+REASONING_EFFORTS = ["low", "medium", "high"]
+TRUNCATION_REASONS = ("max_output_tokens", "time_budget", "incomplete")
+
+
+class GenerationFailed(RuntimeError):
+    """服务端在流里报错（`error` / `response.failed` 事件），按 5xx 处理"""
 
-    # print(response)
+
+def make_base_url(port: int, host: str = "localhost") -> str:
+    return f"http://{host}:{port}/v1"
+
+
+def parse_response(response) -> str:
+    """把 Responses API 的返回拼成 `<think>reasoning</think>final_answer`"""
     final_answer = response.output_text
+    reasoning_text = ""
     for item in response.output:
         if item.type == 'reasoning':
-            for content_block in item.content:
+            for content_block in item.content or []:
                 if content_block.type == 'reasoning_text':
                     reasoning_text = content_block.text
-                    # print(reasoning_text)
                     break
-    full_answer = f"<think>{reasoning_text}</think>{final_answer}"
-    return full_answer
+    return f"<think>{reasoning_text}</think>{final_answer}"
+
+
+def parse_effort_budget(spec: str | None, cast=float) -> dict:
+    """"low=8192,high=32768" -> {"low": 8192, "high": 32768}；单个数字对所有 effort 生效"""
+    if not spec:
+        return {}
+    if "=" not in spec:
+        return {effort: cast(spec) for effort in REASONING_EFFORTS}
+    budget = {}
+    for item in spec.split(","):
+        effort, _, value = item.partition("=")
+        effort = effort.strip()
+        if effort not in REASONING_EFFORTS:
+            raise ValueError(f"unknown reasoning effort {effort!r} in budget {spec!r}")
+        budget[effort] = cast(value)
+    return budget
+
+
+class Generation:
+    """
+    One model response. `stop_reason` is None for a normal finish, "early_stop" when the
+    stream was cut after a complete final answer, or "max_output_tokens" / "time_budget"
+    when the trace was truncated by a budget.
+    """
+
+    def __init__(self, text: str, stop_reason: str | None = None, cached: bool = False,
+                 output_tokens: int | None = None, reasoning_tokens: int | None = None,
+                 input_tokens: int | None = None, stream_chunks: int | None = None):
+        self.text = text
+        self.stop_reason = stop_reason
+        self.cached = cached
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.reasoning_tokens = reasoning_tokens
+        self.stream_chunks = stream_chunks  # 流被提前关掉、没有 usage 时只知道收到了多少个 delta，不等于 token 数
+        self.latency = None  # 秒，由 RequestTimer 填
+        self.first_token = None  # 流式时第一个 token 的到达时间
+
+    def timing(self) -> dict:
+        """Per-record timing fields (--record_timings)"""
+        tokens_per_second = None
+        if self.output_tokens and self.latency:
+            tokens_per_second = self.output_tokens / self.latency
+        return {
+            "latency": self.latency,
+            "first_token": self.first_token,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "reasoning_tokens": self.reasoning_tokens,
+            "stream_chunks": self.stream_chunks,
+            "output_tokens_per_second": tokens_per_second,
+            "cached": self.cached,
+        }
+
+    @property
+    def truncated(self) -> bool:
+        return self.stop_reason in TRUNCATION_REASONS
+
+    @property
+    def cacheable(self) -> bool:
+        # 缓存里只存文本，回放时 stop_reason 是 None：早停/截断的结果存进去就会被当成正常结束
+        return self.stop_reason is None
+
+    def shared(self) -> "Generation":
+        """This response as seen by a caller whose identical request was coalesced into it (no request of its own)"""
+        return Generation(self.text, stop_reason=self.stop_reason, cached=True)
+
+    @classmethod
+    def from_response(cls, response, stop_reason=None):
+        if stop_reason is None and response.status == "incomplete":
+            details = response.incomplete_details
+            stop_reason = (details.reason if details is not None else None) or "incomplete"
+        usage = response.usage
+        details = usage.output_tokens_details if usage is not None else None
+        return cls(
+            parse_response(response),
+            stop_reason=stop_reason,
+            output_tokens=usage.output_tokens if usage is not None else None,
+            reasoning_tokens=details.reasoning_tokens if details is not None else None,
+            input_tokens=usage.input_tokens if usage is not None else None,
+        )
+
+
+def _abort_stream(response):
+    """关掉底层 socket：阻塞在读上的线程会马上收到连接断开"""
+    network_stream = response.extensions.get("network_stream")
+    sock = network_stream.get_extra_info("socket") if network_stream is not None else None
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+async def _consume(stream, state):
+    async for event in stream:
+        if state.feed(event):
+            break
+
+
+class _StreamState:
+    """累积流式事件；feed 返回 True 表示不用再读了（结束、早停或超时）"""
+
+    def __init__(self, time_budget: float | None, early_stop):
+        self.deadline = time.monotonic() + time_budget if time_budget else None
+        self.early_stop = early_stop
+        self.reasoning = []
+        self.answer = []
+        self.deltas = 0
+        self.first_delta_at = None
+        self.response = None
+        self.stop_reason = None
+
+    def feed(self, event) -> bool:
+        kind = event.type
+        if kind in ("response.completed", "response.incomplete"):
+            self.response = event.response
+            return True
+        if kind in ("error", "response.failed"):
+            raise GenerationFailed(f"generation failed: {getattr(event, 'message', None) or event}")
+        if kind.endswith("reasoning_text.delta") or kind == "response.output_text.delta":
+            if self.first_delta_at is None:
+                self.first_delta_at = time.monotonic()
+            self.deltas += 1
+        if kind.endswith("reasoning_text.delta"):
+            self.reasoning.append(event.delta)
+        elif kind == "response.output_text.delta":
+            self.answer.append(event.delta)
+            if self.early_stop is not None and ("}" in event.delta or "\n" in event.delta) \
+                    and self.early_stop("".join(self.answer)):
+                self.stop_reason = "early_stop"
+                return True
+        if self.expired():
+            self.stop_reason = "time_budget"
+            return True
+        return False
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def remaining(self) -> float | None:
+        return max(self.deadline - time.monotonic(), 0.0) if self.deadline is not None else None
+
+    def watchdog(self, response):
+        """
+        Timer that aborts `response` when the budget runs out, so a stream that stops sending
+        events is cut off too (feed only sees the deadline when an event arrives); None without a budget.
+        """
+        if self.deadline is None:
+            return None
+        timer = threading.Timer(self.remaining(), _abort_stream, (response,))
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def result(self) -> Generation:
+        if self.response is not None:
+            return Generation.from_response(self.response)
+        text = f"<think>{''.join(self.reasoning)}</think>{''.join(self.answer)}"
+        return Generation(text, stop_reason=self.stop_reason, stream_chunks=self.deltas)
+
+
+class VLLMBackend:
+    """
+    Long-lived client for one or more vLLM servers.
+
+    Holds one keep-alive connection pool per endpoint (base_url), created lazily
+    and shared by every thread that calls `respond`. With an `EndpointPool`, calls
+    that do not pass `base_url` are routed to the least loaded healthy endpoint.
+    With a `ResponseCache`, cached responses are returned without a request and
+    identical requests that are in flight at the same time are sent only once;
+    `sample` keeps the samples of one prompt (--num_samples) apart in both.
+
+    `max_output_tokens` / `time_budget` map a reasoning effort to a token / wall-clock budget.
+    With `stream` (implied by a time budget or `early_stop`), responses are consumed as they
+    are generated: the stream is closed, and the request aborted on the server, once the time
+    budget runs out or `early_stop(answer_text)` says the final answer is complete.
+    Only responses that finished normally are cached (not truncated or early-stopped ones).
+
+    With a `RunMetrics`, every request sent to a server is timed and its token usage recorded.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "gpt-oss-120b",
+        base_url: str = make_base_url(8000),
+        max_connections: int = 64,
+        max_keepalive_connections: int = 64,
+        keepalive_expiry: float = 60.0,
+        timeout: float = 3600.0,
+        connect_timeout: float = 10.0,
+        max_retries: int = 2,
+        instructions: str = DEFAULT_INSTRUCTIONS,
+        endpoints: EndpointPool | None = None,
+        cache: ResponseCache | None = None,
+        max_output_tokens: dict | None = None,
+        time_budget: dict | None = None,
+        early_stop=None,
+        stream: bool = False,
+        metrics: RunMetrics | None = None,
+    ):
+        self.model_name = model_name
+        self.base_url = base_url
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.instructions = instructions
+        self.endpoints = endpoints
+        self.cache = cache
+        self.max_output_tokens = max_output_tokens or {}
+        self.time_budget = time_budget or {}
+        self.early_stop = early_stop
+        self.stream = stream or bool(self.time_budget) or early_stop is not None
+        self.metrics = metrics
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def client(self, base_url: str | None = None) -> OpenAI:
+        base_url = base_url or self.base_url
+        client = self._clients.get(base_url)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(base_url)
+            if client is None:
+                client = self._new_client(base_url)
+                self._clients[base_url] = client
+        return client
+
+    def _new_client(self, base_url: str) -> OpenAI:
+        return OpenAI(
+            base_url=base_url,
+            api_key="EMPTY",
+            timeout=self.timeout,
+            max_retries=self.max_retries,
+            http_client=httpx.Client(limits=self.limits, timeout=self.timeout),
+        )
+
+    def respond(
+        self,
+        user_prompt: str,
+        reasoning_effort: str = "medium",
+        model_name: str | None = None,
+        base_url: str | None = None,
+        sample: int = 0,
+    ) -> str:
+        return self.generate(user_prompt, reasoning_effort, model_name, base_url, sample).text
+
+    def generate(
+        self,
+        user_prompt: str,
+        reasoning_effort: str = "medium",
+        model_name: str | None = None,
+        base_url: str | None = None,
+        sample: int = 0,
+    ) -> Generation:
+        """Like `respond`, but returns a `Generation` (stop reason, token usage)"""
+        model_name = model_name or self.model_name
+        if self.cache is None:
+            return self._generate(user_prompt, reasoning_effort, model_name, base_url)
+
+        key = cache_key(model_name, reasoning_effort, self.instructions, user_prompt, sample)
+        cached = self.cache.get(key)
+        if cached is not None:
+            if self.metrics is not None:
+                self.metrics.cache_hit()
+            return Generation(cached, cached=True)
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+        if not owner:
+            # 同样的请求已经在飞，等它的结果
+            return future.result().shared()
+        try:
+            generation = self._generate(user_prompt, reasoning_effort, model_name, base_url)
+            if generation.cacheable:
+                self.cache.put(key, generation.text)
+            future.set_result(generation)
+            return generation
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def _request(self, user_prompt, reasoning_effort, model_name) -> dict:
+        request = dict(
+            model=model_name,
+            instructions=self.instructions,
+            input=user_prompt,
+            reasoning={"effort": reasoning_effort},
+        )
+        if reasoning_effort in self.max_output_tokens:
+            request["max_output_tokens"] = self.max_output_tokens[reasoning_effort]
+        return request
+
+    def _generate(self, user_prompt, reasoning_effort, model_name, base_url) -> Generation:
+        if base_url is None and self.endpoints is not None:
+            with self.endpoints.lease() as endpoint:
+                return self._generate(user_prompt, reasoning_effort, model_name, endpoint.base_url)
+        request = self._request(user_prompt, reasoning_effort, model_name)
+        timer = RequestTimer(self.metrics, reasoning_effort)
+        try:
+            if not self.stream:
+                return timer.finish(Generation.from_response(self.client(base_url).responses.create(**request)))
+
+            state = _StreamState(self.time_budget.get(reasoning_effort), self.early_stop)
+            stream = self.client(base_url).responses.create(**request, stream=True)
+            watchdog = state.watchdog(stream.response)
+            try:
+                for event in stream:
+                    if state.feed(event):
+                        break
+            except httpx.TransportError:
+                if not state.expired():
+                    raise
+            finally:
+                if watchdog is not None:
+                    watchdog.cancel()
+                stream.close()  # 提前关闭连接，vLLM 会中止这个请求
+            if state.response is None and state.stop_reason is None and state.expired():
+                state.stop_reason = "time_budget"  # 流卡住了，被 watchdog 断开（断开可能是报错，也可能像正常读完）
+            return timer.finish(state.result(), state.first_delta_at)
+        except BaseException as e:
+            timer.fail(e)
+            raise
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncVLLMBackend(VLLMBackend):
+    """
+    asyncio 版本的 VLLMBackend：同样每个 endpoint 一个连接池，`respond` 是协程。
+    in-flight 合并用的是 event loop 里的 future，不需要加锁。
+
+    只能在创建它的 event loop 里使用，用完需要 `await backend.close()`。
+    """
+
+    def _new_client(self, base_url: str) -> AsyncOpenAI:
+        return AsyncOpenAI(
+            base_url=base_url,
+            api_key="EMPTY",
+            timeout=self.timeout,
+            max_retries=self.max_retries,
+            http_client=httpx.AsyncClient(limits=self.limits, timeout=self.timeout),
+        )
+
+    async def respond(
+        self,
+        user_prompt: str,
+        reasoning_effort: str = "medium",
+        model_name: str | None = None,
+        base_url: str | None = None,
+        sample: int = 0,
+    ) -> str:
+        return (await self.generate(user_prompt, reasoning_effort, model_name, base_url, sample)).text
+
+    async def generate(
+        self,
+        user_prompt: str,
+        reasoning_effort: str = "medium",
+        model_name: str | None = None,
+        base_url: str | None = None,
+        sample: int = 0,
+    ) -> Generation:
+        model_name = model_name or self.model_name
+        if self.cache is None:
+            return await self._generate(user_prompt, reasoning_effort, model_name, base_url)
+
+        key = cache_key(model_name, reasoning_effort, self.instructions, user_prompt, sample)
+        cached = self.cache.get(key)
+        if cached is not None:
+            if self.metrics is not None:
+                self.metrics.cache_hit()
+            return Generation(cached, cached=True)
+        future = self._in_flight.get(key)
+        if future is not None:
+            if hedging():
+                # 原请求赢不了就会被取消，结果由对冲这一方写进缓存
+                generation = await self._generate(user_prompt, reasoning_effort, model_name, base_url)
+                if generation.cacheable:
+                    self.cache.put(key, generation.text)
+                return generation
+            try:
+                return (await asyncio.shield(future)).shared()
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # 是自己被取消了
+                # 原请求被取消了（比如对冲输掉），不能让等它的记录跟着失败，自己发一次
+                return await self.generate(user_prompt, reasoning_effort, model_name, base_url, sample)
+        future = self._in_flight[key] = asyncio.get_running_loop().create_future()
+        try:
+            generation = await self._generate(user_prompt, reasoning_effort, model_name, base_url)
+            if generation.cacheable:
+                self.cache.put(key, generation.text)
+            future.set_result(generation)
+            return generation
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    async def _generate(self, user_prompt, reasoning_effort, model_name, base_url) -> Generation:
+        if base_url is None and self.endpoints is not None:
+            with self.endpoints.lease() as endpoint:
+                return await self._generate(user_prompt, reasoning_effort, model_name, endpoint.base_url)
+        request = self._request(user_prompt, reasoning_effort, model_name)
+        timer = RequestTimer(self.metrics, reasoning_effort)
+        try:
+            if not self.stream:
+                response = await self.client(base_url).responses.create(**request)
+                return timer.finish(Generation.from_response(response))
+
+            state = _StreamState(self.time_budget.get(reasoning_effort), self.early_stop)
+            stream = await self.client(base_url).responses.create(**request, stream=True)
+            try:
+                # 事件不来时 feed 看不到 deadline，由 wait_for 兜底
+                await asyncio.wait_for(_consume(stream, state), state.remaining())
+            except asyncio.TimeoutError:
+                state.stop_reason = "time_budget"
+            finally:
+                await stream.close()
+            return timer.finish(state.result(), state.first_delta_at)
+        except BaseException as e:
+            timer.fail(e)
+            raise
+
+    async def close(self):
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.close()
+
+    def __enter__(self):
+        raise TypeError("use 'async with' for AsyncVLLMBackend")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+_default_backend = None
+_default_lock = threading.Lock()
+
+
+def get_backend() -> VLLMBackend:
+    """进程内共享的 backend，第一次调用时创建"""
+    global _default_backend
+    if _default_backend is None:
+        with _default_lock:
+            if _default_backend is None:
+                _default_backend = VLLMBackend()
+    return _default_backend
+
+
+def configure_backend(**kwargs) -> VLLMBackend:
+    """用新的连接池参数替换共享 backend（在提交请求之前调用）"""
+    global _default_backend
+    with _default_lock:
+        old, _default_backend = _default_backend, VLLMBackend(**kwargs)
+    if old is not None:
+        old.close()
+    return _default_backend
+
+
+def get_response(
+    user_prompt: str,
+    model_name: str = "gpt-oss-120b",
+    port: int = 8000,
+    logout: bool = True,
+    reasoning_effort: str = "medium",
+):
+    return get_backend().respond(
+        user_prompt,
+        reasoning_effort=reasoning_effort,
+        model_name=model_name,
+        base_url=make_base_url(port),
+    )
 
 
 if __name__ == "__main__":
@@ -51,4 +559,4 @@ if __name__ == "__main__":
     # prompt = "1+1 = ?"
 
     response = get_response(prompt, port=1145, reasoning_effort="high")
-    print(response)
\ No newline at end of file
+    print(response)
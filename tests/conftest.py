@@ -0,0 +1,32 @@
+import argparse
+import os
+import sys
+import threading
+
+import pytest
+
+# 测试直接 import src.*，不需要安装
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.bench.mock_server import add_server_args, make_server  # noqa: E402
+
+
+@pytest.fixture
+def mock_server():
+    """start(*mock server flags) -> base_url of a mock vLLM server running in this process (default: a free port)"""
+    servers = []
+
+    def start(*argv):
+        parser = argparse.ArgumentParser()
+        add_server_args(parser)
+        parser.add_argument("--port", type=int, default=0)
+        args = parser.parse_args(["--latency", "fixed", "--first_token", "0.01", *argv])
+        server = make_server(args)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
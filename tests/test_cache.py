@@ -0,0 +1,56 @@
+import threading
+import time
+
+from src.collect.runner import _observed
+from src.utils.response_cache import ResponseCache
+from src.utils.vllm_backend import VLLMBackend
+
+
+class _Controller:
+    def __init__(self):
+        self.latencies = []
+
+    def record(self, latency, error=None):
+        self.latencies.append(latency)
+
+
+class _Result:
+    def __init__(self, cached):
+        self.cached = cached
+
+
+def test_cached_results_are_not_latency_samples():
+    controller = _Controller()
+    call = _observed(lambda idx, record: _Result(cached=record), controller)
+    call(0, False)
+    call(1, True)
+    assert len(controller.latencies) == 1
+
+
+def test_early_stopped_response_is_not_cached(tmp_path, mock_server):
+    base_url = mock_server("--latency_mean", "0.1", "--reasoning_tokens", "20")
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    backend = VLLMBackend("mock", base_url, cache=cache, early_stop=lambda answer: True, max_retries=0)
+    try:
+        first = backend.generate("What is 1+1?", "low")
+        again = backend.generate("What is 1+1?", "low")
+    finally:
+        backend.close()
+    assert first.stop_reason == "early_stop"
+    assert not again.cached and again.stop_reason == "early_stop"
+
+
+def test_coalesced_wait_is_marked_cached(tmp_path, mock_server):
+    base_url = mock_server("--latency_mean", "0.3", "--reasoning_tokens", "20")
+    backend = VLLMBackend("mock", base_url, cache=ResponseCache(str(tmp_path / "cache.sqlite")), max_retries=0)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(backend.generate("What is 1+1?", "low")))
+               for _ in range(2)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join()
+    backend.close()
+    assert sorted(generation.cached for generation in results) == [False, True]
+    assert results[0].text == results[1].text
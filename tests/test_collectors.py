@@ -0,0 +1,89 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from src.bench.run import COLLECTORS, ROOT, write_dataset
+from src.collect.writer import iter_output_records
+
+
+def _collect(collector, dataset, output_path, base_url, *extra):
+    port = base_url.rsplit(":", 1)[1].split("/")[0]
+    command = [sys.executable, COLLECTORS[collector], "--raw_path", dataset, "--output_path", output_path,
+               "--model_name", "mock", "--port", port, "--health_interval", "0", *extra]
+    env = {**os.environ, "PYTHONPATH": ROOT}
+    done = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True, timeout=120)
+    assert done.returncode == 0, done.stdout + done.stderr
+    return done.stdout
+
+
+@pytest.mark.parametrize("collector,engine", [("dapo", "thread"), ("science", "async")])
+def test_collector_runs_and_resumes(tmp_path, mock_server, collector, engine):
+    base_url = mock_server("--latency_mean", "0.05", "--reasoning_tokens", "20")
+    dataset = str(tmp_path / "input.jsonl")
+    output_path = str(tmp_path / "out" / "results.jsonl")
+    write_dataset(collector, dataset, 6)
+
+    stdout = _collect(collector, dataset, output_path, base_url, "--engine", engine, "--num_samples", "2")
+    assert "Pending: 12" in stdout
+    keys = sorted((record["extra_info"]["index"], record["extra_info"]["sample"])
+                  for record in iter_output_records(output_path))
+    assert keys == [(index, sample) for index in range(6) for sample in range(2)]
+
+    stdout = _collect(collector, dataset, output_path, base_url, "--engine", engine, "--num_samples", "2")
+    assert "Already done: 12, Pending: 0" in stdout
+
+
+def test_collector_rejects_bad_flag_combinations(tmp_path):
+    dataset = str(tmp_path / "input.jsonl")
+    write_dataset("dapo", dataset, 1)
+    command = [sys.executable, COLLECTORS["dapo"], "--raw_path", dataset, "--output_path", str(tmp_path / "out.jsonl"),
+               "--model_name", "mock", "--stream", "--schedule", "longest_first"]
+    done = subprocess.run(command, cwd=ROOT, env={**os.environ, "PYTHONPATH": ROOT}, capture_output=True, text=True)
+    assert done.returncode == 2 and "--schedule longest_first" in done.stderr
+
+
+def test_hedging_cuts_hung_requests(tmp_path, mock_server):
+    # 一个 endpoint 有请求会挂住 60s 以上，对冲到另一个 endpoint 后整个 run 不用等它
+    hanging = mock_server("--latency_mean", "0.05", "--reasoning_tokens", "20", "--hang_rate", "0.05")
+    healthy = mock_server("--latency_mean", "0.05", "--reasoning_tokens", "20")
+    endpoints = ",".join(url.split("//")[1].split("/")[0] for url in (hanging, healthy))
+    dataset = str(tmp_path / "input.jsonl")
+    output_path = str(tmp_path / "out" / "results.jsonl")
+    write_dataset("dapo", dataset, 100)
+
+    started = time.monotonic()
+    stdout = _collect("dapo", dataset, output_path, hanging, "--endpoints", endpoints, "--engine", "async",
+                      "--max_workers", "8", "--hedge_after", "3", "--max_attempts", "1")
+    assert time.monotonic() - started < 30
+    assert "hedge finished first: 0" not in stdout
+    assert sum(1 for _ in iter_output_records(output_path)) == 100
+
+
+def test_hedging_needs_the_async_engine(tmp_path):
+    dataset = str(tmp_path / "input.jsonl")
+    write_dataset("dapo", dataset, 1)
+    command = [sys.executable, COLLECTORS["dapo"], "--raw_path", dataset, "--output_path", str(tmp_path / "out.jsonl"),
+               "--model_name", "mock", "--hedge_after", "3"]
+    done = subprocess.run(command, cwd=ROOT, env={**os.environ, "PYTHONPATH": ROOT}, capture_output=True, text=True)
+    assert done.returncode == 2 and "--engine async" in done.stderr
+
+
+def test_dead_letter_and_retry_failed(tmp_path, mock_server):
+    failing = mock_server("--error_rate", "1")
+    healthy = mock_server("--latency_mean", "0.05", "--reasoning_tokens", "20")
+    dataset = str(tmp_path / "input.jsonl")
+    output_path = str(tmp_path / "out" / "results.jsonl")
+    failed_path = str(tmp_path / "out" / "results.failed.jsonl")
+    write_dataset("dapo", dataset, 5)
+
+    stdout = _collect("dapo", dataset, output_path, failing, "--max_attempts", "2", "--retry_base_delay", "0.01")
+    assert "Dead letters: 5" in stdout
+    assert sum(1 for _ in open(failed_path)) == 5
+
+    stdout = _collect("dapo", dataset, output_path, healthy, "--retry_failed")
+    assert "Retrying 5 dead-letter records" in stdout and "Dead letters: 0" in stdout
+    assert sorted(record["extra_info"]["index"] for record in iter_output_records(output_path)) == list(range(5))
+    assert not os.path.exists(failed_path) and not os.path.exists(failed_path + ".retrying")
@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+pytest.importorskip("pyarrow")
+import pyarrow.dataset as ds  # noqa: E402
+
+from src.collect.columnar import export_columnar, split_record  # noqa: E402
+
+
+def _dapo(index, model, reward, sample=0):
+    return {
+        "reasoning_prompt": f"question {index}",
+        "gpt-oss-120b-response": f"<think>thinking {index}</think>answer {index}",
+        "model_name": model,
+        "reasoning_effort": "low",
+        "reward": reward,
+        "model_answer": str(index),
+        "extra_info": {"index": index, "sample": sample, "split": "train"},
+        "timing": {"output_tokens": 10 + index, "latency": 0.5},
+        "source_id": f"src-{index}",
+    }
+
+
+def _science(index):
+    return {
+        "messages": [{"role": "user", "content": "Which option?"}, {"role": "assistant", "content": "B"}],
+        "model_name": "gpt-oss/120b",
+        "reasoning_effort": "high",
+        "reward": None,
+        "extra_info": {"index": f"sci-{index}"},
+    }
+
+
+def test_split_record():
+    scalars, text = split_record(_dapo(3, "m", 1.0, sample=2), row_id=7)
+    assert scalars["row_id"] == text["row_id"] == 7
+    assert (scalars["index"], scalars["sample"]) == ("3", 2)
+    assert scalars["reasoning_chars"] == len("thinking 3")
+    assert scalars["response_chars"] == len(text["response"]) and text["prompt"] == "question 3"
+    assert scalars["output_tokens"] == 13 and scalars["input_tokens"] is None
+    assert json.loads(text["extra"]) == {"source_id": "src-3", "extra_info": {"split": "train"}}
+
+    scalars, text = split_record(_science(1), row_id=0)
+    assert (scalars["index"], text["prompt"], text["response"], text["extra"]) == ("sci-1", "Which option?", "B", None)
+    assert scalars["reasoning_chars"] == 0
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_export_round_trip(tmp_path, fmt):
+    records = [_dapo(i, "model-a" if i % 2 else "model-b", float(i % 3 == 0)) for i in range(30)]
+    records += [_science(i) for i in range(5)]
+    output_dir = tmp_path / "columnar"
+    assert export_columnar(records, str(output_dir), fmt=fmt, row_group_size=4) == 35
+
+    file_format = "ipc" if fmt == "arrow" else "parquet"
+    scalars = ds.dataset(output_dir / "scalars", format=file_format, partitioning="hive")
+    text = ds.dataset(output_dir / "text", format=file_format, partitioning="hive")
+    assert scalars.count_rows() == text.count_rows() == 35
+
+    correct = scalars.to_table(columns=["row_id", "index"], filter=ds.field("reward") == 1).to_pylist()
+    assert sorted(int(row["index"]) for row in correct) == list(range(0, 30, 3))
+
+    # "/" 在分区目录名里被转义，读回来还是原值
+    science = scalars.to_table(filter=ds.field("model_name") == "gpt-oss/120b")
+    assert science.num_rows == 5 and set(science.column("reward").to_pylist()) == {None}
+
+    # 同一个 row_id 对应同一条记录
+    columns = text.to_table(columns=["row_id", "response"]).to_pydict()
+    responses = dict(zip(columns["row_id"], columns["response"]))
+    for row in correct:
+        assert responses[row["row_id"]].endswith(f"answer {row['index']}")
+
+
+def test_export_replaces_and_validates(tmp_path):
+    output_dir = tmp_path / "columnar"
+    export_columnar([_dapo(i, "m", 0.0) for i in range(10)], str(output_dir))
+    export_columnar([_dapo(i, "m", 0.0) for i in range(3)], str(output_dir), partition_by=())
+    assert ds.dataset(output_dir / "scalars").count_rows() == 3
+    assert not list((output_dir / "scalars").glob("model_name=*"))
+
+    with pytest.raises(ValueError, match="partition"):
+        export_columnar([], str(output_dir), partition_by=("prompt",))
+    with pytest.raises(ValueError, match="format"):
+        export_columnar([], str(output_dir), fmt="csv")
@@ -0,0 +1,102 @@
+import httpx
+
+from src.utils.concurrency import AdaptiveConcurrency, parse_waiting
+
+
+def _round(limiter, latency=1.0, error=None):
+    """一整轮：limit 个请求都结束"""
+    for _ in range(limiter.limit):
+        limiter.record(latency, error)
+
+
+def test_slow_start_then_additive_increase():
+    limiter = AdaptiveConcurrency(2, max_limit=20, ewma_alpha=1.0)
+    limiter.record(1.0)
+    assert limiter.limit == 2  # 一轮没结束不变
+    limiter.record(1.0)
+    assert limiter.limit == 4
+    _round(limiter)
+    _round(limiter)
+    assert limiter.limit == 16
+    _round(limiter)
+    assert limiter.limit == 20  # max_limit 封顶
+
+    _round(limiter, error=httpx.ConnectError("refused"))
+    assert limiter.limit == 14
+    _round(limiter)
+    _round(limiter)
+    assert limiter.limit == 16  # 第一次降之后每轮只加 increase
+
+
+def test_decrease_once_per_round():
+    limiter = AdaptiveConcurrency(10, ewma_alpha=1.0)
+    for _ in range(9):
+        limiter.record(1.0, httpx.ReadTimeout("timeout"))
+    assert limiter.limit == 10
+    limiter.record(1.0, httpx.ReadTimeout("timeout"))
+    assert limiter.limit == 7
+    for _ in range(6):
+        limiter.record(1.0, httpx.ReadTimeout("timeout"))
+    assert limiter.limit == 7  # 同一批超时只降一次
+    limiter.record(1.0, httpx.ReadTimeout("timeout"))
+    assert limiter.limit == 4
+
+    floor = AdaptiveConcurrency(2, min_limit=2)
+    _round(floor, error=httpx.ConnectError("refused"))
+    assert floor.limit == 2
+
+
+def test_client_errors_do_not_shrink():
+    limiter = AdaptiveConcurrency(4)
+    _round(limiter, error=ValueError("could not parse the answer"))
+    _round(limiter, error=ValueError("could not parse the answer"))
+    assert limiter.limit == 4
+
+
+def test_latency_regression_shrinks():
+    limiter = AdaptiveConcurrency(4, ewma_alpha=1.0, max_limit=4)
+    _round(limiter, latency=1.0)
+    _round(limiter, latency=1.5)
+    assert limiter.limit == 4
+    limiter.record(3.0)
+    assert limiter.limit == 2
+    limiter.record(1.0)
+    limiter.record(1.0)
+    assert limiter.limit == 3  # 降过一次之后只加 1，不再翻倍
+
+
+def test_server_queue_holds_and_shrinks():
+    limiter = AdaptiveConcurrency(4, max_waiting=8, ewma_alpha=1.0)
+    limiter.waiting = 3
+    _round(limiter)
+    assert limiter.limit == 4  # 有排队就不再加
+    limiter.waiting = 20
+    limiter.record(1.0)
+    assert limiter.limit == 2
+    limiter.waiting = 0
+    _round(limiter)
+    assert limiter.limit == 3
+
+
+def test_parse_waiting():
+    text = (
+        "# HELP vllm:num_requests_waiting Number of requests waiting.\n"
+        'vllm:num_requests_running{model_name="a"} 7.0\n'
+        'vllm:num_requests_waiting{engine="0",model_name="a"} 2.0\n'
+        'vllm:num_requests_waiting{engine="1",model_name="a"} 3.0\n'
+    )
+    assert parse_waiting(text) == 5.0
+    assert parse_waiting("vllm:num_requests_waiting 1e1\n") == 10.0
+    assert parse_waiting("") == 0.0
+
+
+def test_poll_metrics(mock_server):
+    root = mock_server().rsplit("/v1", 1)[0]
+    limiter = AdaptiveConcurrency(4, metrics_urls=[root + "/metrics"])
+    limiter.poll_metrics()
+    assert limiter.waiting == 0 and limiter.status() == {"concurrency": 4, "waiting": 0}
+
+    # 拿不到指标时当作未知，而不是 0
+    limiter.metrics_urls = ["http://127.0.0.1:1/metrics"]
+    limiter.poll_metrics()
+    assert limiter.waiting is None and limiter.status() == {"concurrency": 4}
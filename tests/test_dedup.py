@@ -0,0 +1,67 @@
+import json
+import os
+import random
+import subprocess
+import sys
+
+import numpy as np
+
+from src.data.dedup import ENTRY, choose_bands, _group_partition
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_bands_favour_recall_above_threshold():
+    bands, rows = choose_bands(0.8, 128)
+    assert bands * rows <= 128
+
+    def candidate(s):
+        return 1 - (1 - s ** rows) ** bands
+
+    assert candidate(0.84) > 0.9
+    assert candidate(0.5) < 0.05
+
+
+def test_group_links_members_unlike_the_bucket_head(tmp_path):
+    # A 是桶里第一个，B、C 互为近似重复但都不像 A
+    num_perm = 10
+    signatures = np.array([
+        [0] * 10,
+        [1] * 9 + [2],
+        [1] * 10,
+    ], dtype=np.uint32)
+    signatures_path = str(tmp_path / "signatures.u32")
+    signatures.tofile(signatures_path)
+    entries = np.zeros(3, dtype=ENTRY)
+    entries["kind"], entries["key"], entries["id"] = 0, 42, [0, 1, 2]
+    partition_path = str(tmp_path / "part.bin")
+    entries.tofile(partition_path)
+    assert _group_partition((partition_path, signatures_path, 3, num_perm, 0.8)) == [(1, 2)]
+
+
+def _prompt(words):
+    return {"prompt": [{"role": "user", "content": " ".join(words)}], "reward_model": {"ground_truth": "1"}}
+
+
+def test_planted_near_duplicates_are_found(tmp_path):
+    rng = random.Random(0)
+    vocabulary = [f"w{i}" for i in range(5000)]
+    originals = [[rng.choice(vocabulary) for _ in range(100)] for _ in range(40)]
+    duplicates = []
+    for words in originals[:20]:
+        words = list(words)
+        words[rng.randrange(len(words))] = "changed"  # 改一个词
+        duplicates.append(words)
+    dataset = tmp_path / "input.jsonl"
+    with open(dataset, "w", encoding="utf-8") as f:
+        for words in originals + duplicates:
+            f.write(json.dumps(_prompt(words)) + "\n")
+
+    output_dir = tmp_path / "dedup"
+    subprocess.run([sys.executable, "-m", "src.data.dedup", "--inputs", str(dataset), "--output_dir", str(output_dir),
+                    "--workers", "2", "--partitions", "4"],
+                   cwd=ROOT, check=True, capture_output=True)
+    with open(output_dir / "input.dropped.jsonl", encoding="utf-8") as f:
+        dropped = [json.loads(line) for line in f]
+    assert sorted(record["dedup"]["duplicate_of"]["line"] for record in dropped) == list(range(20))
+    assert all(record["dedup"]["reason"] == "near" for record in dropped)
@@ -0,0 +1,91 @@
+import json
+import socket
+import threading
+import urllib.request
+
+import httpx
+
+from src.utils.endpoints import EndpointPool
+from src.utils.vllm_backend import VLLMBackend
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _completed(base_url):
+    with urllib.request.urlopen(base_url.rsplit("/v1", 1)[0] + "/stats") as response:
+        return json.loads(response.read())["completed"]
+
+
+def test_least_outstanding_routing(mock_server):
+    urls = [mock_server("--latency_mean", "0.5", "--reasoning_tokens", "20") for _ in range(2)]
+    pool = EndpointPool(urls, health_interval=0)
+    first, second = pool.acquire(), pool.acquire()
+    assert {first.base_url, second.base_url} == set(urls)  # 第二个请求去空闲的那台
+    pool.release(first)
+    assert pool.acquire() is first
+    pool.release(first)
+    pool.release(second)
+
+    backend = VLLMBackend("mock", endpoints=pool, max_retries=0)
+    threads = [threading.Thread(target=backend.generate, args=(f"question {i}", "low")) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    backend.close()
+    completed = [_completed(url) for url in urls]
+    assert sum(completed) == 20 and abs(completed[0] - completed[1]) <= 2
+    assert all(endpoint.outstanding == 0 for endpoint in pool.endpoints)
+
+
+def test_health_check_ejects_and_readmits(mock_server):
+    live = mock_server()
+    port = _free_port()
+    down = f"http://127.0.0.1:{port}/v1"
+    pool = EndpointPool([live, down], health_interval=3600, health_timeout=1.0)
+
+    # 启动时健康检查不过的直接摘掉，请求只去活着的那台
+    with pool:
+        assert [endpoint.ejected for endpoint in pool.endpoints] == [False, True]
+        leases = [pool.acquire() for _ in range(3)]
+        assert all(endpoint.base_url == live for endpoint in leases)
+        for endpoint in leases:
+            pool.release(endpoint)
+
+        # 服务起来之后下一次健康检查放回来，空闲的它接下一个请求
+        mock_server("--port", str(port))
+        pool.check_health()
+        assert not pool.endpoints[1].ejected
+        busy = pool.acquire()
+        assert pool.acquire().base_url != busy.base_url
+
+
+def test_consecutive_failures_eject(mock_server):
+    pool = EndpointPool([mock_server(), mock_server()], max_failures=3, health_interval=0)
+    flaky = pool.endpoints[1]
+
+    def fail(endpoint, error):
+        endpoint.outstanding += 1
+        pool.release(endpoint, error)
+
+    # 4xx 不算 endpoint 的问题；成功一次就重新计数
+    fail(flaky, ValueError("bad request"))
+    fail(flaky, httpx.ConnectError("refused"))
+    fail(flaky, httpx.ConnectError("refused"))
+    fail(flaky, None)
+    fail(flaky, httpx.ConnectError("refused"))
+    fail(flaky, httpx.ReadTimeout("timeout"))
+    assert not flaky.ejected
+    fail(flaky, httpx.ConnectError("refused"))
+    assert flaky.ejected and flaky.failures == 5
+    assert all(pool.acquire() is pool.endpoints[0] for _ in range(3))
+
+    # 全部被摘掉时仍然发给最闲的那台，而不是直接失败
+    for _ in range(3):
+        fail(pool.endpoints[0], httpx.ConnectError("refused"))
+    assert all(endpoint.ejected for endpoint in pool.endpoints)
+    assert pool.acquire() is flaky
@@ -0,0 +1,51 @@
+import json
+
+from src.collect.checkpoint import resume_key
+from src.collect.ladder import EffortLadder, load_ladder_progress
+from src.collect.writer import ResultWriter, iter_output_records
+
+LEVELS = ["low", "medium", "high"]
+
+
+def _attempt(index, effort, reward):
+    return {"extra_info": {"index": index}, "reasoning_effort": effort, "reward": reward}
+
+
+def test_progress_after_crash_with_partial_line(tmp_path):
+    output = tmp_path / "out.jsonl"
+    lines = [
+        _attempt(0, "low", 1.0),                                # 已解出
+        _attempt(1, "low", 0.0), _attempt(1, "medium", 0.0),    # 继续 high
+        _attempt("abc-2", "low", 0.0),                          # 继续 medium
+        _attempt(3, "low", 0.0), _attempt(3, "medium", 0.0), _attempt(3, "high", 0.0),  # 到顶了
+    ]
+    with open(output, "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(line) + "\n" for line in lines)
+        f.write('{"extra_info": {"index": 4}, "reasoning_eff')  # 崩溃留下的半行
+
+    completed, start = load_ladder_progress(str(output), LEVELS)
+    assert completed == {0, 3}
+    assert start == {1: 2, resume_key("abc-2"): 1}
+    assert output.read_bytes().endswith(b"\n")
+
+    # 接着跑：追加的记录是完整的一行，不会接在半行后面
+    with ResultWriter(str(output)) as writer:
+        ladder = EffortLadder(LEVELS, writer, start)
+        result = ladder.run("abc-2", lambda effort: _Result(effort, 1.0))
+        writer.put(result.to_dict())
+    records = list(iter_output_records(str(output)))
+    assert len(records) == len(lines) + 1
+    assert records[-1]["reasoning_effort"] == "medium"
+
+
+class _Result:
+    def __init__(self, effort, reward):
+        self.reasoning_effort = effort
+        self.reward = reward
+
+    def to_dict(self):
+        return _attempt("abc-2", self.reasoning_effort, self.reward)
+
+
+def test_missing_output_has_no_progress(tmp_path):
+    assert load_ladder_progress(str(tmp_path / "none.jsonl"), LEVELS) == (set(), {})
@@ -0,0 +1,32 @@
+import asyncio
+
+from src.utils.metrics import RunMetrics
+from src.utils.vllm_backend import Generation, _StreamState
+
+
+def test_cancelled_hedges_are_not_errors():
+    metrics = RunMetrics()
+    metrics.timer("low").fail(asyncio.CancelledError())
+    metrics.timer("low").fail(ConnectionError())
+    metrics.timer("low").finish(Generation("ok"))
+    snap = metrics.snapshot()
+    assert snap["hedge_cancelled"] == 1
+    assert snap["errors"] == {"ConnectionError": 1}
+    assert "errors 1, hedge cancelled 1" in metrics.summary()
+    assert "collect_hedge_cancelled_total 1" in metrics.prometheus()
+
+
+class _Delta:
+    def __init__(self, kind, delta):
+        self.type = kind
+        self.delta = delta
+
+
+def test_cut_stream_reports_chunks_not_tokens():
+    state = _StreamState(None, lambda answer: True)
+    state.feed(_Delta("response.reasoning_text.delta", "think "))
+    state.feed(_Delta("response.output_text.delta", "\\boxed{2}"))
+    generation = state.result()
+    assert isinstance(generation, Generation) and generation.stop_reason == "early_stop"
+    assert generation.output_tokens is None and generation.reasoning_tokens is None
+    assert generation.stream_chunks == 2
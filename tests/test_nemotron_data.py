@@ -0,0 +1,93 @@
+import json
+import os
+import subprocess
+import sys
+from collections import Counter
+
+import pytest
+
+from src.data import nemotron_data
+from src.data.nemotron_data import _ShardedOutput, _filter_chunk
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _row(i, category="chemistry", used_in_training="yes", answer="B", prompt="Which option?"):
+    return {
+        "input": [{"role": "user", "content": f"{prompt} ({i})"}],
+        "output": f"<think>reasoning</think>The answer is ({answer})." if answer else "I am not sure.",
+        "category": category,
+        "used_in_training": used_in_training,
+    }
+
+
+FILTERS = {"categories": set(), "used_in_training": set(), "require_answer": True,
+           "max_prompt_chars": 0, "max_output_chars": 0}
+
+
+def _filter(rows, start=0, **filters):
+    nemotron_data._init_worker({**FILTERS, **filters})
+    lines = [json.dumps(row).encode() + b"\n" if isinstance(row, dict) else row for row in rows]
+    kept, dropped = _filter_chunk((start, lines))
+    return [json.loads(line) for line in kept], dropped
+
+
+def test_filters_and_stable_indices():
+    rows = [_row(0), _row(1, answer=None), _row(2, category="physics"), b"{not json\n",
+            {"input": "no messages"}, _row(5, used_in_training="no"), _row(6, prompt="x" * 100)]
+    kept, dropped = _filter(rows, start=100)
+    assert [row["extra_info"]["index"] for row in kept] == [100, 102, 105, 106]  # 按源文件行号，不受过滤影响
+    assert dropped == Counter(no_answer=1, invalid_json=1, malformed=1)
+
+    kept, dropped = _filter(rows, categories={"chemistry"}, used_in_training={"none"})
+    assert [row["extra_info"]["index"] for row in kept] == [5]
+    assert dropped == Counter(category=1, used_in_training=3, invalid_json=1, malformed=1)
+
+    kept, dropped = _filter(rows, max_prompt_chars=50, max_output_chars=1000)
+    assert [row["extra_info"]["index"] for row in kept] == [0, 2, 5]
+    assert dropped["prompt_too_long"] == 1
+
+    kept, _ = _filter([_row(0, answer=None)], require_answer=False)
+    assert len(kept) == 1
+
+    # 已有的 extra_info 保留，index 覆盖
+    row = {**_row(0), "extra_info": {"index": 9, "source": "x"}}
+    assert _filter([row], start=3)[0][0]["extra_info"] == {"index": 3, "source": "x"}
+
+
+def test_sharded_output(tmp_path):
+    output = _ShardedOutput(str(tmp_path), "science", rows_per_shard=4)
+    output.write([b"%d\n" % i for i in range(3)])
+    output.write([b"%d\n" % i for i in range(3, 10)])
+    output.close()
+    assert [os.path.basename(path) for path in output.paths] == [f"science.{i:05d}.jsonl" for i in range(3)]
+    assert [open(path, "rb").read().count(b"\n") for path in output.paths] == [4, 4, 2]
+    assert output.rows == 10 and not list(tmp_path.glob("*.tmp"))
+
+    empty = _ShardedOutput(str(tmp_path / "empty"), "science", rows_per_shard=0)
+    os.makedirs(empty.output_dir)
+    empty.close()
+    assert empty.paths == [str(tmp_path / "empty" / "science.jsonl")] and os.path.getsize(empty.paths[0]) == 0
+
+
+def test_main_over_several_inputs(tmp_path):
+    first = tmp_path / "a.jsonl"
+    first.write_text("".join(json.dumps(_row(i, answer=None if i % 5 == 0 else "C")) + "\n" for i in range(20)) + "\n")
+    inputs = [str(first)]
+    pq = pytest.importorskip("pyarrow.parquet")
+    import pyarrow as pa
+
+    second = tmp_path / "b.parquet"
+    pq.write_table(pa.Table.from_pylist([_row(i, category="physics") for i in range(20, 30)]), second, row_group_size=3)
+    inputs.append(str(second))
+
+    output_dir = tmp_path / "out"
+    subprocess.run([sys.executable, "-m", "src.data.nemotron_data", "--inputs", *inputs, "--output_dir", str(output_dir),
+                    "--rows_per_shard", "7", "--batch_size", "4", "--workers", "2"],
+                   cwd=ROOT, check=True, capture_output=True)
+    shards = sorted(output_dir.glob("science.*.jsonl"))
+    rows = [json.loads(line) for shard in shards for line in open(shard, encoding="utf-8")]
+    assert [len(open(shard).readlines()) for shard in shards] == [7, 7, 7, 5]
+    # 空行不算行号；第二个文件的行号接着第一个
+    assert [row["extra_info"]["index"] for row in rows] == [i for i in range(30) if i >= 20 or i % 5]
+    assert rows[-1]["category"] == "physics"
@@ -0,0 +1,20 @@
+import pytest
+
+from src.collect.records import DapoRecord, RecordError
+
+
+def _dapo(**extra_info):
+    return {"prompt": [{"role": "user", "content": "1+1?"}], "reward_model": {"ground_truth": "2"},
+            "extra_info": extra_info}
+
+
+def test_dapo_record_keeps_index():
+    assert DapoRecord.from_dict(_dapo(index="abc-1")).index == "abc-1"
+    assert DapoRecord.from_dict(_dapo(index=0)).index == 0
+
+
+def test_dapo_record_without_index_is_rejected():
+    with pytest.raises(RecordError):
+        DapoRecord.from_dict(_dapo())
+    with pytest.raises(RecordError):
+        DapoRecord.from_dict(_dapo(index=None))
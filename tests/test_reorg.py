@@ -0,0 +1,72 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def _reorg(*argv):
+    subprocess.run([sys.executable, "-m", "src.data.reorg", "--workers", "2", "--batch_size", "7", *argv],
+                   cwd=ROOT, check=True, capture_output=True)
+
+
+@pytest.fixture
+def parquet(tmp_path):
+    rows = [{"prompt": f"question {i}", "extra_info": {"index": 1000 + i, "split": "train"}} for i in range(50)]
+    rows[3]["extra_info"] = None
+    path = tmp_path / "data.parquet"
+    pq.write_table(pa.Table.from_pylist(rows), path, row_group_size=16)
+    return path
+
+
+def test_all_outputs_in_one_pass(tmp_path, parquet):
+    output_dir = tmp_path / "out"
+    _reorg("--input", str(parquet), "--output_dir", str(output_dir), "--head", "10", "--sample", "12",
+           "--shards", "4", "--assign_index")
+
+    full = _read(output_dir / "data.jsonl")
+    assert [row["prompt"] for row in full] == [f"question {i}" for i in range(50)]
+    assert [row["extra_info"]["index"] for row in full] == list(range(50))
+    assert full[3]["extra_info"] == {"index": 3} and full[4]["extra_info"]["split"] == "train"
+
+    assert _read(output_dir / "data.head10.jsonl") == full[:10]
+
+    sample = [row["extra_info"]["index"] for row in _read(output_dir / "data.sample12.jsonl")]
+    assert len(set(sample)) == 12 and sample == sorted(sample)  # 按输入顺序写出
+
+    shards = [_read(output_dir / f"data.{i:05d}-of-00004.jsonl") for i in range(4)]
+    assert [len(shard) for shard in shards] == [12, 13, 12, 13]
+    assert [row for shard in shards for row in shard] == full
+
+
+def test_head_only_and_empty_shards(tmp_path, parquet):
+    _reorg("--input", str(parquet), "--no_full", "--head", "5", "--head_output", str(tmp_path / "head.jsonl"))
+    head = _read(tmp_path / "head.jsonl")
+    assert [row["extra_info"]["index"] for row in head[:3]] == [1000, 1001, 1002]  # 不加 --assign_index 原样保留
+    assert len(head) == 5 and not os.path.exists(tmp_path / "data.jsonl")
+
+    # 行数少于分片数：多出来的分片是空文件
+    small = tmp_path / "small.parquet"
+    pq.write_table(pa.Table.from_pylist([{"prompt": "a"}, {"prompt": "b"}]), small)
+    _reorg("--input", str(small), "--no_full", "--shards", "3")
+    assert [len(_read(tmp_path / f"small.{i:05d}-of-00003.jsonl")) for i in range(3)] == [0, 1, 1]
+
+
+def test_sample_is_seeded(tmp_path, parquet):
+    samples = []
+    for run, seed in enumerate(("1", "1", "2")):
+        _reorg("--input", str(parquet), "--no_full", "--sample", "10", "--seed", seed,
+               "--sample_output", str(tmp_path / f"sample{run}.jsonl"))
+        samples.append(_read(tmp_path / f"sample{run}.jsonl"))
+    assert len(samples[0]) == 10 and samples[0] == samples[1] and samples[0] != samples[2]
@@ -0,0 +1,56 @@
+import os
+
+from src.collect.checkpoint import checkpoint_path, resume_key
+from src.collect.runner import ResumeFilter
+from src.collect.writer import ResultWriter, load_completed_indices, load_completed_samples
+
+
+def _record(index, sample=None):
+    extra_info = {"index": index}
+    if sample is not None:
+        extra_info["sample"] = sample
+    return {"extra_info": extra_info, "reward": 1.0}
+
+
+def _write(path, records, **kwargs):
+    with ResultWriter(str(path), **kwargs) as writer:
+        for record in records:
+            writer.put(record)
+
+
+def test_string_indices_resume(tmp_path):
+    output = tmp_path / "out.jsonl"
+    _write(output, [_record("abc-1"), _record("abc-2"), _record(7)])
+
+    completed = load_completed_indices(str(output))
+    assert completed == {resume_key("abc-1"), resume_key("abc-2"), 7}
+
+    resume_filter = ResumeFilter(completed)
+    pending = list(resume_filter([("abc-1", None), ("abc-3", None), (7, None), (8, None)]))
+    assert [key for key, _ in pending] == ["abc-3", 8]
+    assert resume_filter.skipped == 2
+
+
+def test_string_indices_resume_after_rescan(tmp_path):
+    # 没有 sidecar（或 sidecar 丢了）时扫描输出重建，结果一样
+    output = tmp_path / "out.jsonl"
+    _write(output, [_record("abc-1"), _record(3)])
+    (tmp_path / "out.jsonl.idx").unlink()
+    assert load_completed_indices(str(output)) == {resume_key("abc-1"), 3}
+
+
+def test_string_indices_resume_samples_and_shards(tmp_path):
+    output = tmp_path / "out.jsonl"
+    _write(output, [_record("abc-1", 0), _record("abc-1", 1)], shard_size=1 << 20)
+    completed = load_completed_samples(str(output))
+    assert completed == {resume_key(("abc-1", 0)), resume_key(("abc-1", 1))}
+    assert list(ResumeFilter(completed)([(("abc-1", 1), None), (("abc-1", 2), None)])) == [(("abc-1", 2), None)]
+
+
+def test_no_sidecar_without_output(tmp_path):
+    output = str(tmp_path / "out.jsonl")
+    assert load_completed_indices(output) == set()
+    assert not os.path.exists(checkpoint_path(output))
+    _write(output, [_record(1)])
+    assert os.path.exists(checkpoint_path(output))
+    assert load_completed_indices(output) == {1}
@@ -0,0 +1,118 @@
+import asyncio
+import json
+
+import httpx
+import openai
+import pytest
+
+from src.collect.retry import (
+    DeadLetter, RetriesExhausted, RetryPolicy, classify_error, dead_letter_path, finish_retry, iter_dead_letter,
+    take_dead_letter,
+)
+from src.utils.vllm_backend import GenerationFailed
+
+
+def _status_error(status_code):
+    request = httpx.Request("POST", "http://localhost/v1/responses")
+    return openai.APIStatusError("error", response=httpx.Response(status_code, request=request), body=None)
+
+
+@pytest.mark.parametrize("error,error_class", [
+    (httpx.ConnectError("refused"), "connection"),
+    (httpx.ReadTimeout("timeout"), "timeout"),
+    (TimeoutError(), "timeout"),
+    (_status_error(503), "server"),
+    (_status_error(429), "rate_limit"),
+    (_status_error(408), "timeout"),
+    (_status_error(400), "client"),
+    (json.JSONDecodeError("bad", "", 0), "parse"),
+    (KeyError("answer"), "parse"),
+    (RuntimeError("?"), "other"),
+])
+def test_classify_error(error, error_class):
+    assert classify_error(error) == error_class
+
+
+def _flaky(errors):
+    """依次抛出 errors 里的异常，之后返回尝试次数"""
+    calls = []
+
+    def process(idx, record):
+        calls.append(idx)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return len(calls)
+    return process, calls
+
+
+def test_retry_until_success():
+    retry = RetryPolicy(max_attempts=4, base_delay=0.001)
+    process, _ = _flaky([httpx.ConnectError("refused"), _status_error(500), httpx.ReadTimeout("timeout")])
+    assert retry.wrap(process)(0, {}) == 4
+    assert retry.retried == {"connection": 1, "server": 1, "timeout": 1}
+
+
+def test_retry_gives_up():
+    retry = RetryPolicy(max_attempts=3, base_delay=0.001)
+    process, calls = _flaky([GenerationFailed("aborted")] * 5)
+    with pytest.raises(RetriesExhausted) as info:
+        retry.wrap(process)(0, {})
+    assert len(calls) == 3 and info.value.attempts == 3 and info.value.error_class == "server"
+
+    # 解析错误重试也没用，直接放弃
+    process, calls = _flaky([ValueError("no answer")])
+    with pytest.raises(RetriesExhausted) as info:
+        retry.wrap(process)(0, {})
+    assert len(calls) == 1 and info.value.error_class == "parse"
+
+
+def test_retry_async():
+    retry = RetryPolicy(max_attempts=3, base_delay=0.001)
+    process, _ = _flaky([httpx.ConnectError("refused")])
+
+    async def process_async(idx, record):
+        return process(idx, record)
+
+    assert asyncio.run(retry.wrap_async(process_async)(0, {})) == 2
+
+
+def test_backoff_is_capped():
+    retry = RetryPolicy(base_delay=1.0, max_delay=4.0)
+    assert all(0 <= retry.delay(1) <= 1.0 for _ in range(100))
+    assert max(retry.delay(10) for _ in range(1000)) <= 4.0
+
+
+def test_dead_letter_round_trip(tmp_path):
+    path = dead_letter_path(str(tmp_path / "out" / "results.jsonl"))
+    assert path.endswith("results.failed.jsonl")
+    dead_letter = DeadLetter(path)
+    dead_letter.put(3, {"prompt": "a"}, RetriesExhausted(httpx.ConnectError("refused"), 5))
+    dead_letter.put((4, 1), {"prompt": "b"}, ValueError("no answer"))
+    dead_letter.put(3, {"prompt": "a"}, RetriesExhausted(httpx.ConnectError("refused"), 5))  # 续跑又失败一次
+    dead_letter.close()
+    assert dead_letter.count == 3 and dead_letter.errors == {"connection": 2, "parse": 1}
+
+    entries = [json.loads(line) for line in open(path, encoding="utf-8")]
+    assert entries[0]["attempts"] == 5 and entries[0]["error"] == "ConnectError: refused"
+    assert entries[1]["key"] == [4, 1] and entries[1]["attempts"] == 1
+    assert list(iter_dead_letter(path)) == [(3, {"prompt": "a"}), ((4, 1), {"prompt": "b"})]
+
+
+def test_take_dead_letter_survives_a_crash(tmp_path):
+    path = str(tmp_path / "results.failed.jsonl")
+    assert take_dead_letter(path) == []
+
+    dead_letter = DeadLetter(path)
+    dead_letter.put(1, {"prompt": "a"}, ValueError("x"))
+    dead_letter.put(2, {"prompt": "b"}, ValueError("x"))
+    dead_letter.close()
+    assert [key for key, _ in take_dead_letter(path)] == [1, 2]
+
+    # 重试到一半崩溃：.retrying 还在，新的失败写进了 path；下次两边合并
+    dead_letter = DeadLetter(path)
+    dead_letter.put(7, {"prompt": "c"}, ValueError("x"))
+    dead_letter.close()
+    assert [key for key, _ in take_dead_letter(path)] == [1, 2, 7]
+
+    finish_retry(path)
+    assert take_dead_letter(path) == []
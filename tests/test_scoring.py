@@ -0,0 +1,72 @@
+import pytest
+
+from src.collect.scoring import answers_match, extract_boxed, final_answer_ready, normalize_answer, summarize_pass_at_k
+
+
+@pytest.mark.parametrize("answer,expected", [
+    ("2m", "2m"),                        # m 是变量，不是单位
+    ("2 m", "2m"),
+    ("5 min", "5"),
+    ("5min", "5min"),
+    ("5\\text{ cm}", "5"),
+    ("5\\text{cm}", "5"),
+    ("12 \\text{cm}^2", "12"),
+    ("90^\\circ", "90"),
+    ("10 dollars", "10"),
+    ("1,000 meters", "1000"),
+    ("x = 3", "3"),
+    ("\\dfrac{1}{2}", "\\frac{1}{2}"),
+    ("\\frac12", "\\frac{1}{2}"),
+    ("\\left( 1, 2 \\right)", "(1,2)"),
+])
+def test_normalize_answer(answer, expected):
+    assert normalize_answer(answer) == expected
+
+
+def test_single_letter_is_not_a_unit():
+    assert not answers_match("2m", "2")
+    assert answers_match("2 meters", "2")
+    assert answers_match("5 min", "5 minutes")
+
+
+def test_extract_boxed():
+    assert extract_boxed("<think>\\boxed{1}</think>So \\boxed{\\frac{1}{2}}") == "\\frac{1}{2}"
+    assert extract_boxed("<think>draft \\boxed{7}</think>no box here") == "7"  # 退回整段回复
+    assert extract_boxed("\\boxed{3} then \\boxed{4") == "3"  # 没闭合的不算
+    assert extract_boxed("") == ""
+
+
+@pytest.mark.parametrize("predicted,reference,expected", [
+    ("0.5", "\\frac{1}{2}", True),
+    ("1/2", "0.5", True),
+    ("2\\frac{1}{2}", "5/2", True),
+    ("0.33333333", "\\frac{1}{3}", True),   # 非整数在 rel_tol 内相等
+    ("3", "4", False),
+    ("(1, 2)", "(1,2)", True),
+    ("(1, 2)", "(2, 1)", False),
+    ("\\{1, 2\\}", "\\{2, 1\\}", True),
+    ("x \\ge 1", "x\\geq 1", True),
+    ("", "", False),
+])
+def test_answers_match(predicted, reference, expected):
+    assert answers_match(predicted, reference) is expected
+
+
+def test_final_answer_ready():
+    assert final_answer_ready("so the answer is \\boxed{12}")
+    assert final_answer_ready("Answer: C\n")
+    assert not final_answer_ready("so the answer is \\boxed{\\frac{1}{")
+    assert not final_answer_ready("Answer: C")  # 行还没写完
+
+
+def test_pass_at_k_skips_prompts_with_fewer_samples(tmp_path):
+    def record(index, sample, reward):
+        return {"extra_info": {"index": index, "sample": sample}, "reward": reward}
+
+    records = [record(0, 0, 1.0), record(0, 1, 0.0), record(0, 2, 0.0), record(0, 3, 0.0),
+               record(1, 0, 0.0), record(1, 1, 0.0)]  # 1 号题只跑完了 2 个 sample
+    summary = summarize_pass_at_k(records, 4, str(tmp_path / "passk.jsonl"))
+    assert summary["prompts"] == 2
+    assert summary["pass@1"] == (pytest.approx((0.25 + 0.0) / 2), 2)
+    assert summary["pass@2"] == (pytest.approx((0.5 + 0.0) / 2), 2)
+    assert summary["pass@4"] == (1.0, 1)  # 不把 1 号题当成失败
@@ -0,0 +1,37 @@
+import asyncio
+import time
+
+import pytest
+
+from src.utils.vllm_backend import AsyncVLLMBackend, VLLMBackend
+
+
+@pytest.fixture
+def stalling_server(mock_server):
+    """Streams stop sending events halfway and keep the connection open"""
+    return mock_server("--latency_mean", "0.2", "--reasoning_tokens", "100", "--stall_rate", "1")
+
+
+def test_time_budget_cuts_stalled_stream(stalling_server):
+    backend = VLLMBackend("mock", stalling_server, time_budget={"low": 1.0}, max_retries=0)
+    started = time.monotonic()
+    generation = backend.generate("What is 1+1?", "low")
+    elapsed = time.monotonic() - started
+    backend.close()
+    assert generation.stop_reason == "time_budget"
+    assert generation.text.startswith("<think>") and len(generation.text) > len("<think></think>")
+    assert elapsed < 3.0
+
+
+def test_time_budget_cuts_stalled_stream_async(stalling_server):
+    async def run():
+        backend = AsyncVLLMBackend("mock", stalling_server, time_budget={"low": 1.0}, max_retries=0)
+        try:
+            return await backend.generate("What is 1+1?", "low")
+        finally:
+            await backend.close()
+
+    started = time.monotonic()
+    generation = asyncio.run(run())
+    assert generation.stop_reason == "time_budget"
+    assert time.monotonic() - started < 3.0
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from src.collect.checkpoint import checkpoint_path
+from src.collect.writer import ResultWriter, iter_output_records, list_shards, load_completed_indices
+
+
+def _records(start, stop):
+    return [{"extra_info": {"index": i}, "text": f"answer {i} " * 20} for i in range(start, stop)]
+
+
+def _write(path, records, **kwargs):
+    with ResultWriter(str(path), flush_records=7, **kwargs) as writer:
+        for record in records:
+            writer.put(record)
+
+
+def test_shard_rotation(tmp_path):
+    output = tmp_path / "out.jsonl"
+    _write(output, _records(0, 50), shard_size=1000)
+
+    shards = list_shards(str(output))
+    assert len(shards) > 2 and not output.exists()
+    assert [shard_id for shard_id, _, _ in shards] == list(range(len(shards)))
+    line_size = os.path.getsize(shards[0][1]) // len(list(iter_output_records(shards[0][1])))
+    for _, path, compression in shards:
+        assert compression == "none"
+        assert os.path.exists(checkpoint_path(path))
+        assert os.path.getsize(path) < 1000 + line_size  # 超过 shard_size 就换下一个分片
+    assert [r["extra_info"]["index"] for r in iter_output_records(str(output))] == list(range(50))
+
+    # 每次运行都从一个新分片开始
+    _write(output, _records(50, 60), shard_size=1000)
+    new_shards = list_shards(str(output))[len(shards):]
+    assert new_shards[0][0] == len(shards)
+    new_records = [r for _, path, _ in new_shards for r in iter_output_records(path)]
+    assert [r["extra_info"]["index"] for r in new_records] == list(range(50, 60))
+    assert load_completed_indices(str(output)) == set(range(60))
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_compressed_round_trip(tmp_path, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    output = tmp_path / "out.jsonl"
+    records = _records(0, 40)
+    _write(output, records, shard_size=2000, compression=compression)
+
+    shards = list_shards(str(output))
+    suffix = {"gzip": ".gz", "zstd": ".zst"}[compression]
+    assert len(shards) > 1 and all(path.endswith(suffix) and c == compression for _, path, c in shards)
+    assert list(iter_output_records(str(output))) == records
+    assert load_completed_indices(str(output)) == set(range(40))
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip", "zstd"])
+def test_unfinished_shard_is_repaired(tmp_path, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    output = tmp_path / "out.jsonl"
+    _write(output, _records(0, 30), compression=compression, shard_size=10 ** 9)
+    (_, path, _), = list_shards(str(output))
+
+    # 模拟写到一半崩溃：没有 .idx，文件尾部被截断
+    os.remove(checkpoint_path(path))
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 50)
+
+    completed = load_completed_indices(str(output))
+    assert completed and completed < set(range(30))
+    assert os.path.exists(checkpoint_path(path))
+    records = list(iter_output_records(str(output)))
+    assert [r["extra_info"]["index"] for r in records] == sorted(completed)